@@ -17,15 +17,16 @@ from directory_bootstrap.distros.base import (
 from directory_bootstrap.shared.commands import (
         COMMAND_CHROOT, COMMAND_MOUNT, COMMAND_TAR,
         COMMAND_UMOUNT, COMMAND_UNSHARE)
-from directory_bootstrap.shared.mount import try_unmounting
+from directory_bootstrap.shared.mount import mount, try_unmounting
 from directory_bootstrap.shared.resolv_conf import filter_copy_resolv_conf
 
 SUPPORTED_ARCHITECTURES = ('i686', 'x86_64')
 
+# NOTE: Tuples of source, file system type, options, target
 _NON_DISK_MOUNT_TASKS = (
-        ('devtmpfs', ['-t', 'devtmpfs'], 'dev'),
-        ('devpts', ['-t', 'devpts'], 'dev/pts'),  # for gpgme
-        ('proc', ['-t', 'proc'], 'proc'),  # for pacstrap mountpoint detection
+        ('devtmpfs', 'devtmpfs', None, 'dev'),
+        ('devpts', 'devpts', None, 'dev/pts'),  # for gpgme
+        ('proc', 'proc', None, 'proc'),  # for pacstrap mountpoint detection
         )
 
 
@@ -195,47 +196,40 @@ class ArchBootstrapper(DirectoryBootstrapper):
         self._executor.check_call(cmd, env=env)
 
     def _mount_disk_chroot_mounts(self, abs_pacstrap_target_dir):
-        self._executor.check_call([
-                COMMAND_MOUNT,
-                '-o', 'bind',
-                self._abs_target_dir,
-                abs_pacstrap_target_dir,
-                ])
+        mount(self._messenger, self._executor,
+                self._abs_target_dir, abs_pacstrap_target_dir, bind=True)
 
     def _mount_nondisk_chroot_mounts(self, abs_pacstrap_inner_root):
         self._messenger.info('Mounting non-disk file systems...')
-        for source, options, target in _NON_DISK_MOUNT_TASKS:
-            self._executor.check_call([
-                    COMMAND_MOUNT,
-                    source,
-                    ] \
-                    + options \
-                    + [
-                        os.path.join(abs_pacstrap_inner_root, target),
-                    ])
+        for source, fs_type, options, target in _NON_DISK_MOUNT_TASKS:
+            mount(self._messenger, self._executor, source,
+                    os.path.join(abs_pacstrap_inner_root, target),
+                    fs_type=fs_type, options=options)
 
     def _unmount_disk_chroot_mounts(self, abs_pacstrap_target_dir):
-        try_unmounting(self._executor, abs_pacstrap_target_dir)
+        try_unmounting(self._messenger, self._executor, abs_pacstrap_target_dir)
 
     def _unmount_nondisk_chroot_mounts(self, abs_pacstrap_inner_root):
         self._messenger.info('Unmounting non-disk file systems...')
-        for source, options, target in reversed(_NON_DISK_MOUNT_TASKS):
+        for source, fs_type, options, target in reversed(_NON_DISK_MOUNT_TASKS):
             abs_path = os.path.join(abs_pacstrap_inner_root, target)
-            try_unmounting(self._executor, abs_path)
+            try_unmounting(self._messenger, self._executor, abs_path)
+
+    def _prefetch(self):
+        if self._image_date_triple_or_none is None:
+            image_listing_html = self._get_image_listing()
+            image_yyyy_mm_dd = self.extract_latest_date(image_listing_html, _image_date_matcher)
+        else:
+            image_yyyy_mm_dd = '%04s.%02d.%02d' % self._image_date_triple_or_none
+
+        return self._download_image(image_yyyy_mm_dd)
 
     def run(self):
         self.ensure_directories_writable()
+        image_filename = self.prefetch()
 
         abs_temp_dir = os.path.abspath(tempfile.mkdtemp())
         try:
-            if self._image_date_triple_or_none is None:
-                image_listing_html = self._get_image_listing()
-                image_yyyy_mm_dd = self.extract_latest_date(image_listing_html, _image_date_matcher)
-            else:
-                image_yyyy_mm_dd = '%04s.%02d.%02d' % self._image_date_triple_or_none
-
-            image_filename = self._download_image(image_yyyy_mm_dd)
-
             abs_pacstrap_inner_root = self._extract_image(image_filename, abs_temp_dir)
             self._adjust_pacman_mirror_list(abs_pacstrap_inner_root)
             self._copy_etc_resolv_conf(abs_pacstrap_inner_root)
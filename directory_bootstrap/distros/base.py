@@ -48,6 +48,10 @@ class DirectoryBootstrapper(object, metaclass=ABCMeta):
         self._executor = executor
         self._abs_target_dir = abs_target_dir
         self._abs_cache_dir = abs_cache_dir
+        self._prefetched = None
+
+    def set_target_dir(self, abs_target_dir):
+        self._abs_target_dir = abs_target_dir
 
     @abstractmethod
     def wants_to_be_unshared(self):
@@ -82,6 +86,20 @@ class DirectoryBootstrapper(object, metaclass=ABCMeta):
 
         return sorted(dates)[-1]
 
+    def prefetch(self):
+        """
+        Download and verify whatever can be prepared without touching
+        the target directory, e.g. while the target is still being set up.
+        Only does the work once; run calls it, too.
+        """
+        if self._prefetched is None:
+            self._ensure_directory_writable(self._abs_cache_dir, 0o755)
+            self._prefetched = self._prefetch()
+        return self._prefetched
+
+    def _prefetch(self):
+        return ()
+
     @abstractmethod
     def run(self):
         pass
@@ -331,9 +331,7 @@ class GentooBootstrapper(DirectoryBootstrapper):
         if not os.path.exists(output_filename):
             raise OSError(errno.ENOENT, 'File "%s" does not exists' % output_filename)
 
-    def run(self):
-        self.ensure_directories_writable()
-
+    def _prefetch(self):
         abs_temp_dir = os.path.abspath(tempfile.mkdtemp())
         try:
             abs_gpg_home_dir = self._initialize_gpg_home(abs_temp_dir)
@@ -380,14 +378,20 @@ class GentooBootstrapper(DirectoryBootstrapper):
             snapshot_tarball_uncompressed = self.uncompress_xz_tarball(snapshot_tarball)
             self._verify_md5_sum(snapshot_tarball_uncompressed, snapshot_uncompressed_md5sum)
 
-            self._extract_tarball(stage3_tarball, self._abs_target_dir)
-            abs_var_db_repos = os.path.join(self._abs_target_dir, 'var', 'db', 'repos')
-            self._extract_tarball(snapshot_tarball_uncompressed, abs_var_db_repos)
-            os.rename(os.path.join(abs_var_db_repos, 'portage'), os.path.join(abs_var_db_repos, 'gentoo'))
+            return stage3_tarball, snapshot_tarball_uncompressed
         finally:
             self._messenger.info('Cleaning up "%s"...' % abs_temp_dir)
             shutil.rmtree(abs_temp_dir)
 
+    def run(self):
+        self.ensure_directories_writable()
+        stage3_tarball, snapshot_tarball_uncompressed = self.prefetch()
+
+        self._extract_tarball(stage3_tarball, self._abs_target_dir)
+        abs_var_db_repos = os.path.join(self._abs_target_dir, 'var', 'db', 'repos')
+        self._extract_tarball(snapshot_tarball_uncompressed, abs_var_db_repos)
+        os.rename(os.path.join(abs_var_db_repos, 'portage'), os.path.join(abs_var_db_repos, 'gentoo'))
+
     @classmethod
     def add_arguments_to(clazz, distro):
         distro.add_argument('--arch', dest='architecture', default='amd64',
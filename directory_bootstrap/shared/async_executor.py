@@ -0,0 +1,124 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import asyncio
+import subprocess
+import time
+
+from directory_bootstrap.shared.executor import Executor
+
+_READ_SIZE_BYTES = 64 * 1024
+_DEFAULT_TAIL_SIZE_BYTES = 4 * 1024
+_TERMINATE_TIMEOUT_SECONDS = 5.0
+
+
+class CommandResult(object):
+    """
+    What is left of a command that ran to completion
+    """
+    def __init__(self, argv, returncode, duration_seconds,
+            stdout_tail, stderr_tail, output=None):
+        self.argv = argv
+        self.returncode = returncode
+        self.duration_seconds = duration_seconds
+        self.stdout_tail = stdout_tail
+        self.stderr_tail = stderr_tail
+        self.output = output  # i.e. all of stdout if captured, None otherwise
+
+    def __repr__(self):
+        return 'CommandResult(%r, returncode=%d, duration_seconds=%.3f)' % (
+                self.argv, self.returncode, self.duration_seconds)
+
+
+def _write_through(target, data):
+    buffer = getattr(target, 'buffer', None)
+    if buffer is None:
+        target.write(data.decode('utf-8', errors='replace'))
+        target.flush()
+    else:
+        buffer.write(data)
+        buffer.flush()
+
+
+async def _pump(stream, target, tail_size_bytes, capture):
+    """
+    Forward everything from stream to target (if any),
+    returning the tail (and all of it, if capture is true)
+    """
+    tail = bytearray()
+    captured = bytearray() if capture else None
+    while True:
+        chunk = await stream.read(_READ_SIZE_BYTES)
+        if not chunk:
+            break
+        if captured is not None:
+            captured += chunk
+        elif target is not None:
+            _write_through(target, chunk)
+        tail += chunk
+        del tail[:-tail_size_bytes]
+    return bytes(tail), (None if captured is None else bytes(captured))
+
+
+class AsyncExecutor(Executor):
+    """
+    An executor that can also run commands concurrently, using asyncio.
+
+    Commands are announced, have their environment sanitized and
+    fail with subprocess.CalledProcessError just like with Executor.
+    Cancelling the awaiting task terminates (and if need be kills)
+    the command.
+    """
+    def __init__(self, messenger, stdout=None, stderr=None,
+            tail_size_bytes=_DEFAULT_TAIL_SIZE_BYTES):
+        super(AsyncExecutor, self).__init__(messenger, stdout=stdout, stderr=stderr)
+        self._tail_size_bytes = tail_size_bytes
+
+    async def _run(self, argv, env, cwd, capture):
+        self._messenger.announce_command(argv)
+        before = time.monotonic()
+        process = await asyncio.create_subprocess_exec(*argv,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=self._without_pythonpath(env),
+                cwd=cwd,
+                )
+        try:
+            (stdout_tail, output), (stderr_tail, _) = await asyncio.gather(
+                    _pump(process.stdout, self._default_stdout, self._tail_size_bytes, capture),
+                    _pump(process.stderr, self._default_stderr, self._tail_size_bytes, False),
+                    )
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            await self._terminate(process)
+            raise
+
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, argv,
+                    output=stdout_tail if output is None else output,
+                    stderr=stderr_tail)
+
+        return CommandResult(argv, returncode, time.monotonic() - before,
+                stdout_tail, stderr_tail, output)
+
+    @staticmethod
+    async def _terminate(process):
+        if process.returncode is not None:
+            return
+
+        try:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), _TERMINATE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        except ProcessLookupError:
+            pass  # i.e. already gone
+
+    async def check_call_async(self, argv, env=None, cwd=None):
+        return await self._run(argv, env, cwd, capture=False)
+
+    async def check_output_async(self, argv, env=None, cwd=None):
+        return await self._run(argv, env, cwd, capture=True)
@@ -0,0 +1,129 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+import shlex
+import socket
+import subprocess
+
+from directory_bootstrap.shared.commands import COMMAND_CHROOT
+
+_ABS_SHELL = '/bin/sh'
+
+_RECV_SIZE_BYTES = 64 * 1024
+
+
+class ChrootSession(object):
+    """
+    A single long-lived shell inside a chroot that runs one command after
+    another, so that many small commands do not each pay for
+    spawning chroot (and a shell) anew.
+
+    Commands are fed to the shell through a socket that is its standard input.
+    The shell reports back through the very same socket: output to capture
+    (if any) followed by a line with a random marker and the exit code.
+    Standard output and error of commands go where those of the executor go.
+    """
+    def __init__(self, messenger, executor, abs_root, env=None):
+        self._messenger = messenger
+        self._executor = executor
+        self._abs_root = abs_root
+        self._env = env
+        self._marker = os.urandom(16).hex().encode('ascii')
+        self._socket = None
+        self._process = None
+        self._buffer = b''
+
+    def _create_shell_argv(self):
+        return [COMMAND_CHROOT, self._abs_root, _ABS_SHELL]
+
+    def _get_announce_argv(self, argv):
+        return [COMMAND_CHROOT, self._abs_root] + list(argv)
+
+    def start(self):
+        our_socket, their_socket = socket.socketpair()
+        try:
+            self._process = self._executor.popen(self._create_shell_argv(),
+                    env=self._env, stdin=their_socket)
+        except BaseException:
+            our_socket.close()
+            raise
+        finally:
+            their_socket.close()
+        self._socket = our_socket
+
+    def close(self):
+        if self._process is None:
+            return
+
+        try:
+            self._socket.shutdown(socket.SHUT_WR)  # i.e. end of input
+        except OSError:
+            pass  # i.e. the shell is gone already
+        self._socket.close()
+        self._socket = None
+
+        returncode = self._process.wait()
+        self._process = None
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, self._create_shell_argv())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+
+        try:
+            self.close()
+        except subprocess.CalledProcessError:
+            pass  # i.e. do not hide the original exception
+
+    def _read_until_marker(self):
+        prefix = b'\n' + self._marker + b' '
+        while True:
+            start = self._buffer.find(prefix)
+            if start != -1:
+                end = self._buffer.find(b'\n', start + len(prefix))
+                if end != -1:
+                    output = self._buffer[:start]
+                    returncode = int(self._buffer[start + len(prefix):end])
+                    self._buffer = self._buffer[end + 1:]
+                    return returncode, output
+
+            chunk = self._socket.recv(_RECV_SIZE_BYTES)
+            if not chunk:
+                raise subprocess.CalledProcessError(self._process.wait(),
+                        self._create_shell_argv(), self._buffer)
+            self._buffer += chunk
+
+    def _run(self, argv, capture):
+        if self._process is None:
+            raise ValueError('Session has not been started')
+
+        self._messenger.announce_command(self._get_announce_argv(argv))
+
+        # NOTE: Redirecting standard input makes sure that commands
+        #       cannot eat subsequent commands off the socket; output to capture
+        #       needs redirecting before, while fd 0 is still the socket
+        line = '%s%s </dev/null; printf \'\\n%%s %%d\\n\' %s "$?" >&0\n' % (
+                ' '.join(shlex.quote(arg) for arg in argv),
+                ' >&0' if capture else '',
+                self._marker.decode('ascii'),
+                )
+        self._socket.sendall(line.encode('utf-8'))
+
+        returncode, output = self._read_until_marker()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode,
+                    self._get_announce_argv(argv), output)
+        return output
+
+    def check_call(self, argv):
+        self._run(argv, capture=False)
+
+    def check_output(self, argv):
+        return self._run(argv, capture=True)
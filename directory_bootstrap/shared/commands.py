@@ -4,7 +4,9 @@
 import errno
 import os
 import subprocess
-import time
+
+from directory_bootstrap.shared.waiting import (
+        DEFAULT_TIMEOUT_SECONDS, wait_until)
 
 COMMAND_BLKID = 'blkid'
 COMMAND_BLOCKDEV = 'blockdev'
@@ -12,19 +14,24 @@ COMMAND_CHMOD = 'chmod'
 COMMAND_CHROOT = 'chroot'
 COMMAND_CP = 'cp'
 COMMAND_DB_DUMP = 'db_dump'
+COMMAND_E2FSCK = 'e2fsck'
 COMMAND_EXTLINUX = 'extlinux'
 COMMAND_FILE = 'file'
 COMMAND_FIND = 'find'
+COMMAND_FSTRIM = 'fstrim'
 COMMAND_GPG = 'gpg'
 COMMAND_INSTALL_MBR = 'install-mbr'
 COMMAND_KPARTX = 'kpartx'
+COMMAND_LOSETUP = 'losetup'
 COMMAND_LSB_RELEASE = 'lsb_release'
 COMMAND_MD5SUM = 'md5sum'
 COMMAND_MKDIR = 'mkdir'
+COMMAND_MKFS_BTRFS = 'mkfs.btrfs'
 COMMAND_MKFS_EXT4 = 'mkfs.ext4'
+COMMAND_MKSQUASHFS = 'mksquashfs'
 COMMAND_MOUNT = 'mount'
-COMMAND_PARTED = 'parted'
-COMMAND_PARTPROBE = 'partprobe'
+COMMAND_QEMU_IMG = 'qemu-img'
+COMMAND_RESIZE2FS = 'resize2fs'
 COMMAND_RM = 'rm'
 COMMAND_RMDIR = 'rmdir'
 COMMAND_RPM = 'rpm'
@@ -37,22 +44,31 @@ COMMAND_UNAME = 'uname'
 COMMAND_UNSHARE = 'unshare'
 COMMAND_UNXZ = 'unxz'
 COMMAND_WGET = 'wget'
+COMMAND_XZ = 'xz'
 COMMAND_YUM = 'yum'
+COMMAND_ZSTD = 'zstd'
 
 
 EXIT_COMMAND_NOT_FOUND = 127
 
+# NOTE: Each attempt runs (and announces) a command, so not too often
+_RETRY_DELAY_SECONDS = 1.0
+
 
-def check_call__keep_trying(executor, cmd):
-	for i in range(3):
+def check_call__keep_trying(executor, cmd, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+	"""
+	Return True once the command succeeds, False if it keeps failing.
+	"""
+	def attempt():
 		try:
 			executor.check_call(cmd)
 		except subprocess.CalledProcessError as e:
 			if e.returncode == EXIT_COMMAND_NOT_FOUND:
 				raise
-			time.sleep(1)
-		else:
-			break
+			return False
+		return True
+
+	return wait_until(attempt, timeout_seconds, min_delay_seconds=_RETRY_DELAY_SECONDS)
 
 
 def find_command(command):
@@ -107,10 +107,11 @@ class Executor(object):
         self._default_stdout = stdout or sys.stdout
         self._default_stderr = stderr or sys.stderr
 
-    def check_call(self, argv, env=None, cwd=None):
+    def check_call(self, argv, env=None, cwd=None, stdin=None, stdout=None):
         self._messenger.announce_command(argv)
         subprocess.check_call(argv,
-                stdout=self._default_stdout,
+                stdin=stdin,
+                stdout=stdout or self._default_stdout,
                 stderr=self._default_stderr,
                 env=self._without_pythonpath(env),
                 cwd=cwd,
@@ -120,6 +121,15 @@ class Executor(object):
         self._messenger.announce_command(argv)
         return subprocess.check_output(argv, stderr=self._default_stderr)
 
+    def popen(self, argv, env=None, stdin=None):
+        self._messenger.announce_command(argv)
+        return subprocess.Popen(argv,
+                stdin=stdin,
+                stdout=self._default_stdout,
+                stderr=self._default_stderr,
+                env=self._without_pythonpath(env),
+                )
+
     def _without_pythonpath(self, env):
         if env is None:
             env = os.environ
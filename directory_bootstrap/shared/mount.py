@@ -1,13 +1,136 @@
 # Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under AGPL v3 or later
 
+import errno
+import os
+from ctypes import CDLL, c_char_p, c_int, c_ulong, get_errno
+
 from directory_bootstrap.shared.commands import (
-        COMMAND_UMOUNT, check_call__keep_trying)
+        COMMAND_MOUNT, COMMAND_UMOUNT, check_call__keep_trying)
+from directory_bootstrap.shared.waiting import (
+        DEFAULT_TIMEOUT_SECONDS, wait_until)
+
+# NOTE: From <sys/mount.h>
+_MS_BIND = 0x1000
+_MNT_DETACH = 0x2
+
+
+def _load_lib_c():
+    try:
+        lib_c = CDLL("libc.so.6", use_errno=True)
+        lib_c.mount, lib_c.umount2
+    except (AttributeError, OSError):  # i.e. no glibc, use commands instead
+        return None
+    return lib_c
+
+
+_lib_c = _load_lib_c()
+
+
+def _encode(text_or_none):
+    return None if text_or_none is None else text_or_none.encode('utf-8')
+
+
+def _mount(source, abs_target, fs_type, options, flags):
+    ret = _lib_c.mount(c_char_p(_encode(source)), c_char_p(_encode(abs_target)),
+            c_char_p(_encode(fs_type)), c_ulong(flags), c_char_p(_encode(options)))
+    if ret:
+        _errno = get_errno() or errno.EPERM
+        raise OSError(_errno, 'Mounting "%s" at "%s" failed: %s'
+                % (source, abs_target, os.strerror(_errno)))
+
+
+def _umount2(abs_path, flags):
+    ret = _lib_c.umount2(c_char_p(_encode(abs_path)), c_int(flags))
+    if ret:
+        _errno = get_errno() or errno.EPERM
+        raise OSError(_errno, 'Unmounting "%s" failed: %s'
+                % (abs_path, os.strerror(_errno)))
+
+
+def _call_or_run(messenger, executor, argv, func, *args):
+    """
+    Call func (wrapping a system call) or run the equivalent command
+    if the system call is not available
+    """
+    if _lib_c is not None:
+        messenger.announce_command(argv)
+        try:
+            func(*args)
+            return
+        except OSError as e:
+            if e.errno != errno.ENOSYS:
+                raise
+
+    executor.check_call(argv)
+
+
+def create_mount_argv(source, abs_target, fs_type=None, options=None, bind=False):
+    """
+    The command equivalent to a call to mount(...)
+
+    >>> create_mount_argv('tmpfs', '/mnt/dev/shm', 'tmpfs', 'mode=1777')
+    ['mount', 'tmpfs', '-t', 'tmpfs', '-o', 'mode=1777', '/mnt/dev/shm']
+    >>> create_mount_argv('/var/tmp/root', '/mnt', bind=True)
+    ['mount', '-o', 'bind', '/var/tmp/root', '/mnt']
+    """
+    argv = [COMMAND_MOUNT]
+    if bind:
+        argv += ['-o', 'bind']
+    argv.append(source)
+    if fs_type is not None:
+        argv += ['-t', fs_type]
+    if options is not None:
+        argv += ['-o', options]
+    argv.append(abs_target)
+    return argv
+
+
+def mount(messenger, executor, source, abs_target, fs_type=None, options=None, bind=False):
+    """
+    Mount using mount(2) directly, rather than running command "mount",
+    unless the system call is not available.
+    """
+    argv = create_mount_argv(source, abs_target, fs_type, options, bind)
+    _call_or_run(messenger, executor, argv,
+            _mount, source, abs_target, fs_type, options, _MS_BIND if bind else 0)
+
+
+def detach(messenger, executor, abs_path):
+    """
+    Detach a mount together with all mounts below it in one go
+    (i.e. a lazy unmount).  Once no longer in use, they are gone for real.
+    """
+    argv = [COMMAND_UMOUNT, '--lazy', abs_path]
+    _call_or_run(messenger, executor, argv, _umount2, abs_path, _MNT_DETACH)
+
+
+def try_unmounting(messenger, executor, abs_path, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+    """
+    Unmount using umount2(2) directly (or command "umount" if need be),
+    re-trying for as long as the mount is busy.  Gives up with a warning
+    rather than an exception, so that clean-up can go on.
+    """
+    argv = [COMMAND_UMOUNT, abs_path]
+
+    if _lib_c is None:
+        if not check_call__keep_trying(executor, argv, timeout_seconds):
+            messenger.warn('Unmounting "%s" failed, giving up.' % abs_path)
+        return
+
+    messenger.announce_command(argv)
+    errors = []
+
+    def attempt():
+        try:
+            _umount2(abs_path, 0)
+        except OSError as e:
+            errors[:] = [e]
+            return e.errno != errno.EBUSY  # i.e. no use re-trying otherwise
+        del errors[:]
+        return True
 
+    wait_until(attempt, timeout_seconds)
 
-def try_unmounting(executor, abs_path):
-    cmd = [
-            COMMAND_UMOUNT,
-            abs_path,
-            ]
-    check_call__keep_trying(executor, cmd)
+    if errors:
+        messenger.warn(errors[0].strerror)
@@ -3,20 +3,158 @@
 
 import errno
 import os
+import select
+import signal
+import sys
 from ctypes import CDLL, c_char_p, c_int, cast, get_errno
 
+from directory_bootstrap.shared.waiting import wait_until
+
 _CLONE_NEWNS = 0x00020000
 _CLONE_NEWUTS = 0x04000000
+_CLONE_NEWPID = 0x20000000
+
+_KILL_REQUEST = b'k'
 
 _lib_c = CDLL("libc.so.6", use_errno=True)
 
 
-def unshare_current_process(messenger):
-    messenger.info('Unsharing Linux namespaces (mount, UTS/hostname)...')
-    ret = _lib_c.unshare(c_int(_CLONE_NEWNS | _CLONE_NEWUTS))
+def _unshare(flags, what):
+    ret = _lib_c.unshare(c_int(flags))
     if ret:
         _errno = get_errno() or errno.EPERM
-        raise OSError(_errno, 'Unsharing Linux namespaces failed: ' + os.strerror(_errno))
+        raise OSError(_errno, 'Unsharing Linux %s failed: %s' % (what, os.strerror(_errno)))
+
+
+def _reap_children():
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+
+
+def _kill_all_but_self():
+    # NOTE: For the init process of a PID namespace, kill(-1, ...) is
+    #       about all other processes of that namespace (and below), only
+    def none_left():
+        try:
+            os.kill(-1, signal.SIGKILL)
+        except ProcessLookupError:
+            return True
+        _reap_children()
+        return False
+
+    wait_until(none_left)
+
+
+def _run_reaper(request_fd, response_fd):
+    """
+    Main loop of the init process of the PID namespace:
+    reap orphans, kill everything on request and once the builder is gone
+    """
+    for signum in (signal.SIGINT, signal.SIGQUIT):
+        signal.signal(signum, signal.SIG_IGN)  # i.e. leave Ctrl+C to the builder
+
+    wakeup_read_fd, wakeup_write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup_write_fd)
+
+    while True:
+        _reap_children()
+
+        readable, _, _ = select.select([request_fd, wakeup_read_fd], [], [])
+        if wakeup_read_fd in readable:
+            try:
+                os.read(wakeup_read_fd, 1024)  # i.e. drain
+            except BlockingIOError:
+                pass
+
+        if request_fd in readable:
+            request = os.read(request_fd, 1)
+            _kill_all_but_self()
+            if not request:
+                return  # i.e. the builder has exited
+            os.write(response_fd, request)
+
+
+class PidNamespace(object):
+    """
+    A PID namespace that all child processes to come end up in.
+    Its init process reaps orphans and kills what is left over on request,
+    e.g. daemons started in a chroot that would keep mounts busy.
+    """
+    def __init__(self, reaper_pid, request_fd, response_fd):
+        self._reaper_pid = reaper_pid
+        self._request_fd = request_fd
+        self._response_fd = response_fd
+
+    def kill_all_processes(self):
+        """
+        Kill all processes of the namespace (but the reaper),
+        returning once they are gone
+        """
+        os.write(self._request_fd, _KILL_REQUEST)
+        if os.read(self._response_fd, 1) != _KILL_REQUEST:
+            raise OSError(errno.ESRCH, 'Reaper of PID namespace has gone away')
+
+    def close(self):
+        """
+        Kill all processes of the namespace including the reaper.
+        No child processes can be started after (fork fails with ENOMEM,
+        for good), so the calling process should be about to exit.
+        """
+        os.close(self._request_fd)  # i.e. end of requests
+        os.waitpid(self._reaper_pid, 0)
+        os.close(self._response_fd)
+
+
+def _create_pid_namespace():
+    _unshare(_CLONE_NEWPID, 'PID namespace')
+
+    # NOTE: The caller stays outside, the first child becomes PID 1
+    request_read_fd, request_write_fd = os.pipe()
+    response_read_fd, response_write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(request_write_fd)
+            os.close(response_read_fd)
+            _run_reaper(request_read_fd, response_write_fd)
+        finally:
+            os._exit(0)
+
+    os.close(request_read_fd)
+    os.close(response_write_fd)
+    return PidNamespace(pid, request_write_fd, response_read_fd)
+
+
+def unshare_current_process(messenger, pid_namespace=False):
+    """
+    Unshare mount and UTS namespaces and (if requested and possible)
+    put all child processes to come into a PID namespace of their own.
+
+    Returns the PidNamespace or None.
+
+    NOTE: Unsharing cannot be undone, so this should be called
+          in a (child) process dedicated to a single build only.
+    """
+    messenger.info('Unsharing Linux namespaces (mount, UTS/hostname)...')
+    _unshare(_CLONE_NEWNS | _CLONE_NEWUTS, 'namespaces')
+
+    if not pid_namespace:
+        return None
+
+    messenger.info('Unsharing Linux PID namespace...')
+    try:
+        return _create_pid_namespace()
+    except OSError as e:
+        messenger.warn('%s, continuing without.' % e.strerror)
+        return None
 
 
 def set_hostname(hostname):
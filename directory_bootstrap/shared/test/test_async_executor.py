@@ -0,0 +1,67 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import asyncio
+import os
+import subprocess
+import time
+from unittest import TestCase
+
+from directory_bootstrap.shared.async_executor import AsyncExecutor
+from directory_bootstrap.shared.messenger import VERBOSITY_QUIET, Messenger
+
+
+class TestAsyncExecutor(TestCase):
+    def setUp(self):
+        messenger = Messenger(VERBOSITY_QUIET, colorize=False)
+        self._devnull = open(os.devnull, 'w')
+        self._executor = AsyncExecutor(messenger, stdout=self._devnull,
+                stderr=self._devnull, tail_size_bytes=4)
+
+    def tearDown(self):
+        self._devnull.close()
+
+    def test_concurrent_commands(self):
+        async def run_both():
+            return await asyncio.gather(
+                    self._executor.check_call_async(['sleep', '0.3']),
+                    self._executor.check_call_async(['sleep', '0.3']),
+                    )
+
+        before = time.monotonic()
+        results = asyncio.run(run_both())
+        self.assertLess(time.monotonic() - before, 0.55)
+        self.assertEqual([result.returncode for result in results], [0, 0])
+        self.assertGreaterEqual(results[0].duration_seconds, 0.3)
+
+    def test_output_and_tails(self):
+        result = asyncio.run(self._executor.check_output_async(
+                ['sh', '-c', 'echo 123456789; echo abcdef >&2']))
+        self.assertEqual(result.output, b'123456789\n')
+        self.assertEqual(result.stdout_tail, b'789\n')
+        self.assertEqual(result.stderr_tail, b'def\n')
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            asyncio.run(self._executor.check_call_async(
+                    ['sh', '-c', 'echo oops >&2; exit 3']))
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertEqual(context.exception.stderr, b'ops\n')
+
+    def test_pythonpath_removed(self):
+        result = asyncio.run(self._executor.check_output_async(
+                ['sh', '-c', 'echo "${PYTHONPATH-unset}"'],
+                env={'PATH': os.environ['PATH'], 'PYTHONPATH': '/tmp'}))
+        self.assertEqual(result.output, b'unset\n')
+
+    def test_cancellation_terminates(self):
+        async def run_and_cancel():
+            task = asyncio.ensure_future(self._executor.check_call_async(['sleep', '10']))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        before = time.monotonic()
+        asyncio.run(run_and_cancel())
+        self.assertLess(time.monotonic() - before, 3)
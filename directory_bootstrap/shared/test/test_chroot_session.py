@@ -0,0 +1,58 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+import subprocess
+from unittest import TestCase
+
+from directory_bootstrap.shared.chroot_session import ChrootSession
+from directory_bootstrap.shared.executor import Executor
+from directory_bootstrap.shared.messenger import VERBOSITY_QUIET, Messenger
+
+
+class _ShellSession(ChrootSession):
+    """
+    A session with no chroot involved, so that tests can run unprivileged
+    """
+    def _create_shell_argv(self):
+        return ['/bin/sh']
+
+
+class TestChrootSession(TestCase):
+    def setUp(self):
+        messenger = Messenger(VERBOSITY_QUIET, colorize=False)
+        self._devnull = open(os.devnull, 'w')
+        executor = Executor(messenger, stdout=self._devnull, stderr=self._devnull)
+        self._session = _ShellSession(messenger, executor, '/', env={'PATH': os.environ['PATH']})
+
+    def tearDown(self):
+        self._devnull.close()
+
+    def test_output_and_exit_codes(self):
+        with self._session as session:
+            self.assertEqual(session.check_output(['printf', '%s', "it's\n$HOME"]),
+                    b"it's\n$HOME")
+            self.assertEqual(session.check_output(['true']), b'')
+            session.check_call(['echo', 'not captured'])
+
+            with self.assertRaises(subprocess.CalledProcessError) as context:
+                session.check_call(['sh', '-c', 'exit 3'])
+            self.assertEqual(context.exception.returncode, 3)
+
+            # i.e. the session survives failing commands
+            self.assertEqual(session.check_output(['echo', 'still here']), b'still here\n')
+
+    def test_commands_cannot_read_further_commands(self):
+        with self._session as session:
+            self.assertEqual(session.check_output(['cat']), b'')
+            self.assertEqual(session.check_output(['echo', 'next']), b'next\n')
+
+    def test_environment(self):
+        with self._session as session:
+            self.assertEqual(session.check_output(['sh', '-c', 'echo "${HOME-unset}"']),
+                    b'unset\n')
+
+    def test_shell_dying(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            with self._session as session:
+                session.check_call(['exit', '7'])
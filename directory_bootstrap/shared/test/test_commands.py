@@ -0,0 +1,21 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import subprocess
+from unittest import TestCase
+from unittest.mock import Mock
+
+from directory_bootstrap.shared.commands import check_call__keep_trying
+
+
+class TestCheckCallKeepTrying(TestCase):
+    def test_success(self):
+        executor = Mock()
+        self.assertTrue(check_call__keep_trying(executor, ['true']))
+        self.assertEqual(executor.check_call.call_count, 1)
+
+    def test_few_attempts_until_giving_up(self):
+        executor = Mock()
+        executor.check_call.side_effect = subprocess.CalledProcessError(1, ['false'])
+        self.assertFalse(check_call__keep_trying(executor, ['false'], timeout_seconds=1.5))
+        self.assertEqual(executor.check_call.call_count, 3)  # i.e. at 0, 1 and 1.5 seconds
@@ -0,0 +1,42 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import errno
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipUnless
+from unittest.mock import Mock, patch
+
+import directory_bootstrap.shared.mount as mount_module
+from directory_bootstrap.shared.mount import mount, try_unmounting
+
+
+class TestMount(TestCase):
+    def test_fallback_to_commands(self):
+        messenger = Mock()
+        executor = Mock()
+        with patch.object(mount_module, '_lib_c', None):
+            mount(messenger, executor, 'proc', '/mnt/proc', fs_type='proc')
+            try_unmounting(messenger, executor, '/mnt/proc', timeout_seconds=0)
+
+        self.assertEqual([c[0][0] for c in executor.check_call.call_args_list], [
+                ['mount', 'proc', '-t', 'proc', '/mnt/proc'],
+                ['umount', '/mnt/proc'],
+                ])
+
+    @skipUnless(mount_module._lib_c is not None, 'glibc needed')
+    def test_errors(self):
+        messenger = Mock()
+        executor = Mock()
+        with TemporaryDirectory() as abs_dir:
+            abs_missing = os.path.join(abs_dir, 'missing')
+            with self.assertRaises(OSError) as context:
+                mount(messenger, executor, 'tmpfs', abs_missing, fs_type='tmpfs')
+            self.assertIn(context.exception.errno, (errno.ENOENT, errno.EPERM))
+            self.assertIn('"%s"' % abs_missing, context.exception.strerror)
+
+            # i.e. no exception and no waiting for the timeout
+            try_unmounting(messenger, executor, abs_dir, timeout_seconds=60)
+            self.assertEqual(messenger.warn.call_count, 1)
+
+        executor.check_call.assert_not_called()
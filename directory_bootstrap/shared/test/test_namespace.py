@@ -0,0 +1,51 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import subprocess
+import sys
+from textwrap import dedent
+from unittest import TestCase
+
+_EXIT_SKIP = 77
+
+# NOTE: Run in a process of its own since unsharing cannot be undone
+_SCRIPT = dedent("""\
+        import os, select, subprocess, sys
+
+        from directory_bootstrap.shared.messenger import VERBOSITY_QUIET, Messenger
+        from directory_bootstrap.shared.namespace import unshare_current_process
+
+        try:
+            pid_namespace = unshare_current_process(
+                    Messenger(VERBOSITY_QUIET, colorize=False), pid_namespace=True)
+        except OSError:
+            pid_namespace = None
+        if pid_namespace is None:
+            sys.exit(%(exit_skip)d)
+
+        # A daemon keeping a pipe open, orphaned as soon as the shell exits
+        read_fd, write_fd = os.pipe()
+        subprocess.check_call(['sh', '-c', 'sleep 60 &'], pass_fds=[write_fd])
+        os.close(write_fd)
+
+        readable, _, _ = select.select([read_fd], [], [], 0.1)
+        assert not readable, 'daemon died early'
+
+        pid_namespace.kill_all_processes()
+        readable, _, _ = select.select([read_fd], [], [], 5)
+        assert readable and os.read(read_fd, 1) == b'', 'daemon survived'
+
+        # i.e. child processes still work after killing
+        subprocess.check_call(['true'])
+
+        pid_namespace.close()
+        """ % {'exit_skip': _EXIT_SKIP})
+
+
+class TestPidNamespace(TestCase):
+    def test_stray_processes_killed(self):
+        process = subprocess.run([sys.executable, '-c', _SCRIPT],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        if process.returncode == _EXIT_SKIP:
+            self.skipTest('Unsharing namespaces not permitted')
+        self.assertEqual(process.returncode, 0, process.stdout.decode('utf-8', 'replace'))
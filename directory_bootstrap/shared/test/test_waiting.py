@@ -0,0 +1,31 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+import threading
+import time
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from directory_bootstrap.shared.waiting import wait_until
+
+
+class TestWaitUntil(TestCase):
+    def test_timeout(self):
+        before = time.monotonic()
+        self.assertFalse(wait_until(lambda: False, timeout_seconds=0.05))
+        self.assertLess(time.monotonic() - before, 1.0)
+
+    def test_no_delay_if_met(self):
+        self.assertTrue(wait_until(lambda: True, timeout_seconds=0))
+
+    def test_node_appearing(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'node')
+            timer = threading.Timer(0.01, lambda: open(abs_filename, 'w').close())
+            timer.start()
+            try:
+                self.assertTrue(wait_until(lambda: os.path.exists(abs_filename),
+                        timeout_seconds=3, abs_watch_dir=abs_dir))
+            finally:
+                timer.join()
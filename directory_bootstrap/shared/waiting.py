@@ -0,0 +1,92 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+import select
+import time
+from ctypes import CDLL, c_char_p, c_int, c_uint32
+
+DEFAULT_TIMEOUT_SECONDS = 3.0
+
+_INITIAL_DELAY_SECONDS = 0.001
+_MAX_DELAY_SECONDS = 0.1
+
+# NOTE: From <sys/inotify.h>
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+
+_lib_c = CDLL("libc.so.6", use_errno=True)
+
+
+class _DirectoryWatch(object):
+    """
+    Wakes up waiters on changes to the entries of a directory (using inotify)
+    """
+    def __init__(self, abs_dir):
+        self._fd = _lib_c.inotify_init1(c_int(_IN_NONBLOCK | _IN_CLOEXEC))
+        if self._fd < 0:
+            raise OSError('inotify_init1 failed')
+
+        ret = _lib_c.inotify_add_watch(c_int(self._fd),
+                c_char_p(abs_dir.encode('utf-8')),
+                c_uint32(_IN_ATTRIB | _IN_CREATE | _IN_DELETE | _IN_MOVED_TO))
+        if ret < 0:
+            os.close(self._fd)
+            raise OSError('inotify_add_watch failed')
+
+    def wait(self, timeout_seconds):
+        readable, _, _ = select.select([self._fd], [], [], timeout_seconds)
+        if readable:
+            try:
+                os.read(self._fd, 64 * 1024)  # i.e. drain events
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _create_directory_watch(abs_dir):
+    try:
+        return _DirectoryWatch(abs_dir)
+    except (AttributeError, OSError):  # i.e. no inotify, or no such directory
+        return None
+
+
+def wait_until(condition, timeout_seconds=DEFAULT_TIMEOUT_SECONDS, abs_watch_dir=None,
+        min_delay_seconds=_INITIAL_DELAY_SECONDS):
+    """
+    Return True as soon as condition() is met, False once the timeout is hit.
+
+    With abs_watch_dir given, re-checks happen whenever entries of that
+    directory change.  Otherwise (and if inotify is unavailable),
+    re-checks happen after delays growing from min_delay_seconds
+    (1 millisecond by default) to 100 milliseconds (or min_delay_seconds,
+    if greater), e.g. for checks as expensive as running a command.
+    """
+    deadline = time.monotonic() + timeout_seconds
+    watch = None if abs_watch_dir is None else _create_directory_watch(abs_watch_dir)
+    max_delay_seconds = max(min_delay_seconds, _MAX_DELAY_SECONDS)
+    try:
+        delay_seconds = min_delay_seconds
+        while True:
+            if condition():
+                return True
+
+            remaining_seconds = deadline - time.monotonic()
+            if remaining_seconds <= 0:
+                return False
+
+            if watch is None:
+                time.sleep(min(delay_seconds, remaining_seconds))
+                delay_seconds = min(delay_seconds * 2, max_delay_seconds)
+            else:
+                # NOTE: Capped since not every change of interest produces an event
+                watch.wait(min(_MAX_DELAY_SECONDS, remaining_seconds))
+    finally:
+        if watch is not None:
+            watch.close()
@@ -2,8 +2,10 @@
 # Licensed under AGPL v3 or later
 
 import os
+import shutil
 import signal
 import sys
+import tempfile
 
 from directory_bootstrap.distros.base import \
         add_general_directory_bootstrapping_options
@@ -15,6 +17,9 @@ from directory_bootstrap.shared.messenger import (
 from directory_bootstrap.shared.metadata import DESCRIPTION, VERSION_STR
 from directory_bootstrap.shared.output_control import (
         add_output_control_options, is_color_wanted, run_handle_errors)
+from image_bootstrap.customize import (
+        CUSTOMIZE_SUBCOMMAND, CustomizationEngine, add_customize_parser_to,
+        check_golden_image)
 from image_bootstrap.distros.arch import ArchStrategy
 from image_bootstrap.distros.base import DISTRO_CLASS_FIELD
 from image_bootstrap.distros.debian import DebianStrategy
@@ -24,10 +29,23 @@ from image_bootstrap.engine import (
         BOOTLOADER__AUTO, BOOTLOADER__CHROOT_GRUB2__DEVICE,
         BOOTLOADER__CHROOT_GRUB2__DRIVE, BOOTLOADER__HOST_EXTLINUX,
         BOOTLOADER__HOST_GRUB2__DEVICE, BOOTLOADER__HOST_GRUB2__DRIVE,
-        BOOTLOADER__NONE, BootstrapEngine, MachineConfig)
+        BOOTLOADER__NONE, ROOT_FSES, BootstrapEngine, MachineConfig)
+from image_bootstrap.fan_out import copy_to_many
+from image_bootstrap.file_systems.base import (
+        BUILD_PROFILE__SAFE, BUILD_PROFILES)
+from image_bootstrap.file_systems.btrfs import ROOT_FS__BTRFS
+from image_bootstrap.file_systems.ext4 import ROOT_FS__EXT4
+from image_bootstrap.file_systems.squashfs import ROOT_FS__SQUASHFS
+from image_bootstrap.journal import journal_filename_for
+from image_bootstrap.output import (
+        OUTPUT_FORMAT__RAW, OUTPUT_FORMATS, guess_output_format)
+from image_bootstrap.parallel import (
+        run_engine_in_child_process, run_engines_in_parallel)
+from image_bootstrap.types.byte_size import byte_size_type
 from image_bootstrap.types.disk_id import disk_id_type
 from image_bootstrap.types.machine_id import machine_id_type
 from image_bootstrap.types.uuid import uuid_type
+from image_bootstrap.variants import load_variants
 
 _BOOTLOADER_APPROACHES = (
         BOOTLOADER__AUTO,
@@ -44,6 +62,170 @@ def _abspath_or_none(path_or_none):
     return path_or_none and os.path.abspath(path_or_none)
 
 
+def _create_bootstrap_engine(messenger, executor, options, machine_config,
+        abs_target_path, abs_scripts_dir_pre, abs_scripts_dir_chroot,
+        abs_scripts_dir_post, abs_phase_cache_dir, abs_output_path, output_format):
+    if options.keep_on_failure or options.resume:
+        abs_journal_filename = journal_filename_for(
+                os.path.join(os.path.abspath(options.cache_dir), 'journals'),
+                abs_target_path)
+    else:
+        abs_journal_filename = None
+
+    bootstrap = BootstrapEngine(
+            messenger,
+            executor,
+            machine_config,
+            abs_scripts_dir_pre,
+            abs_scripts_dir_chroot,
+            abs_scripts_dir_post,
+            abs_target_path,
+            options.command_grub2_install,
+            abs_phase_cache_dir,
+            abs_journal_filename,
+            options.resume,
+            options.image_size_bytes,
+            options.build_profile,
+            options.compact,
+            options.shrink_headroom_bytes,
+            output_format,
+            abs_output_path,
+            options.root_fs,
+            options.root_overlay,
+            options.timings,
+            os.path.abspath(options.cache_dir),
+            )
+
+    distro_class = getattr(options, DISTRO_CLASS_FIELD)
+    bootstrap.set_distro(distro_class.create(messenger, executor, options))
+
+    bootstrap.check_release()
+    bootstrap.select_bootloader()
+    bootstrap.detect_grub2_install()
+    bootstrap.check_for_commands()
+    bootstrap.check_architecture()
+    bootstrap.check_target_block_device()
+    bootstrap.check_script_permissions()
+    bootstrap.process_root_password()
+    return bootstrap
+
+
+def _create_customization_engines(messenger, executor, machine_config, abs_target_paths):
+    customizations = []
+    for i, abs_target_path in enumerate(abs_target_paths):
+        customization = CustomizationEngine(
+                messenger,
+                executor,
+                machine_config if (i == 0) else machine_config.copy_without_identifiers(),
+                abs_target_path,
+                )
+        customization.check_for_commands()
+        customization.check_target_block_device()
+        customization.process_root_password()
+        customizations.append((abs_target_path, customization))
+    return customizations
+
+
+def _run_customization_engines(messenger, options, customizations):
+    if len(customizations) == 1:
+        abs_target_path, customization = customizations[0]
+        run_engine_in_child_process(messenger, options, abs_target_path, customization)
+    else:
+        run_engines_in_parallel(messenger, options, customizations)
+
+
+def _customize(messenger, executor, options, machine_config):
+    for option_name, unsupported in (
+            ('--keep-on-failure', options.keep_on_failure),
+            ('--phase-cache', options.phase_cache_dir),
+            ('--resume', options.resume),
+            ('--variants', options.variants_file),
+            ('--root-fs', options.root_fs != ROOT_FS__EXT4),
+            ):
+        if unsupported:
+            raise ValueError('Option %s cannot be combined with subcommand "%s"'
+                    % (option_name, CUSTOMIZE_SUBCOMMAND))
+
+    abs_source_image_path = os.path.abspath(options.source_image_path)
+    check_golden_image(abs_source_image_path)
+
+    abs_target_paths = [os.path.abspath(options.target_path)] \
+            + [os.path.abspath(e) for e in options.extra_target_paths]
+    customizations = _create_customization_engines(messenger, executor,
+            machine_config, abs_target_paths)
+
+    copy_to_many(messenger, abs_source_image_path, abs_target_paths)
+
+    _run_customization_engines(messenger, options, customizations)
+
+
+def _bootstrap(messenger, executor, options, machine_config):
+    if options.variants_file:
+        variants = load_variants(os.path.abspath(options.variants_file))
+    else:
+        variants = []
+
+    abs_output_paths = [_abspath_or_none(options.output_path)] \
+            + [variant.abs_output_path for variant in variants]
+    abs_output_paths = [e for e in abs_output_paths if e is not None]
+    if len(set(abs_output_paths)) < len(abs_output_paths):
+        raise ValueError('Output files of --output and of variants need to differ')
+
+    abs_phase_cache_dir = _abspath_or_none(options.phase_cache_dir)
+    abs_temp_phase_cache_dir = None
+    if variants and abs_phase_cache_dir is None:
+        # NOTE: Variants branch off the base build through the phase cache
+        abs_cache_dir = os.path.abspath(options.cache_dir)
+        os.makedirs(abs_cache_dir, 0o700, exist_ok=True)
+        abs_temp_phase_cache_dir = tempfile.mkdtemp(prefix='phase-cache-', dir=abs_cache_dir)
+        abs_phase_cache_dir = abs_temp_phase_cache_dir
+
+    bootstrap = _create_bootstrap_engine(messenger, executor, options,
+            machine_config,
+            os.path.abspath(options.target_path),
+            _abspath_or_none(options.scripts_dir_pre),
+            _abspath_or_none(options.scripts_dir_chroot),
+            _abspath_or_none(options.scripts_dir_post),
+            abs_phase_cache_dir,
+            _abspath_or_none(options.output_path),
+            options.output_format,
+            )
+
+    variant_engines = []
+    for variant in variants:
+        variant_engines.append((variant.abs_target_path, _create_bootstrap_engine(
+                messenger, executor, options,
+                variant.apply_to(machine_config),
+                variant.abs_target_path,
+                variant.abs_scripts_dir_pre or _abspath_or_none(options.scripts_dir_pre),
+                variant.abs_scripts_dir_chroot or _abspath_or_none(options.scripts_dir_chroot),
+                variant.abs_scripts_dir_post or _abspath_or_none(options.scripts_dir_post),
+                abs_phase_cache_dir,
+                variant.abs_output_path,
+                variant.get_output_format(),
+                )))
+
+    abs_extra_target_paths = [os.path.abspath(e) for e in options.extra_target_paths]
+    customizations = _create_customization_engines(messenger, executor,
+            machine_config.copy_without_identifiers(), abs_extra_target_paths)
+
+    try:
+        # NOTE: Each engine runs in a child process of its own so that
+        #       its PID namespace does not outlive it, see PidNamespace.close
+        run_engine_in_child_process(messenger, options,
+                os.path.abspath(options.target_path), bootstrap)
+        if variant_engines:
+            run_engines_in_parallel(messenger, options, variant_engines)
+        if customizations:
+            copy_to_many(messenger, os.path.abspath(options.target_path),
+                    abs_extra_target_paths)
+            _run_customization_engines(messenger, options, customizations)
+    finally:
+        if abs_temp_phase_cache_dir is not None:
+            messenger.info('Removing directory "%s"...' % abs_temp_phase_cache_dir)
+            shutil.rmtree(abs_temp_phase_cache_dir)
+
+
 def _main__level_three(messenger, options):
     messenger.banner()
 
@@ -72,29 +254,10 @@ def _main__level_three(messenger, options):
             options.with_openstack,
             )
 
-    bootstrap = BootstrapEngine(
-            messenger,
-            executor,
-            machine_config,
-            _abspath_or_none(options.scripts_dir_pre),
-            _abspath_or_none(options.scripts_dir_chroot),
-            _abspath_or_none(options.scripts_dir_post),
-            os.path.abspath(options.target_path),
-            options.command_grub2_install,
-            )
-
-    distro_class = getattr(options, DISTRO_CLASS_FIELD)
-    bootstrap.set_distro(distro_class.create(messenger, executor, options))
-
-    bootstrap.check_release()
-    bootstrap.select_bootloader()
-    bootstrap.detect_grub2_install()
-    bootstrap.check_for_commands()
-    bootstrap.check_architecture()
-    bootstrap.check_target_block_device()
-    bootstrap.check_script_permissions()
-    bootstrap.process_root_password()
-    bootstrap.run()
+    if options.source_image_path is not None:
+        _customize(messenger, executor, options, machine_config)
+    else:
+        _bootstrap(messenger, executor, options, machine_config)
 
     if not stdout_wanted:
         child_process_stdout.close()
@@ -110,6 +273,7 @@ def _main__level_two():
             formatter_class=RawDescriptionHelpFormatter,
             )
     parser.add_argument('--version', action='version', version=VERSION_STR)
+    parser.set_defaults(source_image_path=None)
 
     add_output_control_options(parser)
 
@@ -121,6 +285,15 @@ def _main__level_two():
         help='approach to take during bootloader installation (default: %(default)s)')
     machine.add_argument('--bootloader-force', default=False, action='store_true',
         help='apply more force when installing bootloader (default: disabled)')
+    machine.add_argument('--root-fs', default=ROOT_FS__EXT4, choices=ROOT_FSES,
+        help='file system of the root partition; "%s" compresses '
+             'transparently, "%s" is read-only, compressed, and requires '
+             'a chroot GRUB 2 approach to bootloader installation '
+             '(default: %%(default)s)' % (ROOT_FS__BTRFS, ROOT_FS__SQUASHFS))
+    machine.add_argument('--root-overlay', default=False, action='store_true',
+        help='keep a writable tmpfs overlay on top of a read-only root file system, '
+             'changes are lost on reboot; requires --root-fs %s (default: disabled)'
+             % ROOT_FS__SQUASHFS)
     machine.add_argument('--hostname', default='machine', metavar='NAME',
         help='hostname to set (default: "%(default)s")')
     machine.add_argument('--openstack', dest='with_openstack', default=False, action='store_true',
@@ -153,6 +326,54 @@ def _main__level_two():
 
     general = parser.add_argument_group('general configuration')
     add_general_directory_bootstrapping_options(general)
+    general.add_argument('--phase-cache', dest='phase_cache_dir', metavar='DIRECTORY',
+        help='directory to keep snapshots of completed build phases in '
+             'so that rebuilds can resume from the latest unchanged phase '
+             '(default: disabled)')
+    general.add_argument('--keep-on-failure', default=False, action='store_true',
+        help='keep a journal of completed steps (in the cache directory) '
+             'so that a failed build can be continued using --resume '
+             '(default: disabled)')
+    general.add_argument('--resume', default=False, action='store_true',
+        help='continue a failed build from the first incomplete step '
+             'rather than starting over, implies --keep-on-failure '
+             '(default: disabled)')
+    general.add_argument('--build-profile', default=BUILD_PROFILE__SAFE, choices=BUILD_PROFILES,
+        help='trade durability during the build for speed: "fast" formats lazily '
+             'and mounts with noatime, "unsafe" also uses data=writeback '
+             'and no write barriers; the resulting image is equally safe '
+             'either way (default: %(default)s)')
+    general.add_argument('--timings', default=False, action='store_true',
+        help='report how long each build step took, at the end '
+             '(default: disabled)')
+    general.add_argument('--compact', default=False, action='store_true',
+        help='zero and/or discard unused blocks of the file system at the end '
+             'so that the image compresses well (default: disabled)')
+    general.add_argument('--shrink', dest='shrink_headroom_bytes', metavar='HEADROOM',
+        type=byte_size_type,
+        help='shrink file system and partition (and image file) '
+             'to minimum size plus HEADROOM, e.g. 256M; implies --compact '
+             '(default: disabled)')
+    general.add_argument('--output', dest='output_path', metavar='PATH',
+        help='file to write the final image to, in addition to DEVICE '
+             '(default: none)')
+    general.add_argument('--output-format', choices=OUTPUT_FORMATS,
+        help='format of the --output file (default: guessed from file name, '
+             'e.g. "qcow2" for *.qcow2, "%s" otherwise)' % OUTPUT_FORMAT__RAW)
+    general.add_argument('--image-size', dest='image_size_bytes', metavar='SIZE',
+        type=byte_size_type,
+        help='size of the sparse image file to create if DEVICE is '
+             'a regular file rather than a block device, e.g. 3G '
+             '(default: use existing file as is)')
+    general.add_argument('--also-to', dest='extra_target_paths', metavar='DEVICE',
+        default=[], action='append',
+        help='further block device (or existing image file) to copy the image to, '
+             'with identifiers of its own; requires --root-fs ext4; '
+             'can be passed multiple times (default: none)')
+    general.add_argument('--variants', dest='variants_file', metavar='FILE',
+        help='YAML file listing further targets to build variants of '
+             'this image to, in parallel, sharing all unchanged phases '
+             'of the build for DEVICE (default: none)')
 
     distros = parser.add_subparsers(title='subcommands (choice of distribution)',
             description='Run "%(prog)s DISTRIBUTION --help" for details '
@@ -168,12 +389,34 @@ def _main__level_two():
             ):
         strategy_clazz.add_parser_to(distros)
 
+    add_customize_parser_to(distros)
+
 
     parser.add_argument('target_path', metavar='DEVICE',
-        help='block device to install to')
+        help='block device (or image file) to install to')
 
     options = parser.parse_args()
 
+    if options.output_path is None:
+        if options.output_format is not None:
+            parser.error('--output-format requires --output')
+    elif options.output_format is None:
+        options.output_format = guess_output_format(options.output_path)
+
+    if options.root_fs == ROOT_FS__SQUASHFS:
+        if options.compact or options.shrink_headroom_bytes is not None:
+            parser.error('--compact and --shrink cannot be combined with --root-fs %s'
+                    % ROOT_FS__SQUASHFS)
+    else:
+        if options.root_overlay:
+            parser.error('--root-overlay requires --root-fs %s' % ROOT_FS__SQUASHFS)
+        if options.root_fs != ROOT_FS__EXT4 and options.shrink_headroom_bytes is not None:
+            parser.error('--shrink requires --root-fs %s' % ROOT_FS__EXT4)
+
+    # NOTE: Copies only get identifiers of their own on ext4 (see CustomizationEngine)
+    if options.extra_target_paths and options.root_fs != ROOT_FS__EXT4:
+        parser.error('--also-to requires --root-fs %s' % ROOT_FS__EXT4)
+
     messenger = Messenger(options.verbosity, is_color_wanted(options))
     run_handle_errors(_main__level_three, messenger, options)
 
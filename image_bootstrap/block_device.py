@@ -0,0 +1,213 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import errno
+import fcntl
+import os
+import stat
+import struct
+import uuid
+
+# NOTE: From <linux/fs.h>
+_BLKGETSIZE64 = 0x80081272
+_BLKRRPART = 0x125f
+_BLKSSZGET = 0x1268
+_BLKZEROOUT = 0x127f
+_FS_IOC_GETFLAGS = 0x80086601
+_FS_IOC_SETFLAGS = 0x40086602
+_FS_NOCOMP_FL = 0x00000400
+
+_DEFAULT_SECTOR_SIZE_BYTES = 512
+
+_ZERO_OUT_ALIGNMENT_BYTES = 512
+
+# NOTE: From <ext2fs/ext2_fs.h>
+_EXT4_SUPERBLOCK_OFFSET = 1024
+_EXT4_LOG_BLOCK_SIZE_OFFSET = 0x18
+_EXT4_MAGIC_OFFSET = 0x38
+_EXT4_MAGIC = 0xef53
+_EXT4_UUID_OFFSET = 0x68
+_EXT4_UUID_SIZE_BYTES = 16
+
+# NOTE: From <linux/btrfs_tree.h>
+_BTRFS_SUPERBLOCK_OFFSET = 64 * 1024
+_BTRFS_FSID_OFFSET = 0x20
+_BTRFS_FSID_SIZE_BYTES = 16
+_BTRFS_MAGIC_OFFSET = 0x40
+_BTRFS_MAGIC = b'_BHRfS_M'
+
+
+def is_block_device(fd):
+    return stat.S_ISBLK(os.fstat(fd).st_mode)
+
+
+def is_below_dev(abs_path):
+    """
+    Tell if a path is below /dev, where files other than device nodes
+    end up in RAM (since /dev is devtmpfs) rather than on disk
+
+    >>> is_below_dev('/dev/sdx'), is_below_dev('/dev/vg/lv'), is_below_dev('/devices/disk.img')
+    (True, True, False)
+    """
+    abs_dir = os.path.realpath(os.path.dirname(abs_path))
+    return abs_dir == '/dev' or abs_dir.startswith('/dev/')
+
+
+def get_size_bytes(fd):
+    """
+    Return the size of a block device or regular file, in bytes
+    """
+    if not is_block_device(fd):
+        return os.fstat(fd).st_size
+
+    buf = fcntl.ioctl(fd, _BLKGETSIZE64, b'\0' * 8)
+    return struct.unpack('Q', buf)[0]
+
+
+def get_logical_sector_size(fd):
+    if not is_block_device(fd):
+        return _DEFAULT_SECTOR_SIZE_BYTES
+
+    buf = fcntl.ioctl(fd, _BLKSSZGET, b'\0' * 4)
+    return struct.unpack('i', buf)[0]
+
+
+def reread_partition_table(fd):
+    """
+    Have the kernel re-read the partition table.  Return False for
+    devices that do not support partitions of their own
+    (e.g. loop devices without partition scanning, device mapper), True otherwise.
+    """
+    try:
+        fcntl.ioctl(fd, _BLKRRPART)
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+        return False
+    return True
+
+
+def zero_out(fd, offset, length):
+    """
+    Zero a range of a block device, preferably without
+    transferring any zeros, falling back to writing them.
+    """
+    if not (offset % _ZERO_OUT_ALIGNMENT_BYTES or length % _ZERO_OUT_ALIGNMENT_BYTES):
+        try:
+            fcntl.ioctl(fd, _BLKZEROOUT, struct.pack('QQ', offset, length))
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP):
+                raise
+
+    zeros = bytes(min(length, 1024 * 1024))
+    end = offset + length
+    while offset < end:
+        offset += os.pwrite(fd, zeros[:end - offset], offset)
+
+
+def try_disabling_compression(fd):
+    """
+    Have a file written uncompressed on file systems with transparent
+    compression (e.g. btrfs).  Return False if not supported.
+    """
+    try:
+        flags = struct.unpack('I', fcntl.ioctl(fd, _FS_IOC_GETFLAGS, b'\0' * 4))[0]
+        fcntl.ioctl(fd, _FS_IOC_SETFLAGS, struct.pack('I', flags | _FS_NOCOMP_FL))
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP):
+            raise
+        return False
+    return True
+
+
+def _read_ext4_superblock(fd, offset=0):
+    superblock = os.pread(fd, _EXT4_UUID_OFFSET + _EXT4_UUID_SIZE_BYTES,
+            offset + _EXT4_SUPERBLOCK_OFFSET)
+    if len(superblock) < _EXT4_UUID_OFFSET + _EXT4_UUID_SIZE_BYTES:
+        raise ValueError('No ext2/3/4 superblock found (device too small)')
+
+    magic = struct.unpack_from('<H', superblock, _EXT4_MAGIC_OFFSET)[0]
+    if magic != _EXT4_MAGIC:
+        raise ValueError('No ext2/3/4 superblock found (magic 0x%04x rather than 0x%04x)'
+                % (magic, _EXT4_MAGIC))
+
+    return superblock
+
+
+def read_ext4_uuid(fd, offset=0):
+    """
+    Read the file system UUID straight from the ext2/3/4 superblock
+    of the file system starting at the given offset
+    """
+    superblock = _read_ext4_superblock(fd, offset)
+    return str(uuid.UUID(bytes=superblock[_EXT4_UUID_OFFSET:_EXT4_UUID_OFFSET + _EXT4_UUID_SIZE_BYTES]))
+
+
+def read_ext4_block_size(fd):
+    superblock = _read_ext4_superblock(fd)
+    log_block_size = struct.unpack_from('<I', superblock, _EXT4_LOG_BLOCK_SIZE_OFFSET)[0]
+    return 1024 << log_block_size
+
+
+def read_btrfs_uuid(fd):
+    """
+    Read the file system UUID straight from the btrfs superblock
+    """
+    superblock = os.pread(fd, _BTRFS_MAGIC_OFFSET + len(_BTRFS_MAGIC), _BTRFS_SUPERBLOCK_OFFSET)
+    if superblock[_BTRFS_MAGIC_OFFSET:] != _BTRFS_MAGIC:
+        raise ValueError('No btrfs superblock found')
+
+    return str(uuid.UUID(bytes=superblock[_BTRFS_FSID_OFFSET:_BTRFS_FSID_OFFSET + _BTRFS_FSID_SIZE_BYTES]))
+
+
+def iter_data_extents(fd, size_bytes):
+    """
+    Yield (offset, length) for each range of a file that may hold data,
+    skipping holes.  Without hole support (e.g. block devices, some
+    file systems), the whole range is yielded as data.
+    """
+    offset = 0
+    while offset < size_bytes:
+        try:
+            data_start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # i.e. nothing but a hole until the end
+                return
+            if e.errno != errno.EINVAL:
+                raise
+            yield offset, size_bytes - offset
+            return
+
+        if data_start >= size_bytes:
+            return
+
+        data_end = min(os.lseek(fd, data_start, os.SEEK_HOLE), size_bytes)
+        yield data_start, data_end - data_start
+        offset = data_end
+
+
+def get_loop_backing_file(fd):
+    """
+    Return the absolute path of the file backing a loop device if the
+    device maps that file one-to-one, None otherwise.
+    """
+    st = os.fstat(fd)
+    if not stat.S_ISBLK(st.st_mode):
+        return None
+
+    abs_loop_dir = '/sys/dev/block/%d:%d/loop' % (os.major(st.st_rdev), os.minor(st.st_rdev))
+    try:
+        with open(os.path.join(abs_loop_dir, 'offset')) as f:
+            offset = int(f.read())
+        with open(os.path.join(abs_loop_dir, 'sizelimit')) as f:
+            size_limit = int(f.read())
+        with open(os.path.join(abs_loop_dir, 'backing_file')) as f:
+            abs_backing_file = f.read().rstrip('\n')
+    except (OSError, ValueError):  # i.e. not a loop device
+        return None
+
+    if offset or size_limit or not os.path.isfile(abs_backing_file):
+        return None
+
+    return abs_backing_file
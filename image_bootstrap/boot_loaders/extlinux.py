@@ -0,0 +1,4 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+BOOTLOADER__HOST_EXTLINUX = 'host-extlinux'
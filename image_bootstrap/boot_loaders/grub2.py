@@ -18,6 +18,11 @@ BOOTLOADER__CHROOT_GRUB2 = (
         BOOTLOADER__CHROOT_GRUB2__DRIVE,
         )
 
+BOOTLOADER__HOST_GRUB2 = (
+        BOOTLOADER__HOST_GRUB2__DEVICE,
+        BOOTLOADER__HOST_GRUB2__DRIVE,
+        )
+
 _BOOTLOADER__ANY_GRUB2__DRIVE = (
         BOOTLOADER__CHROOT_GRUB2__DRIVE,
         BOOTLOADER__HOST_GRUB2__DRIVE,
@@ -0,0 +1,143 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import errno
+import os
+import uuid
+
+from directory_bootstrap.shared.commands import (
+        COMMAND_CHROOT, COMMAND_E2FSCK, COMMAND_KPARTX, COMMAND_LOSETUP,
+        COMMAND_MOUNT, COMMAND_SED, COMMAND_TUNE2FS)
+from directory_bootstrap.shared.mount import COMMAND_UMOUNT
+from image_bootstrap.block_device import get_logical_sector_size, read_ext4_uuid
+from image_bootstrap.engine import BootstrapEngine
+from image_bootstrap.file_systems.ext4 import check_file_system
+from image_bootstrap.mbr import get_first_partition_layout
+from image_bootstrap.types.disk_id import DiskIdentifier
+
+CUSTOMIZE_SUBCOMMAND = 'customize'
+
+
+def add_customize_parser_to(distros):
+    customize = distros.add_parser(CUSTOMIZE_SUBCOMMAND,
+            help='Customization of a copy of a golden image')
+    customize.add_argument('--from', dest='source_image_path', metavar='IMAGE',
+            required=True,
+            help='image (file or block device) previously built by image-bootstrap '
+                 'to copy to DEVICE and apply per-machine configuration to')
+
+
+def check_golden_image(abs_image_path):
+    """
+    Refuse golden images that customization cannot give identifiers
+    of their own, before copying them over any targets
+    """
+    fd = os.open(abs_image_path, os.O_RDONLY)
+    try:
+        first_sector, _ = get_first_partition_layout(fd)
+        read_ext4_uuid(fd, first_sector * get_logical_sector_size(fd))
+    except ValueError as e:
+        raise ValueError('Image "%s" not supported, customization supports '
+                'ext4 golden images only: %s' % (abs_image_path, e))
+    finally:
+        os.close(fd)
+
+
+class CustomizationEngine(BootstrapEngine):
+    """
+    Applies per-machine configuration only to a (fresh) copy
+    of a golden image, rather than bootstrapping from scratch
+    """
+    def __init__(self,
+            messenger,
+            executor,
+            machine_config,
+            abs_target_path,
+            ):
+        super(CustomizationEngine, self).__init__(
+                messenger,
+                executor,
+                machine_config,
+                None,
+                None,
+                None,
+                abs_target_path,
+                None,
+                )
+
+    def get_commands_to_check_for(self):
+        res = [
+                COMMAND_CHROOT,
+                COMMAND_E2FSCK,
+                COMMAND_KPARTX,
+                COMMAND_MOUNT,
+                COMMAND_SED,
+                COMMAND_TUNE2FS,
+                COMMAND_UMOUNT,
+                ]
+
+        if self._target_is_image_file():
+            res.append(COMMAND_LOSETUP)
+
+        return res
+
+    def check_target_block_device(self):
+        # NOTE: Image files are not created by copying, so that a mistyped
+        #       block device does not end up as an image file in /dev
+        if not os.path.exists(self._abs_target_path):
+            raise OSError(errno.ENOENT, 'Block device or image file "%s" does not exist, '
+                    'please create image files up front (e.g. with "truncate -s 0").'
+                    % self._abs_target_path)
+
+        super(CustomizationEngine, self).check_target_block_device()
+
+    def _pick_identifiers(self):
+        # NOTE: Copies of the same image must not share identifiers
+        if not self._config.disk_id:
+            self._config.disk_id = DiskIdentifier.random()
+        if not self._config.first_partition_uuid:
+            self._config.first_partition_uuid = str(uuid.uuid4())
+
+    def _check_file_system(self):
+        # NOTE: tune2fs -U may demand a freshly checked file system
+        check_file_system(self._messenger, self._executor, self._abs_first_partition_device)
+
+    def _configure_hostname(self):
+        filename = os.path.join(self._abs_mountpoint, 'etc', 'hostname')
+        self._messenger.info('Writing file "%s"...' % filename)
+        with open(filename, 'w') as f:
+            print(self._config.hostname, file=f)
+
+    def _run(self):
+        self._unshare()
+        self._pick_identifiers()
+        self._set_disk_id_in_mbr()
+        self._create_partition_devices()
+        try:
+            previous_first_partition_uuid = self._read_first_partition_uuid()
+            self._check_file_system()
+            self._set_first_partition_uuid()
+
+            self._mkdir_mountpount()
+            try:
+                self._mount_disk_chroot_mounts()
+                try:
+                    self._configure_hostname()
+                    self._create_etc_fstab()
+                    self._clean_machine_id()
+                    self._create_etc_machine_id()
+                    self._replace_first_partition_uuid_in_boot_loader_config(
+                            previous_first_partition_uuid,
+                            self._config.first_partition_uuid)
+                    if self._config.root_password is not None:
+                        self._mount_nondisk_chroot_mounts()
+                        try:
+                            self._set_root_password_inside_chroot()
+                        finally:
+                            self._unmount_nondisk_chroot_mounts()
+                finally:
+                    self._unmount_disk_chroot_mounts()
+            finally:
+                self._rmdir_mountpount()
+        finally:
+            self._remove_partition_devices()
@@ -11,6 +11,9 @@ from directory_bootstrap.distros.arch import (
 from directory_bootstrap.shared.commands import (
         COMMAND_CHROOT, COMMAND_CP, COMMAND_FIND, COMMAND_RM, COMMAND_WGET)
 from image_bootstrap.distros.base import DISTRO_CLASS_FIELD, DistroStrategy
+from image_bootstrap.engine import (
+        FEATURE__CLOUD_INIT, FEATURE__DHCP_CLIENT, FEATURE__GRUB2,
+        FEATURE__SSHD, FEATURE__SUDO)
 
 
 class ArchStrategy(DistroStrategy):
@@ -30,6 +33,7 @@ class ArchStrategy(DistroStrategy):
 
         self._image_date_triple_or_none = image_date_triple_or_none
         self._mirror_url = mirror_url
+        self._directory_bootstrapper = None
 
     def get_commands_to_check_for(self):
         return ArchBootstrapper.get_commands_to_check_for() + [
@@ -55,20 +59,29 @@ class ArchStrategy(DistroStrategy):
     def allow_autostart_of_services(self, allow):
         pass  # services are not auto-started on Arch
 
+    def _get_directory_bootstrapper(self, architecture):
+        if self._directory_bootstrapper is None:
+            self._directory_bootstrapper = ArchBootstrapper(
+                    self._messenger,
+                    self._executor,
+                    None,  # i.e. target directory set later
+                    self._abs_cache_dir,
+                    architecture,
+                    self._image_date_triple_or_none,
+                    self._mirror_url,
+                    self._abs_resolv_conf,
+                    )
+        return self._directory_bootstrapper
+
+    def prefetch_directory_bootstrap(self, architecture, bootloader_approach):
+        self._get_directory_bootstrapper(architecture).prefetch()
+
     def run_directory_bootstrap(self, architecture, bootloader_approach):
         self._messenger.info('Bootstrapping %s into "%s"...'
                 % (self.DISTRO_NAME_SHORT, self._abs_mountpoint))
 
-        bootstrap = ArchBootstrapper(
-                self._messenger,
-                self._executor,
-                self._abs_mountpoint,
-                self._abs_cache_dir,
-                architecture,
-                self._image_date_triple_or_none,
-                self._mirror_url,
-                self._abs_resolv_conf,
-                )
+        bootstrap = self._get_directory_bootstrapper(architecture)
+        bootstrap.set_target_dir(self._abs_mountpoint)
         bootstrap.run()
 
     def create_network_configuration(self, use_mtu_tristate):
@@ -101,18 +114,45 @@ class ArchStrategy(DistroStrategy):
                         UseMTU=%(use_mtu)s
                         """ % d), file=f)
 
-    def _install_packages(self, package_names):
+    def _install_packages(self, package_names, download_only=False):
         cmd = [
                 COMMAND_CHROOT,
                 self._abs_mountpoint,
                 'pacman',
                 '--noconfirm',
                 '--sync',
-                ] + list(package_names)
+                ]
+        if download_only:
+            cmd.append('--downloadonly')
+        cmd += list(package_names)
         self._executor.check_call(cmd, env=self.create_chroot_env())
 
-    def ensure_chroot_has_grub2_installed(self):
-        self._install_packages(['grub'])
+    def get_packages_for(self, feature):
+        # NOTE: No FEATURE__ACPID since Arch uses systemd
+        return {
+            FEATURE__GRUB2: ['grub'],
+            FEATURE__DHCP_CLIENT: [],  # already installed (part of systemd)
+            FEATURE__SUDO: ['sudo'],
+            # cloud-unit makes use of command "hostname"
+            # that is provided by package "inetutils" in Arch but the
+            # cloud-init packaging lacks a runtime dependency on inetutils,
+            # see Arch bug https://bugs.archlinux.org/task/67941 .
+            # Installing inetutils ourselves helps while waiting for a fix in Arch.
+            # See also: https://github.com/hartwork/image-bootstrap/pull/90
+            FEATURE__CLOUD_INIT: ['cloud-init', 'inetutils'],
+            FEATURE__SSHD: ['openssh'],
+        }[feature]
+
+    def finish_installing(self, feature):
+        if feature == FEATURE__CLOUD_INIT:
+            self.disable_cloud_init_syslog_fix_perms()
+            self.install_growpart()
+
+    def get_packages_to_prefetch(self, features, with_openstack):
+        packages = super(ArchStrategy, self).get_packages_to_prefetch(features, with_openstack)
+        if with_openstack:
+            packages.append('haveged')  # for shipping clean-up
+        return packages
 
     def get_chroot_command_grub2_install(self):
         return 'grub-install'
@@ -138,6 +178,21 @@ class ArchStrategy(DistroStrategy):
                 ]
         self._executor.check_call(cmd_sed, env=self.create_chroot_env())
 
+        if self._root_fs_kernel_modules:
+            abs_mkinitcpio_conf = '/etc/mkinitcpio.conf'
+            self._messenger.info('Adding kernel modules %s to "%s"...' % (
+                    ', '.join(self._root_fs_kernel_modules),
+                    os.path.join(self._abs_mountpoint, abs_mkinitcpio_conf.lstrip('/'))))
+            cmd_sed = [
+                    COMMAND_CHROOT,
+                    self._abs_mountpoint,
+                    'sed',
+                    's,^MODULES=(\\(.*\\)),MODULES=(\\1 %s)  # adjusted by image-bootstrap,'
+                            % ' '.join(self._root_fs_kernel_modules),
+                    '-i', abs_mkinitcpio_conf,
+                    ]
+            self._executor.check_call(cmd_sed, env=self.create_chroot_env())
+
         # Workaround issue "ERROR: file not found: '/etc/vconsole.conf'"
         abs_etc_vconsole_conf = '/etc/vconsole.conf'
         self._messenger.info('Creating empty file "%s"...' % os.path.join(self._abs_mountpoint, abs_etc_vconsole_conf.lstrip('/')))
@@ -224,31 +279,9 @@ class ArchStrategy(DistroStrategy):
                 ]
         self._executor.check_call(cmd)
 
-    def install_dhcp_client(self):
-        pass  # already installed (part of systemd)
-
-    def install_sudo(self):
-        self._install_packages(['sudo'])
-
-    def install_cloud_init_and_friends(self):
-        self._install_packages(['cloud-init'])
-        self.disable_cloud_init_syslog_fix_perms()
-        self.install_growpart()
-
-        # cloud-unit makes use of command "hostname"
-        # that is provided by package "inetutils" in Arch but the
-        # cloud-init packaging lacks a runtime dependency on inetutils,
-        # see Arch bug https://bugs.archlinux.org/task/67941 .
-        # Installing inetutils ourselves helps while waiting for a fix in Arch.
-        # See also: https://github.com/hartwork/image-bootstrap/pull/90
-        self._install_packages(['inetutils'])
-
     def get_cloud_init_datasource_cfg_path(self):
         return '/etc/cloud/cloud.cfg.d/90_datasource.cfg'
 
-    def install_sshd(self):
-        self._install_packages(['openssh'])
-
     def _make_services_autostart(self, service_names):
         for service_name in service_names:
             self._messenger.info('Making service "%s" start automatically...' % service_name)
@@ -301,6 +334,14 @@ class ArchStrategy(DistroStrategy):
     def get_minimum_size_bytes(self):
         return 3 * 1024**3
 
+    def get_phase_cache_inputs(self):
+        inputs = super(ArchStrategy, self).get_phase_cache_inputs()
+        inputs.update({
+            'image_date': self._image_date_triple_or_none,
+            'mirror_url': self._mirror_url,
+        })
+        return inputs
+
     @classmethod
     def add_parser_to(clazz, distros):
         arch = distros.add_parser(clazz.DISTRO_KEY, help=clazz.DISTRO_NAME_LONG)
@@ -7,6 +7,7 @@ import os
 from abc import ABCMeta, abstractmethod
 
 import image_bootstrap.loaders._yaml as yaml
+from directory_bootstrap.shared.chroot_session import ChrootSession
 from directory_bootstrap.shared.commands import COMMAND_CHROOT, COMMAND_WGET
 from image_bootstrap.engine import BOOTLOADER__CHROOT_GRUB2__DRIVE
 
@@ -21,15 +22,32 @@ class DistroStrategy(object, metaclass=ABCMeta):
         self._abs_cache_dir = abs_cache_dir
         self._abs_resolv_conf = abs_resolv_conf
 
+        self._root_fs_kernel_modules = []
+
     def set_mountpoint(self, abs_mountpoint):
         self._abs_mountpoint = abs_mountpoint
 
+    def set_root_fs_kernel_modules(self, kernel_modules):
+        """
+        Kernel modules needed to mount the root file system,
+        to be made available to the initramfs
+        """
+        self._root_fs_kernel_modules = list(kernel_modules)
+
     def set_chroot_env_prototype(self, chroot_env_prototype):
         self._chroot_env_prototype = chroot_env_prototype
 
     def create_chroot_env(self):
         return self._chroot_env_prototype.copy()
 
+    def chroot_session(self):
+        """
+        Return a session for running many small commands in the chroot
+        through a single process, to be used as a context manager
+        """
+        return ChrootSession(self._messenger, self._executor,
+                self._abs_mountpoint, env=self.create_chroot_env())
+
     def check_release(self):
         pass
 
@@ -58,16 +76,19 @@ class DistroStrategy(object, metaclass=ABCMeta):
     def allow_autostart_of_services(self, allow):
         pass
 
-    @abstractmethod
-    def run_directory_bootstrap(self, architecture, bootloader_approach):
+    def prefetch_directory_bootstrap(self, architecture, bootloader_approach):
+        """
+        Download and verify what run_directory_bootstrap is going to need
+        without touching the mountpoint, to overlap with preparation of the target
+        """
         pass
 
     @abstractmethod
-    def create_network_configuration(self, use_mtu_tristate):
+    def run_directory_bootstrap(self, architecture, bootloader_approach):
         pass
 
     @abstractmethod
-    def ensure_chroot_has_grub2_installed(self):
+    def create_network_configuration(self, use_mtu_tristate):
         pass
 
     @abstractmethod
@@ -100,23 +121,51 @@ class DistroStrategy(object, metaclass=ABCMeta):
         return self.DISTRO_KEY
 
     @abstractmethod
-    def install_dhcp_client(self):
+    def _install_packages(self, package_names, download_only=False):
         pass
 
     @abstractmethod
-    def install_sudo(self):
+    def get_packages_for(self, feature):
+        """
+        Packages that a feature (e.g. FEATURE__SUDO) needs installed
+        """
         pass
 
-    @abstractmethod
-    def install_cloud_init_and_friends(self):
+    def get_packages_for_all(self, features):
+        packages = []
+        for feature in features:
+            for package in self.get_packages_for(feature):
+                if package not in packages:
+                    packages.append(package)
+        return packages
+
+    def install_packages(self, package_names):
+        self._install_packages(package_names)
+
+    def finish_installing(self, feature):
+        """
+        Work that needs the packages of a feature installed,
+        called after the packages of all features are in
+        """
         pass
 
-    @abstractmethod
-    def get_cloud_init_datasource_cfg_path(self):
-        pass
+    def get_packages_to_prefetch(self, features, with_openstack):
+        """
+        Packages that later steps are going to install, to download ahead of time
+        """
+        return self.get_packages_for_all(features)
+
+    def can_prefetch_packages_while_installing(self):
+        return False  # i.e. the package manager holds a lock for either
+
+    def prefetch_packages(self, package_names):
+        """
+        Download packages without installing them
+        """
+        self._install_packages(package_names, download_only=True)
 
     @abstractmethod
-    def install_sshd(self):
+    def get_cloud_init_datasource_cfg_path(self):
         pass
 
     @abstractmethod
@@ -131,7 +180,11 @@ class DistroStrategy(object, metaclass=ABCMeta):
     def get_initramfs_path(self):
         pass
 
-    def prepare_installation_of_packages(self):
+    def prepare_installation_of_packages(self, package_names):
+        """
+        Configure the package manager for all packages that later steps
+        are going to install (or prefetch), before any of them run
+        """
         pass
 
     @abstractmethod
@@ -207,13 +260,16 @@ class DistroStrategy(object, metaclass=ABCMeta):
     def adjust_grub_defaults(self, with_openstack):
         pass
 
-    def install_acpid(self):
-        # NOTE: Only called for distros NOT using systemd
-        raise NotImplementedError()
-
     def get_extra_mkfs_ext4_options(self):
         return []
 
+    def get_phase_cache_inputs(self):
+        # NOTE: Anything affecting the content of the bootstrapped
+        #       root file system needs to go in here
+        return {
+            'distro': self.DISTRO_KEY,
+        }
+
     @classmethod
     def add_parser_to(clazz, distros):
         raise NotImplementedError()
@@ -13,7 +13,9 @@ from directory_bootstrap.shared.commands import (
         COMMAND_FIND, COMMAND_UNAME, COMMAND_UNSHARE)
 from image_bootstrap.distros.base import DISTRO_CLASS_FIELD, DistroStrategy
 from image_bootstrap.engine import (
-        BOOTLOADER__ANY_GRUB, BOOTLOADER__HOST_EXTLINUX, COMMAND_CHROOT)
+        BOOTLOADER__ANY_GRUB, BOOTLOADER__HOST_EXTLINUX, COMMAND_CHROOT,
+        FEATURE__ACPID, FEATURE__CLOUD_INIT, FEATURE__DHCP_CLIENT,
+        FEATURE__GRUB2, FEATURE__SSHD, FEATURE__SUDO)
 
 
 _ETC_NETWORK_INTERFACES_CONTENT = """\
@@ -160,9 +162,6 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
         # TODO For non-None use_mtu_tristate, force DHCP client option 26/interface-mtu
         use_mtu_tristate
 
-    def ensure_chroot_has_grub2_installed(self):
-        pass  # debootstrap has already pulled GRUB 2.x in
-
     def get_chroot_command_grub2_install(self):
         return 'grub-install'
 
@@ -174,6 +173,18 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
                 ]
         self._executor.check_call(cmd, env=self.create_chroot_env())
 
+    def adjust_initramfs_generator_config(self):
+        if not self._root_fs_kernel_modules:
+            return
+
+        abs_modules = os.path.join(self._abs_mountpoint, 'etc/initramfs-tools/modules')
+        self._messenger.info('Adding kernel modules %s to file "%s"...'
+                % (', '.join(self._root_fs_kernel_modules), abs_modules))
+        with open(abs_modules, 'a') as f:
+            print('# added by image-bootstrap', file=f)
+            for kernel_module in self._root_fs_kernel_modules:
+                print(kernel_module, file=f)
+
     def generate_initramfs_from_inside_chroot(self):
         cmd = [
                 COMMAND_CHROOT,
@@ -198,8 +209,10 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
                 ]
         self._executor.check_call(cmd)
 
-    def _install_packages(self, package_names):
-        self._messenger.info('Installing %s...' % ', '.join(package_names))
+    def _install_packages(self, package_names, download_only=False):
+        self._messenger.info('%s %s...' % (
+                'Downloading' if download_only else 'Installing',
+                ', '.join(package_names)))
         env = self.create_chroot_env()
         env.setdefault('DEBIAN_FRONTEND', 'noninteractive')
         cmd = [
@@ -208,25 +221,25 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
                 'apt-get',
                 'install',
                 '-y', '--no-install-recommends', '-V',
-                ] + list(package_names)
+                ]
+        if download_only:
+            cmd.append('--download-only')
+        cmd += list(package_names)
         self._executor.check_call(cmd, env=env)
 
-    def install_dhcp_client(self):
-        pass  # already installed
-
-    def install_sudo(self):
-        self._install_packages(['sudo'])
-
-    @abstractmethod
-    def install_cloud_init_and_friends(self):
-        pass
+    def get_packages_for(self, feature):
+        return {
+            FEATURE__GRUB2: [],  # debootstrap has already pulled GRUB 2.x in
+            FEATURE__DHCP_CLIENT: [],  # already installed
+            FEATURE__SUDO: ['sudo'],
+            FEATURE__CLOUD_INIT: self.CLOUD_INIT_PACKAGES,
+            FEATURE__SSHD: ['openssh-server'],
+            FEATURE__ACPID: ['acpid'],
+        }[feature]
 
     def get_cloud_init_datasource_cfg_path(self):
         return '/etc/cloud/cloud.cfg.d/90_dpkg.cfg'  # existing file
 
-    def install_sshd(self):
-        self._install_packages(['openssh-server'])
-
     def make_openstack_services_autostart(self):
         pass  # autostarted in Debian, already
 
@@ -242,8 +255,15 @@ class DebianBasedDistroStrategy(DistroStrategy, metaclass=ABCMeta):
     def adjust_grub_defaults(self, with_openstack):
         self._ensure_eth0_naming()
 
-    def install_acpid(self):
-        self._install_packages(['acpid'])
+    def get_phase_cache_inputs(self):
+        inputs = super(DebianBasedDistroStrategy, self).get_phase_cache_inputs()
+        inputs.update({
+            'command_debootstrap': self._command_debootstrap,
+            'debootstrap_opt': self._debootstrap_opt,
+            'mirror_url': self._mirror_url,
+            'release': self._release,
+        })
+        return inputs
 
     @classmethod
     def add_parser_to(clazz, distros):
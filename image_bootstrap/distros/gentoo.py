@@ -14,17 +14,31 @@ from directory_bootstrap.distros.gentoo import GentooBootstrapper
 from directory_bootstrap.shared.commands import (
         COMMAND_CHROOT, COMMAND_FIND, COMMAND_WGET)
 from image_bootstrap.distros.base import DISTRO_CLASS_FIELD, DistroStrategy
+from image_bootstrap.engine import (
+        FEATURE__ACPID, FEATURE__CLOUD_INIT, FEATURE__DHCP_CLIENT,
+        FEATURE__GRUB2, FEATURE__SSHD, FEATURE__SUDO)
 
 _ABS_PACKAGE_USE = '/etc/portage/package.use'
 _ABS_PACKAGE_KEYWORDS = '/etc/portage/package.accept_keywords'
 _ABS_PACKAGE_MASK = '/etc/portage/package.mask'
 _ABS_PACKAGE_UNMASK = '/etc/portage/package.unmask'
 
+_GENERATED_MARKER = '# generated by image-bootstrap'
+
+_KERNEL_PACKAGES = ['sys-kernel/vanilla-sources', 'sys-kernel/installkernel']
+
 _ARCH_OF_PLATFORM = {
     # TODO more arches here
     'x86_64': 'amd64',
 }
 
+# NOTE: Built into the kernel, so that no initramfs support is needed
+_KERNEL_OPTIONS_OF_KERNEL_MODULE = {
+    'btrfs': ['BTRFS_FS'],
+    'overlay': ['OVERLAY_FS'],
+    'squashfs': ['SQUASHFS', 'SQUASHFS_ZSTD'],
+}
+
 _HOST_PLATFORM = platform.machine()
 _HOST_ARCH = _ARCH_OF_PLATFORM.get(_HOST_PLATFORM, _HOST_PLATFORM)
 
@@ -49,6 +63,7 @@ class GentooStrategy(DistroStrategy):
         self._max_age_days = max_age_days
         self._stage3_date_triple_or_none = stage3_date_triple_or_none
         self._repository_date_triple_or_none = repository_date_triple_or_none
+        self._directory_bootstrapper = None
 
     def _write_etc_conf_d_hostname(self):
         etc_conf_d = os.path.join(self._abs_mountpoint, 'etc/conf.d')
@@ -122,7 +137,7 @@ class GentooStrategy(DistroStrategy):
 
         filename = os.path.join(self._abs_mountpoint, _ABS_PACKAGE_USE.lstrip('/'), package_name.replace('/', '--'))
         with open(filename, 'w') as f:
-            print('# generated by image-bootstrap', file=f)
+            print(_GENERATED_MARKER, file=f)
             print('%s %s' % (package_atom, flags_str), file=f)
 
     def _set_package_keywords(self, package_name, keywords_str, package_atom=None):
@@ -134,7 +149,7 @@ class GentooStrategy(DistroStrategy):
                 package_name.replace('/', '--'),
                 )
         with open(filename, 'w') as f:
-            print('# generated by image-bootstrap', file=f)
+            print(_GENERATED_MARKER, file=f)
             print('%s %s' % (package_atom, keywords_str), file=f)
 
     def _add_package_mask(self, package_name, package_atom=None, invert=False):
@@ -146,10 +161,36 @@ class GentooStrategy(DistroStrategy):
                 package_name.replace('/', '--'),
                 )
         with open(filename, 'w') as f:
-            print('# generated by image-bootstrap', file=f)
+            print(_GENERATED_MARKER, file=f)
             print(package_atom, file=f)
 
-    def _install_package_atoms(self, packages, reinstall=False):
+    def _configure_portage_for(self, packages):
+        """
+        Write the package.* entries that the given atoms need,
+        prior to both fetching and installing.  Not to be called while
+        emerge may be running, since it would read partial files.
+        """
+        if 'sys-boot/grub:2' in packages:
+            self._set_package_use_flags(
+                    'sys-boot/grub', 'device-mapper grub_platforms_pc', 'sys-boot/grub:2')
+            self._set_package_use_flags(
+                    'sys-fs/lvm2', '-thin')
+
+        if 'app-admin/sudo' in packages:
+            self._set_package_use_flags('app-admin/sudo', '-sendmail')
+
+        if 'app-emulation/cloud-init' in packages:
+            # NOTE This will make virtual/rust pull in dev-lang/rust-bin
+            #      instead of dev-lang/rust (which asked for "11520 MiB disk space")
+            self._add_package_mask('dev-lang/rust')
+
+            self._set_package_keywords('app-emulation/cloud-init', f'~{_HOST_ARCH}')
+
+        if 'sys-kernel/vanilla-sources' in packages:
+            self._set_package_keywords('sys-kernel/vanilla-sources', f'~{_HOST_ARCH}')
+            self._set_package_use_flags('sys-kernel/vanilla-sources', 'symlink')
+
+    def _install_packages(self, package_names, download_only=False, reinstall=False):
         env = self.create_chroot_env().update({
             'DONT_MOUNT_BOOT': '1',  # sys-boot/grub
             'MAKEOPTS': '-j2',
@@ -168,17 +209,12 @@ class GentooStrategy(DistroStrategy):
         ]
         if not reinstall:
             argv += ['--update', '--changed-use']
-        argv += list(packages)
+        if download_only:
+            argv.append('--fetchonly')
+        argv += list(package_names)
 
         self._executor.check_call(argv, env=env)
 
-    def ensure_chroot_has_grub2_installed(self):
-        self._set_package_use_flags(
-                'sys-boot/grub', 'device-mapper grub_platforms_pc', 'sys-boot/grub:2')
-        self._set_package_use_flags(
-                'sys-fs/lvm2', '-thin')
-        self._install_package_atoms(['sys-boot/grub:2'])
-
     def _disable_grub2_gfxmode(self):
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
@@ -230,7 +266,7 @@ class GentooStrategy(DistroStrategy):
     def generate_initramfs_from_inside_chroot(self):
         kernel_version_str = self._get_installed_kernel_version()
 
-        self._install_package_atoms(['sys-kernel/dracut'])
+        self._install_packages(['sys-kernel/dracut'])
         # NOTE: Pass kernel version to Dracut so it does not end up
         #       picking that of the host (rather than the chroot) from uname
         self._executor.check_call([
@@ -261,20 +297,27 @@ class GentooStrategy(DistroStrategy):
     def get_vmlinuz_path(self):
         return '/boot/vmlinuz'
 
-    def install_cloud_init_and_friends(self):
-        # NOTE This will make virtual/rust pull in dev-lang/rust-bin
-        #      instead of dev-lang/rust (which asked for "11520 MiB disk space")
-        self._add_package_mask('dev-lang/rust')
-
-        self._set_package_keywords('app-emulation/cloud-init', f'~{_HOST_ARCH}')
-
-        self._install_package_atoms(['app-emulation/cloud-init', 'net-misc/openssh'])
-        self.disable_cloud_init_syslog_fix_perms()
-        self.install_growpart()
-
-    def install_sshd(self):
-        self._install_package_atoms(['net-misc/openssh'])
-
+    def get_packages_for(self, feature):
+        return {
+            FEATURE__GRUB2: ['sys-boot/grub:2'],
+            FEATURE__DHCP_CLIENT: ['net-misc/dhcpcd'],
+            FEATURE__SUDO: ['app-admin/sudo'],
+            FEATURE__CLOUD_INIT: ['app-emulation/cloud-init', 'net-misc/openssh'],
+            FEATURE__SSHD: ['net-misc/openssh'],
+            FEATURE__ACPID: ['sys-power/acpid'],
+        }[feature]
+
+    def finish_installing(self, feature):
+        if feature == FEATURE__CLOUD_INIT:
+            self.disable_cloud_init_syslog_fix_perms()
+            self.install_growpart()
+        elif feature == FEATURE__SSHD:
+            self._write_sshd_need_root_init_script()
+        elif feature == FEATURE__ACPID:
+            with self.chroot_session() as session:
+                self._make_service_autostart(session, 'acpid')
+
+    def _write_sshd_need_root_init_script(self):
         init_script_path = os.path.join(self._abs_mountpoint, 'etc/init.d/sshd-need-root')
         with open(init_script_path, 'w') as f:
             print(dedent("""\
@@ -298,40 +341,32 @@ class GentooStrategy(DistroStrategy):
                     """), file=f)
             os.fchmod(f.fileno(), 0o755)
 
-    def install_dhcp_client(self):
-        self._install_package_atoms(['net-misc/dhcpcd'])
-
-    def install_sudo(self):
-        self._set_package_use_flags('app-admin/sudo', '-sendmail')
-        self._install_package_atoms(['app-admin/sudo'])
-
     def _create_network_init_script_symlink(self, interface_name):
         net_service = 'net.%s' % interface_name
         net_init_script = os.path.join(self._abs_mountpoint, 'etc/init.d', net_service)
         os.symlink('net.lo', net_init_script)
         return net_service
 
-    def _make_service_autostart(self, service_name):
-        self._executor.check_call([
-            COMMAND_CHROOT,
-            self._abs_mountpoint,
+    def _make_service_autostart(self, session, service_name):
+        session.check_call([
             'rc-update',
             'add', service_name, 'default',
-            ], env=self.create_chroot_env())
+            ])
 
     def make_openstack_services_autostart(self):
         net_service = self._create_network_init_script_symlink('eth0')
 
-        for service in (
-                net_service,
-                'sshd',
-                'sshd-need-root',  # written by image-bootstrap above
-                'cloud-init-local',
-                'cloud-init',
-                'cloud-config',
-                'cloud-final',
-                ):
-            self._make_service_autostart(service)
+        with self.chroot_session() as session:
+            for service in (
+                    net_service,
+                    'sshd',
+                    'sshd-need-root',  # written by image-bootstrap above
+                    'cloud-init-local',
+                    'cloud-init',
+                    'cloud-config',
+                    'cloud-final',
+                    ):
+                self._make_service_autostart(session, service)
 
     def _mark_all_news_as_read(self):
         self._executor.check_call([
@@ -357,46 +392,70 @@ class GentooStrategy(DistroStrategy):
     def perform_post_chroot_clean_up(self):
         self._clean_distfiles()
 
+    def _get_directory_bootstrapper(self, architecture):
+        if self._directory_bootstrapper is None:
+            self._directory_bootstrapper = GentooBootstrapper(
+                    self._messenger,
+                    self._executor,
+                    None,  # i.e. target directory set later
+                    self._abs_cache_dir,
+                    architecture,
+                    self._mirror_url,
+                    self._max_age_days,
+                    self._stage3_date_triple_or_none,
+                    self._repository_date_triple_or_none,
+                    self._abs_resolv_conf,
+                    )
+        return self._directory_bootstrapper
+
+    def prefetch_directory_bootstrap(self, architecture, bootloader_approach):
+        self._get_directory_bootstrapper(architecture).prefetch()
+
     def run_directory_bootstrap(self, architecture, bootloader_approach):
         self._messenger.info('Bootstrapping %s into "%s"...'
                 % (self.DISTRO_NAME_SHORT, self._abs_mountpoint))
 
-        bootstrap = GentooBootstrapper(
-                self._messenger,
-                self._executor,
-                self._abs_mountpoint,
-                self._abs_cache_dir,
-                architecture,
-                self._mirror_url,
-                self._max_age_days,
-                self._stage3_date_triple_or_none,
-                self._repository_date_triple_or_none,
-                self._abs_resolv_conf,
-                )
+        bootstrap = self._get_directory_bootstrapper(architecture)
+        bootstrap.set_target_dir(self._abs_mountpoint)
         bootstrap.run()
 
-    def prepare_installation_of_packages(self):
+    def prepare_installation_of_packages(self, package_names):
         for chroot_abs_path in (
                 _ABS_PACKAGE_KEYWORDS,
                 _ABS_PACKAGE_MASK,
                 _ABS_PACKAGE_UNMASK,
                 _ABS_PACKAGE_USE,
                 ):
+            abs_dir = os.path.join(self._abs_mountpoint, chroot_abs_path.lstrip('/'))
             try:
-                os.makedirs(os.path.join(self._abs_mountpoint, chroot_abs_path.lstrip('/')), 0o755)
+                os.makedirs(abs_dir, 0o755)
             except OSError as e:
                 if e.errno != errno.EEXIST:
                     raise
 
-    def _enable_kernel_option(self, option_name):
-        self._executor.check_call([
-                COMMAND_CHROOT, self._abs_mountpoint,
+            # NOTE: A restored phase snapshot may come with entries
+            #       for packages of a different build
+            for basename in os.listdir(abs_dir):
+                abs_filename = os.path.join(abs_dir, basename)
+                if not os.path.isfile(abs_filename):
+                    continue
+                with open(abs_filename) as f:
+                    generated = f.readline().rstrip('\n') == _GENERATED_MARKER
+                if generated:
+                    os.remove(abs_filename)
+
+        # NOTE: All at once since the kernel gets installed
+        #       while other packages are being fetched
+        self._configure_portage_for(list(package_names) + _KERNEL_PACKAGES)
+
+    def _enable_kernel_option(self, session, option_name):
+        session.check_call([
                 '/usr/src/linux/scripts/config',
                 '--file', '/usr/src/linux/.config',
                 '--enable', option_name,
-                ], env=self.create_chroot_env())
+                ])
 
-    def _configure_kernel__enable_kvm_support(self):
+    def _configure_kernel__enable_kvm_support(self, session):
         tasks = dedent("""\
                 # Based on https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux.git/tree/kernel/configs/kvm_guest.config?h=v5.17.3
                 CONFIG_NET=y
@@ -440,7 +499,12 @@ class GentooStrategy(DistroStrategy):
             assert line.endswith('=y')
             option_name = line[len('CONFIG_'):-len('=y')]
 
-            self._enable_kernel_option(option_name)
+            self._enable_kernel_option(session, option_name)
+
+    def _configure_kernel__enable_root_fs_support(self, session):
+        for kernel_module in self._root_fs_kernel_modules:
+            for option_name in _KERNEL_OPTIONS_OF_KERNEL_MODULE[kernel_module]:
+                self._enable_kernel_option(session, option_name)
 
     def _configure_kernel__finish(self):
         self._executor.check_call([
@@ -458,13 +522,11 @@ class GentooStrategy(DistroStrategy):
                 ], env=self.create_chroot_env())
 
     def install_kernel(self):
-        self._set_package_keywords('sys-kernel/vanilla-sources', f'~{_HOST_ARCH}')
-        self._set_package_use_flags('sys-kernel/vanilla-sources', 'symlink')
-        self._install_package_atoms(['sys-kernel/vanilla-sources', 'sys-kernel/installkernel'])
+        self._install_packages(_KERNEL_PACKAGES)
 
         # This works around issues with Linux 6.19.3:
         # fatal error: bfd.h: No such file or directory
-        self._install_package_atoms(['sys-libs/binutils-libs'])
+        self._install_packages(['sys-libs/binutils-libs'])
 
         self._executor.check_call([
                 COMMAND_CHROOT, self._abs_mountpoint,
@@ -475,7 +537,10 @@ class GentooStrategy(DistroStrategy):
                 os.path.join(self._abs_mountpoint, 'usr/src/linux/.config.initial'),
                 )
 
-        self._configure_kernel__enable_kvm_support()
+        # NOTE: A single chroot session for the dozens of calls to scripts/config
+        with self.chroot_session() as session:
+            self._configure_kernel__enable_kvm_support(session)
+            self._configure_kernel__enable_root_fs_support(session)
         self._configure_kernel__finish()
 
         self._executor.check_call([
@@ -499,6 +564,14 @@ class GentooStrategy(DistroStrategy):
                 'rm', '-f', '/boot/vmlinuz.old',
                 ], env=self.create_chroot_env())
 
+    def get_packages_to_prefetch(self, features, with_openstack):
+        packages = super(GentooStrategy, self).get_packages_to_prefetch(features, with_openstack)
+        packages.append('sys-kernel/dracut')  # for generating the initramfs
+        return packages
+
+    def can_prefetch_packages_while_installing(self):
+        return True  # i.e. Portage locks distfiles individually
+
     def uses_systemd(self):
         return False
 
@@ -508,9 +581,14 @@ class GentooStrategy(DistroStrategy):
     def get_minimum_size_bytes(self):
         return 8 * 1024**3
 
-    def install_acpid(self):
-        self._install_package_atoms(['sys-power/acpid'])
-        self._make_service_autostart('acpid')
+    def get_phase_cache_inputs(self):
+        inputs = super(GentooStrategy, self).get_phase_cache_inputs()
+        inputs.update({
+            'mirror_url': self._mirror_url,
+            'repository_date': self._repository_date_triple_or_none,
+            'stage3_date': self._stage3_date_triple_or_none,
+        })
+        return inputs
 
     @classmethod
     def add_parser_to(clazz, distros):
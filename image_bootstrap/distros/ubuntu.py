@@ -14,6 +14,9 @@ class UbuntuStrategy(DebianBasedDistroStrategy):
     DEFAULT_RELEASE = 'trusty'
     DEFAULT_MIRROR_URL = 'http://archive.ubuntu.com/ubuntu'
     APT_CACHER_NG_URL = 'http://localhost:3142/ubuntu'
+    # NOTE: Not cloud-initramfs-growroot (from universe)
+    #       since cloud-init and growpart alone work just fine
+    CLOUD_INIT_PACKAGES = ['cloud-init', 'cloud-utils']
 
     def select_bootloader(self):
         return BOOTLOADER__HOST_EXTLINUX
@@ -49,11 +52,6 @@ class UbuntuStrategy(DebianBasedDistroStrategy):
         with open(etc_default_grub, 'w') as f:
             f.write('\n'.join(lines_to_write))
 
-    def install_cloud_init_and_friends(self):
-        # Do not install cloud-initramfs-growroot (from universe)
-        # if cloud-init and growpart alone work just fine
-        self._install_packages(['cloud-init', 'cloud-utils'])
-
     def uses_systemd(self):
         # NOTE: assumes not supporting anything older than trusty
         return self._release != 'trusty'
@@ -3,6 +3,7 @@
 
 
 
+import copy
 import errno
 import os
 import pwd
@@ -10,30 +11,57 @@ import stat
 import subprocess
 import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from textwrap import dedent
 
 from directory_bootstrap.shared.byte_size import format_byte_size
 from directory_bootstrap.shared.commands import (
-        COMMAND_BLKID, COMMAND_BLOCKDEV, COMMAND_CHMOD, COMMAND_CHROOT,
-        COMMAND_CP, COMMAND_EXTLINUX, COMMAND_FIND, COMMAND_INSTALL_MBR,
-        COMMAND_KPARTX, COMMAND_MKDIR, COMMAND_MKFS_EXT4, COMMAND_MOUNT,
-        COMMAND_PARTED, COMMAND_PARTPROBE, COMMAND_RM, COMMAND_RMDIR,
-        COMMAND_SED, COMMAND_TUNE2FS, EXIT_COMMAND_NOT_FOUND,
-        check_call__keep_trying, check_for_commands, find_command)
-from directory_bootstrap.shared.mount import COMMAND_UMOUNT, try_unmounting
+        COMMAND_CHMOD, COMMAND_CHROOT, COMMAND_CP, COMMAND_EXTLINUX,
+        COMMAND_FIND, COMMAND_FSTRIM, COMMAND_INSTALL_MBR, COMMAND_KPARTX,
+        COMMAND_LOSETUP, COMMAND_MKDIR, COMMAND_MOUNT, COMMAND_RM,
+        COMMAND_RMDIR, COMMAND_SED, COMMAND_TAR, COMMAND_TUNE2FS,
+        EXIT_COMMAND_NOT_FOUND, check_call__keep_trying, check_for_commands,
+        find_command)
+from directory_bootstrap.shared.metadata import VERSION_STR
+from directory_bootstrap.shared.mount import (
+        COMMAND_UMOUNT, mount, try_unmounting)
 from directory_bootstrap.shared.namespace import (
         set_hostname, unshare_current_process)
 from directory_bootstrap.shared.resolv_conf import filter_copy_resolv_conf
+from directory_bootstrap.shared.waiting import wait_until
+from image_bootstrap.block_device import (
+        get_logical_sector_size, get_size_bytes, is_below_dev,
+        reread_partition_table, try_disabling_compression)
+from image_bootstrap.boot_loaders.extlinux import BOOTLOADER__HOST_EXTLINUX
 from image_bootstrap.boot_loaders.grub2 import (
         BOOTLOADER__CHROOT_GRUB2, BOOTLOADER__CHROOT_GRUB2__DEVICE,
-        BOOTLOADER__CHROOT_GRUB2__DRIVE, BOOTLOADER__HOST_GRUB2__DEVICE,
-        BOOTLOADER__HOST_GRUB2__DRIVE, GrubTwoInstaller)
-from image_bootstrap.mount import MountFinder
+        BOOTLOADER__CHROOT_GRUB2__DRIVE, BOOTLOADER__HOST_GRUB2,
+        BOOTLOADER__HOST_GRUB2__DEVICE, BOOTLOADER__HOST_GRUB2__DRIVE,
+        GrubTwoInstaller)
+from image_bootstrap.fan_out import copy_to_many
+from image_bootstrap.file_systems.base import BUILD_PROFILE__SAFE
+from image_bootstrap.file_systems.btrfs import BtrfsRootFileSystem
+from image_bootstrap.file_systems.ext4 import ROOT_FS__EXT4, Ext4RootFileSystem
+from image_bootstrap.file_systems.squashfs import (
+        ROOT_FS__SQUASHFS, SquashfsRootFileSystem)
+from image_bootstrap.journal import StepJournal
+from image_bootstrap.mbr import (
+        get_first_partition_layout, get_first_partition_partuuid,
+        resize_first_partition, set_disk_id, write_single_partition_table)
+from image_bootstrap.mount import unmount_tree
+from image_bootstrap.output import (
+        get_commands_for_output_format, write_output)
+from image_bootstrap.phase_cache import (
+        PHASE__BASE, PHASE__KERNEL, PHASE__PACKAGES, PHASE__SCRIPTS,
+        PHASE__SETUP, PHASES, PhaseCache, compute_phase_keys,
+        digest_directory, digest_text)
+from image_bootstrap.steps import (
+        RESOURCE__PACKAGE_MANAGER, StepGraph, StepTimings, run_step_graph)
+from image_bootstrap.types.disk_id import DiskIdentifier
 from image_bootstrap.types.uuid import require_valid_uuid
 
 BOOTLOADER__AUTO = 'auto'
-BOOTLOADER__HOST_EXTLINUX = 'host-extlinux'
 BOOTLOADER__NONE = 'none'
 
 
@@ -43,28 +71,45 @@ BOOTLOADER__ANY_GRUB = (
         BOOTLOADER__HOST_GRUB2__DEVICE,
         BOOTLOADER__HOST_GRUB2__DRIVE,
         )
-BOOTLOADER__HOST_GRUB2 = (
-        BOOTLOADER__HOST_GRUB2__DEVICE,
-        BOOTLOADER__HOST_GRUB2__DRIVE,
+
+# NOTE: Features that need packages installed, see DistroStrategy.get_packages_for
+FEATURE__GRUB2 = 'grub2'
+FEATURE__DHCP_CLIENT = 'dhcp-client'
+FEATURE__SUDO = 'sudo'
+FEATURE__CLOUD_INIT = 'cloud-init'
+FEATURE__SSHD = 'sshd'
+FEATURE__ACPID = 'acpid'
+
+
+_ROOT_FILE_SYSTEM_CLASSES = (
+        Ext4RootFileSystem,
+        BtrfsRootFileSystem,
+        SquashfsRootFileSystem,
         )
 
+ROOT_FSES = tuple(clazz.KEY for clazz in _ROOT_FILE_SYSTEM_CLASSES)
+
+_ROOT_OVERLAY_INIT = '/sbin/image-bootstrap-overlay-init'
+_ROOT_OVERLAY_DIR = '/media/root-rw'
+
 
 _MOUNTPOINT_PARENT_DIR = '/mnt'
 _CHROOT_SCRIPT_TARGET_DIR = 'root/chroot-scripts/'
 
+# NOTE: Tuples of source, file system type, options, target
 _NON_DISK_MOUNT_TASKS = (
-        ('devtmpfs', ['-t', 'devtmpfs'], 'dev'),
-        ('devpts', ['-t', 'devpts'], 'dev/pts'),
-        ('tmpfs', ['-t', 'tmpfs', '-o', 'mode=1777'], 'dev/shm'),
-        ('proc', ['-t', 'proc'], 'proc'),
-        ('sysfs', ['-t', 'sysfs'], 'sys'),
+        ('devtmpfs', 'devtmpfs', None, 'dev'),
+        ('devpts', 'devpts', None, 'dev/pts'),
+        ('tmpfs', 'tmpfs', 'mode=1777', 'dev/shm'),
+        ('proc', 'proc', None, 'proc'),
+        ('sysfs', 'sysfs', None, 'sys'),
         )
 
-_DISK_ID_OFFSET = 440
-_DISK_ID_COUNT_BYTES = 4
-
 _CONSOLE_CONFIG = 'console=tty0 console=ttyS0,115200'
 
+# NOTE: Compiled kernels embed the hostname they were built on
+_KERNEL_BUILD_HOSTNAME = 'image-bootstrap'
+
 
 class _script_filename_telling_exceptions(object):
     """
@@ -107,6 +152,16 @@ class MachineConfig(object):
         self.bootloader_force = bootloader_force
         self.with_openstack = with_openstack
 
+    def copy_without_identifiers(self):
+        """
+        Identifiers need to differ across images, so there is no sharing.
+        """
+        machine_config = copy.copy(self)
+        machine_config.disk_id = None
+        machine_config.first_partition_uuid = None
+        machine_config.machine_id = None
+        return machine_config
+
 
 class BootstrapEngine(object):
     def __init__(self,
@@ -118,6 +173,19 @@ class BootstrapEngine(object):
             abs_scripts_dir_post,
             abs_target_path,
             command_grub2_install,
+            abs_phase_cache_dir=None,
+            abs_journal_filename=None,
+            resume=False,
+            image_size_bytes=None,
+            build_profile=BUILD_PROFILE__SAFE,
+            compact=False,
+            shrink_headroom_bytes=None,
+            output_format=None,
+            abs_output_path=None,
+            root_fs=ROOT_FS__EXT4,
+            root_overlay=False,
+            timings=False,
+            abs_cache_dir=None,
             ):
         self._messenger = messenger
         self._executor = executor
@@ -129,16 +197,55 @@ class BootstrapEngine(object):
         self._abs_scripts_dir_chroot = abs_scripts_dir_chroot
         self._abs_scripts_dir_post = abs_scripts_dir_post
         self._abs_target_path = abs_target_path
+        self._abs_image_file = None
+        self._image_size_bytes = image_size_bytes
+        self._build_profile = build_profile
+        self._compact = compact or (shrink_headroom_bytes is not None)
+        self._shrink_headroom_bytes = shrink_headroom_bytes
+        self._shrunk_image_size_bytes = None
+        self._output_format = output_format
+        self._abs_output_path = abs_output_path
+        self._root_fs = {clazz.KEY: clazz for clazz in _ROOT_FILE_SYSTEM_CLASSES}[root_fs](
+                messenger, executor, build_profile)
+        self._root_overlay = root_overlay
+        self._abs_squashfs_file = None
+        self._abs_cache_dir = abs_cache_dir
 
         self._command_grub2_install = command_grub2_install
 
         self._abs_mountpoint = None
         self._abs_first_partition_device = None
 
+        if abs_phase_cache_dir is None:
+            self._phase_cache = None
+        else:
+            self._phase_cache = PhaseCache(messenger, executor, abs_phase_cache_dir)
+        self._phase_keys = None
+        self._restored_phase_index = None
+        self._snapshot_first_partition_uuid = None
+
+        if abs_journal_filename is None:
+            self._journal = None
+        else:
+            self._journal = StepJournal(messenger, abs_journal_filename, abs_target_path)
+        self._resume = resume
+        self._resuming = False
+
+        self._step_timings = StepTimings() if timings else None
+
+        self._prefetch_pool = None
+        self._prefetch_future = None
+
+        self._pid_namespace = None
+
         self._distro = None
 
     def set_distro(self, distro):
         distro.set_chroot_env_prototype(self.make_environment(tell_mountpoint=False))
+        kernel_modules = self._root_fs.KERNEL_MODULES
+        if self._root_overlay:
+            kernel_modules = kernel_modules + ['overlay']
+        distro.set_root_fs_kernel_modules(kernel_modules)
         self._distro = distro
 
     def check_release(self):
@@ -150,28 +257,40 @@ class BootstrapEngine(object):
             self._messenger.info('Selected approach "%s" for bootloader installation.'
                     % self._config.bootloader_approach)
 
+        self._root_fs.check_bootloader_approach(self._config.bootloader_approach)
+
     def get_commands_to_check_for(self):
         res = list(self._distro.get_commands_to_check_for())
         res += [
-                COMMAND_BLKID,
-                COMMAND_BLOCKDEV,
                 COMMAND_CHMOD,
                 COMMAND_CHROOT,
                 COMMAND_CP,
                 COMMAND_FIND,
                 COMMAND_KPARTX,
                 COMMAND_MKDIR,
-                COMMAND_MKFS_EXT4,
                 COMMAND_MOUNT,
-                COMMAND_PARTED,
-                COMMAND_PARTPROBE,
                 COMMAND_RM,
                 COMMAND_RMDIR,
                 COMMAND_SED,
-                COMMAND_TUNE2FS,
                 COMMAND_UMOUNT,
                 self._command_grub2_install,
                 ]
+        res += self._root_fs.get_commands_to_check_for()
+
+        if self._phase_cache is not None:
+            res.append(COMMAND_TAR)
+
+        if self._target_is_image_file():
+            res.append(COMMAND_LOSETUP)
+
+        if self._compact:
+            res.append(COMMAND_FSTRIM)
+
+        if self._abs_output_path is not None:
+            res += get_commands_for_output_format(self._output_format)
+
+        if self._shrink_headroom_bytes is not None:
+            res += self._root_fs.get_commands_to_check_for_shrinking()
 
         if self._config.bootloader_approach == BOOTLOADER__HOST_EXTLINUX:
             res += [
@@ -221,11 +340,31 @@ class BootstrapEngine(object):
     def check_for_commands(self):
         check_for_commands(self._messenger, self.get_commands_to_check_for())
 
+    def _target_is_image_file(self):
+        try:
+            props = os.stat(self._abs_target_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return True
+        return stat.S_ISREG(props.st_mode)
+
     def check_target_block_device(self):
-        self._messenger.info('Checking if "%s" is a block device...' % self._abs_target_path)
+        self._messenger.info('Checking if "%s" is a block device or image file...' % self._abs_target_path)
+        if self._target_is_image_file():
+            if not os.path.exists(self._abs_target_path):
+                if self._image_size_bytes is None:
+                    raise OSError(errno.ENOENT, 'Image file "%s" does not exist, '
+                            'please pass --image-size SIZE to have it created.' % self._abs_target_path)
+                if is_below_dev(self._abs_target_path):
+                    # NOTE: Most likely a mistyped block device, /dev is (RAM-backed) devtmpfs
+                    raise OSError(errno.ENOENT, 'Device "%s" does not exist; '
+                            'image files are not created below /dev.' % self._abs_target_path)
+            return
+
         props = os.stat(self._abs_target_path)
         if not stat.S_ISBLK(props.st_mode):
-            raise OSError(errno.ENOTBLK, 'Not a block device: "%s"' % self._abs_target_path)
+            raise OSError(errno.ENOTBLK, 'Neither a block device nor a regular file: "%s"' % self._abs_target_path)
 
     def check_architecture(self):
         self._messenger.info('Checking for known unsupported architecture/machine combination...')
@@ -291,17 +430,29 @@ class BootstrapEngine(object):
             self._messenger.info_gap()
 
     def _unshare(self):
-        unshare_current_process(self._messenger)
+        self._pid_namespace = unshare_current_process(self._messenger, pid_namespace=True)
         set_hostname(self._config.hostname)
 
+    def _kill_stray_processes(self):
+        # NOTE: Daemons started in the chroot would keep mounts busy
+        if self._pid_namespace is None:
+            return
+        self._messenger.info('Killing left-over processes (if any)...')
+        self._pid_namespace.kill_all_processes()
+
+    def _close_pid_namespace(self):
+        if self._pid_namespace is None:
+            return
+        self._pid_namespace.close()
+        self._pid_namespace = None
+
     def _check_device_size(self):
         self._messenger.info('Checking size of "%s"...' % self._abs_target_path)
-        blockdev_output = self._executor.check_output([
-                COMMAND_BLOCKDEV,
-                '--getsize64',
-                self._abs_target_path,
-                ])
-        size_bytes_found = int(blockdev_output)
+        fd = os.open(self._abs_target_path, os.O_RDONLY)
+        try:
+            size_bytes_found = get_size_bytes(fd)
+        finally:
+            os.close(fd)
         size_bytes_needed = self._distro.get_minimum_size_bytes()
         if size_bytes_found < size_bytes_needed:
             raise OSError(errno.ENOSPC, 'Device "%s" is %s in size, %s or more needed.' % (
@@ -311,39 +462,26 @@ class BootstrapEngine(object):
                     ))
 
     def _partition_device(self):
-        self._messenger.info('Partitioning "%s"...' % self._abs_target_path)
-        cmd_mklabel = [
-                COMMAND_PARTED,
-                '--script',
-                self._abs_target_path,
-                'mklabel', 'msdos',
-                ]
-        self._executor.check_call(cmd_mklabel)
-
-        # Make existing partition devices leave
-        check_call__keep_trying(self._executor, [
-                COMMAND_PARTPROBE,
-                self._abs_target_path,
-                ])
-
-        cmd_mkpart = [
-                COMMAND_PARTED,
-                '--script',
-                '--align', 'optimal',
-                self._abs_target_path,
-                'mkpart',
-                'primary', 'ext4', '1', '100%',
-                ]
-        self._executor.check_call(cmd_mkpart)
+        disk_id = self._config.disk_id or DiskIdentifier.random()
+        self._messenger.info('Partitioning "%s" (with MBR disk identifier %s)...'
+                % (self._abs_target_path, disk_id))
+        fd = os.open(self._abs_target_path, os.O_RDWR)
+        try:
+            write_single_partition_table(fd,
+                    disk_id.byte_sequence(),
+                    get_size_bytes(fd),
+                    get_logical_sector_size(fd))
 
-        cmd_boot_flag = [
-                COMMAND_PARTED,
-                '--script',
-                self._abs_target_path,
-                'set', '1', 'boot', 'on',
-                ]
-        time.sleep(1)  # increase chances of first call working, e.g. with LVM volumes
-        check_call__keep_trying(self._executor, cmd_boot_flag)
+            # Make existing partition devices leave
+            try:
+                reread_partition_table(fd)
+            except OSError as e:
+                if e.errno != errno.EBUSY:
+                    raise
+                self._messenger.warn('Kernel did not re-read partition table of "%s": %s'
+                        % (self._abs_target_path, os.strerror(e.errno)))
+        finally:
+            os.close(fd)
 
     def _create_partition_devices(self):
         self._messenger.info('Activating partition devices...')
@@ -367,41 +505,25 @@ class BootstrapEngine(object):
                     '-a', self._abs_target_path,
                     ])
 
-        for i in range(3):
-            if os.path.exists(self._abs_first_partition_device):
-                break
-            time.sleep(1)
-        else:
+        abs_first_partition_device = self._abs_first_partition_device
+        if not wait_until(lambda: os.path.exists(abs_first_partition_device),
+                abs_watch_dir=os.path.dirname(abs_first_partition_device)):
             raise OSError(errno.ENOENT, "No such block device file: '%s'" \
-                    % self._abs_first_partition_device)
+                    % abs_first_partition_device)
 
     def _format_partitions(self):
-        self._messenger.info('Creating file system on "%s"...' % self._abs_first_partition_device)
-        cmd = [
-                COMMAND_MKFS_EXT4,
-                '-F',
-        ]
-
-        if self._config.bootloader_approach == BOOTLOADER__HOST_EXTLINUX:
-            self._messenger.warn('Creating ext4 file system with '
-                    'feature "64bit" disabled '
-                    'to ensure bootability with extlinux.')
-            self._messenger.warn('Please see '
-                    'https://github.com/hartwork/image-bootstrap/issues/44'
-                    ' for details.')
-            cmd += ['-O', '^64bit']
-
-        cmd += self._distro.get_extra_mkfs_ext4_options()
-
-        cmd += [
+        self._root_fs.create(
                 self._abs_first_partition_device,
-                ]
-        self._executor.check_call(cmd)
+                self._config.first_partition_uuid,
+                self._config.bootloader_approach,
+                self._distro.get_extra_mkfs_ext4_options(),
+                )
 
     def _mkdir_mountpount(self):
         self._abs_mountpoint = tempfile.mkdtemp(dir=_MOUNTPOINT_PARENT_DIR)
         self._messenger.info('Creating directory "%s"...' % self._abs_mountpoint)
-        self._distro.set_mountpoint(self._abs_mountpoint)
+        if self._distro is not None:
+            self._distro.set_mountpoint(self._abs_mountpoint)
 
     def _mkdir_mountpount_etc(self):
         abs_dir = os.path.join(self._abs_mountpoint, 'etc')
@@ -415,19 +537,145 @@ class BootstrapEngine(object):
                 self._abs_first_partition_device,
                 self._abs_mountpoint,
                 ]
+        mount_options = self._root_fs.get_build_mount_options()
+        if mount_options:
+            cmd += ['-o', ','.join(mount_options)]
         self._executor.check_call(cmd)
 
+    def _sync_disk_chroot_mounts(self):
+        mount_options = self._root_fs.get_build_remount_options()
+        if mount_options:
+            self._messenger.info('Re-mounting "%s" with options %s...'
+                    % (self._abs_mountpoint, ','.join(mount_options)))
+            self._executor.check_call([
+                    COMMAND_MOUNT,
+                    '-o', ','.join(['remount'] + mount_options),
+                    self._abs_mountpoint,
+                    ])
+
+        self._messenger.info('Syncing file systems...')
+        os.sync()
+
+    def _discard_free_blocks(self):
+        self._messenger.info('Discarding unused blocks of file system "%s"...' % self._abs_mountpoint)
+        try:
+            self._executor.check_call([
+                    COMMAND_FSTRIM,
+                    self._abs_mountpoint,
+                    ])
+        except subprocess.CalledProcessError:
+            self._messenger.info('Discarding is not supported for "%s".' % self._abs_target_path)
+            return False
+        return True
+
+    def _zero_free_blocks(self):
+        abs_filename = os.path.join(self._abs_mountpoint, 'image-bootstrap-zeros')
+        self._messenger.info('Zeroing unused blocks of file system "%s" (by writing file "%s")...'
+                % (self._abs_mountpoint, abs_filename))
+        zeros = bytes(4 * 1024 * 1024)
+        try:
+            with open(abs_filename, 'wb') as f:
+                # NOTE: Compressed zeros would not fill up the file system
+                try_disabling_compression(f.fileno())
+                try:
+                    while True:
+                        f.write(zeros)
+                except OSError as e:
+                    if e.errno != errno.ENOSPC:
+                        raise
+                os.fsync(f.fileno())
+        finally:
+            os.remove(abs_filename)
+
+    def _compact_file_system(self):
+        if not self._compact:
+            return
+
+        # NOTE: Discarding blocks of image files punches holes, so the
+        #       blocks read as zeros.  Block devices give no such guarantee.
+        if self._abs_image_file is not None:
+            if not self._discard_free_blocks():
+                self._zero_free_blocks()
+        else:
+            self._zero_free_blocks()
+            self._discard_free_blocks()  # e.g. to give space back to thin pools
+
+    def _shrink_file_system(self):
+        if self._shrink_headroom_bytes is None:
+            return
+
+        size_bytes = self._root_fs.shrink(self._abs_first_partition_device,
+                self._shrink_headroom_bytes)
+        if size_bytes is None:
+            return
+
+        fd = os.open(self._abs_target_path, os.O_RDWR)
+        try:
+            sector_size_bytes = get_logical_sector_size(fd)
+            first_sector, _ = get_first_partition_layout(fd)
+            sector_count = size_bytes // sector_size_bytes
+            self._messenger.info('Shrinking first partition of "%s" to match...' % self._abs_target_path)
+            resize_first_partition(fd, sector_count)
+        finally:
+            os.close(fd)
+
+        if self._abs_image_file is not None:
+            self._shrunk_image_size_bytes = (first_sector + sector_count) * sector_size_bytes
+
+    def _truncate_shrunk_image_file(self):
+        if self._shrunk_image_size_bytes is None:
+            return
+
+        self._messenger.info('Truncating image file "%s" to %s...' % (
+                self._abs_target_path, format_byte_size(self._shrunk_image_size_bytes)))
+        os.truncate(self._abs_target_path, self._shrunk_image_size_bytes)
+
+    def _finish_file_system(self):
+        self._root_fs.finish(self._abs_first_partition_device)
+
     def run_directory_bootstrap(self):
         return self._distro.run_directory_bootstrap(
                 self._config.architecture,
                 self._config.bootloader_approach,
                 )
 
+    def _directory_bootstrap_may_be_needed(self):
+        if self._journal is not None and self._journal.is_completed('run-directory-bootstrap'):
+            return False
+        if self._resuming or self._phase_cache is None:
+            return True
+        return self._phase_cache.find_latest(self._phase_keys) is None
+
+    def _start_prefetching_directory_bootstrap(self):
+        if not self._directory_bootstrap_may_be_needed():
+            return
+
+        # NOTE: Downloading and verifying does not need the target, so it can
+        #       happen while partitions are being formatted and mounted
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=1)
+        self._prefetch_future = self._prefetch_pool.submit(
+                self._distro.prefetch_directory_bootstrap,
+                self._config.architecture,
+                self._config.bootloader_approach,
+                )
+
+    def _finish_prefetching_directory_bootstrap(self):
+        if self._prefetch_future is None:
+            return
+
+        self._prefetch_future.result()  # i.e. wait and re-raise errors, if any
+
+    def _stop_prefetching_directory_bootstrap(self):
+        if self._prefetch_pool is None:
+            return
+
+        self._prefetch_pool.shutdown(wait=True)
+        self._prefetch_pool = None
+        self._prefetch_future = None
+
     def _unmount_directory_bootstrap_leftovers(self):
-        mounts = MountFinder()
-        mounts.load()
-        for abs_mount_point in reversed(list(mounts.below(self._abs_mountpoint))):
-            self._try_unmounting(abs_mount_point)
+        self._kill_stray_processes()
+        unmount_tree(self._messenger, self._executor, self._abs_mountpoint)
 
     def _set_root_password_inside_chroot(self):
         self._messenger.info('Setting root password...')
@@ -459,23 +707,37 @@ class BootstrapEngine(object):
                 ]
         self._executor.check_call(cmd)
 
-    def _gather_first_partition_uuid(self):
-        cmd_blkid = [
-                COMMAND_BLKID,
-                '-o', 'value',
-                '-s', 'UUID',
-                self._abs_first_partition_device,
-                ]
-        output = self._executor.check_output(cmd_blkid)
-        first_partition_uuid = output.rstrip().decode('utf-8')
+    def _read_first_partition_uuid(self):
+        fd = os.open(self._abs_first_partition_device, os.O_RDONLY)
+        try:
+            first_partition_uuid = self._root_fs.read_uuid(fd)
+        finally:
+            os.close(fd)
         require_valid_uuid(first_partition_uuid)
-        self._config.first_partition_uuid = first_partition_uuid
+        return first_partition_uuid
+
+    def _gather_first_partition_uuid(self):
+        self._config.first_partition_uuid = self._read_first_partition_uuid()
+
+    def _read_first_partition_partuuid(self):
+        fd = os.open(self._abs_target_path, os.O_RDONLY)
+        try:
+            return get_first_partition_partuuid(fd)
+        finally:
+            os.close(fd)
 
     def _create_etc_fstab(self):
         filename = os.path.join(self._abs_mountpoint, 'etc', 'fstab')
         self._messenger.info('Writing file "%s"...' % filename)
         f = open(filename, 'w')
-        print('/dev/disk/by-uuid/%s / auto defaults 0 1' % self._config.first_partition_uuid, file=f)
+        if self._root_overlay:
+            # NOTE: A root entry would have the overlay remounted read-only
+            print('# / is a tmpfs overlay on top of a read-only file system, see %s'
+                    % _ROOT_OVERLAY_INIT, file=f)
+        else:
+            print(self._root_fs.get_etc_fstab_root_entry(
+                    self._config.first_partition_uuid,
+                    self._read_first_partition_partuuid()), file=f)
         f.close()
 
     def _create_etc_machine_id(self):
@@ -492,6 +754,11 @@ class BootstrapEngine(object):
         use_mtu_tristate = True if self._config.with_openstack else None
         return self._distro.create_network_configuration(use_mtu_tristate)
 
+    def _generate_grub_cfg(self):
+        self._messenger.info('Generating GRUB configuration...')
+        self.generate_grub_cfg_from_inside_chroot()
+        self._fix_grub_cfg_root_device()
+
     def _fix_grub_cfg_root_device(self):
         self._messenger.info('Post-processing GRUB config...')
         cmd_sed = [
@@ -540,23 +807,14 @@ class BootstrapEngine(object):
 
     def _mount_nondisk_chroot_mounts(self):
         self._messenger.info('Mounting non-disk file systems...')
-        for source, options, target in _NON_DISK_MOUNT_TASKS:
-            cmd = [
-                    COMMAND_MOUNT,
-                    source,
-                    ] \
-                    + options \
-                    + [
-                        os.path.join(self._abs_mountpoint, target),
-                    ]
-            self._executor.check_call(cmd)
+        for source, fs_type, options, target in _NON_DISK_MOUNT_TASKS:
+            mount(self._messenger, self._executor, source,
+                    os.path.join(self._abs_mountpoint, target),
+                    fs_type=fs_type, options=options)
 
     def get_chroot_command_grub2_install(self):
         return self._distro.get_chroot_command_grub2_install()
 
-    def _ensure_chroot_has_grub2_installed(self):
-        self._distro.ensure_chroot_has_grub2_installed()
-
     def _install_bootloader__extlinux(self):
         assert self._config.first_partition_uuid
         d = {
@@ -571,7 +829,7 @@ class BootstrapEngine(object):
         boot_extlinux = os.path.join(self._abs_mountpoint, 'boot/extlinux/')
         extlinux_conf = os.path.join(boot_extlinux, 'extlinux.conf')
 
-        os.makedirs(boot_extlinux)
+        os.makedirs(boot_extlinux, exist_ok=True)  # e.g. with restored snapshots
 
         self._messenger.info('Writing file "%s"...' % extlinux_conf)
         with open(extlinux_conf, 'w') as f:
@@ -616,6 +874,124 @@ class BootstrapEngine(object):
                 )
         installer.run()
 
+    def _write_root_overlay_init(self):
+        os.makedirs(os.path.join(self._abs_mountpoint, _ROOT_OVERLAY_DIR.lstrip('/')),
+                0o755, exist_ok=True)
+
+        abs_filename = os.path.join(self._abs_mountpoint, _ROOT_OVERLAY_INIT.lstrip('/'))
+        self._messenger.info('Writing file "%s"...' % abs_filename)
+        with open(abs_filename, 'w') as f:
+            print(dedent("""\
+                    #! /bin/sh
+                    # Written by image-bootstrap.  Runs the actual init on top of
+                    # a writable tmpfs overlay of the read-only root file system,
+                    # so all changes are lost on reboot.
+                    set -e
+                    modprobe overlay 2>/dev/null || true
+                    mount -t tmpfs -o mode=0755 tmpfs %(dir)s
+                    mkdir %(dir)s/upper %(dir)s/work %(dir)s/root
+                    mount -t overlay -o lowerdir=/,upperdir=%(dir)s/upper,workdir=%(dir)s/work overlay %(dir)s/root
+                    exec switch_root %(dir)s/root /sbin/init "$@"
+                    """ % {'dir': _ROOT_OVERLAY_DIR}), end='', file=f)
+            os.fchmod(f.fileno(), 0o755)
+
+    def _install_bootloader__grub2_for_squashfs(self):
+        # NOTE: GRUB cannot find squashfs by UUID, and grub-mkconfig as well as
+        #       grub-install would probe the ext4 file system we build in.
+        #       So the configuration is ours and the core image points
+        #       to the first partition of the boot drive, directly.
+        d = {
+            'distro_name_long': self._distro.DISTRO_NAME_LONG,
+            'kernel_extra': (' %s' % _CONSOLE_CONFIG) if self._config.with_openstack else '',
+            'partuuid': self._read_first_partition_partuuid(),
+            'vmlinuz': self._distro.get_vmlinuz_path(),
+            'initramfs': self._distro.get_initramfs_path(),
+        }
+        if self._root_overlay:
+            d['kernel_extra'] += ' init=%s' % _ROOT_OVERLAY_INIT
+
+        grub_cfg = os.path.join(self._abs_mountpoint, 'boot', 'grub', 'grub.cfg')
+        self._messenger.info('Writing file "%s"...' % grub_cfg)
+        with open(grub_cfg, 'w') as f:
+            print(dedent("""\
+                    set timeout=1
+
+                    insmod part_msdos
+                    insmod squash4
+
+                    menuentry '%(distro_name_long)s' {
+                        linux %(vmlinuz)s root=PARTUUID=%(partuuid)s rootfstype=squashfs ro%(kernel_extra)s
+                        initrd %(initramfs)s
+                    }
+                    """ % d), end='', file=f)
+
+        command_grub2_install = self.get_chroot_command_grub2_install()
+        env = self.make_environment(tell_mountpoint=False)
+
+        self._messenger.info('Creating GRUB core image for squashfs...')
+        self._executor.check_call([
+                COMMAND_CHROOT, self._abs_mountpoint,
+                command_grub2_install.replace('-install', '-mkimage'),
+                '--format=i386-pc',
+                '--output=/boot/grub/i386-pc/core.img',
+                '--prefix=(,msdos1)/boot/grub',
+                'biosdisk', 'part_msdos', 'squash4',
+                ], env=env)
+
+        real_abs_target = os.path.realpath(self._abs_target_path)
+        self._messenger.info('Installing GRUB boot sector to device "%s"...' % real_abs_target)
+        cmd = [
+                COMMAND_CHROOT, self._abs_mountpoint,
+                command_grub2_install.replace('-install', '-bios-setup'),
+                '--directory=/boot/grub/i386-pc',
+                '--skip-fs-probe',
+                ]
+        if self._config.bootloader_force:
+            cmd.append('--force')
+        cmd.append(real_abs_target)
+        self._executor.check_call(cmd, env=env)
+
+    def _create_squashfs_file(self):
+        if self._root_fs.KEY != ROOT_FS__SQUASHFS:
+            return
+
+        # NOTE: The default temp directory is often (too small a) tmpfs
+        if self._abs_cache_dir is not None:
+            os.makedirs(self._abs_cache_dir, 0o700, exist_ok=True)
+        fd, self._abs_squashfs_file = tempfile.mkstemp(prefix='image-bootstrap-',
+                suffix='.squashfs', dir=self._abs_cache_dir)
+        os.close(fd)
+
+        self._root_fs.pack(self._abs_mountpoint, self._abs_squashfs_file)
+
+    def _write_squashfs_file_to_first_partition(self):
+        if self._abs_squashfs_file is None:
+            return
+
+        copy_to_many(self._messenger, self._abs_squashfs_file, [self._abs_first_partition_device])
+
+        fd = os.open(self._abs_target_path, os.O_RDWR)
+        try:
+            sector_size_bytes = get_logical_sector_size(fd)
+            first_sector, _ = get_first_partition_layout(fd)
+            sector_count = -(-os.stat(self._abs_squashfs_file).st_size // sector_size_bytes)
+            self._messenger.info('Shrinking first partition of "%s" to fit squashfs...'
+                    % self._abs_target_path)
+            resize_first_partition(fd, sector_count)
+        finally:
+            os.close(fd)
+
+        if self._abs_image_file is not None:
+            self._shrunk_image_size_bytes = (first_sector + sector_count) * sector_size_bytes
+
+    def _remove_squashfs_file(self):
+        if self._abs_squashfs_file is None:
+            return
+
+        self._messenger.info('Removing file "%s"...' % self._abs_squashfs_file)
+        os.remove(self._abs_squashfs_file)
+        self._abs_squashfs_file = None
+
     def adjust_grub_defaults(self):
         res = self._distro.adjust_grub_defaults(self._config.with_openstack)
 
@@ -712,13 +1088,13 @@ class BootstrapEngine(object):
         self._executor.check_call(cmd_rmdir)
 
     def _try_unmounting(self, abs_path):
-        return try_unmounting(self._executor, abs_path)
+        return try_unmounting(self._messenger, self._executor, abs_path)
 
     def _unmount_nondisk_chroot_mounts(self):
+        self._kill_stray_processes()
         self._messenger.info('Unmounting non-disk file systems...')
-        for source, options, target in reversed(_NON_DISK_MOUNT_TASKS):
-            abs_path = os.path.join(self._abs_mountpoint, target)
-            self._try_unmounting(abs_path)
+        # NOTE: Also covers anything that chroot scripts may have mounted
+        unmount_tree(self._messenger, self._executor, self._abs_mountpoint)
 
     def _perform_in_chroot_shipping_clean_up(self):
         self._distro.perform_in_chroot_shipping_clean_up()
@@ -733,6 +1109,7 @@ class BootstrapEngine(object):
             self._run_scripts_from(self._abs_scripts_dir_post, env)
 
     def _unmount_disk_chroot_mounts(self):
+        self._kill_stray_processes()
         self._messenger.info('Unmounting partitions...')
         self._try_unmounting(self._abs_mountpoint)
 
@@ -743,32 +1120,34 @@ class BootstrapEngine(object):
                 '-d',
                 self._abs_target_path,
                 ]
-        check_call__keep_trying(self._executor, cmd)
+        if not check_call__keep_trying(self._executor, cmd):
+            self._messenger.warn('Deactivating partition devices of "%s" failed, giving up.'
+                    % self._abs_target_path)
 
     def _rmdir_mountpount(self):
         self._messenger.info('Removing directory "%s"...' % self._abs_mountpoint)
-        for i in range(3):
+
+        def try_rmdir():
             try:
                 os.rmdir(self._abs_mountpoint)
             except OSError as e:
                 if e.errno != errno.EBUSY:
                     raise
-                time.sleep(1)
-            else:
-                break
+                return False
+            return True
+
+        wait_until(try_rmdir)
 
     def _set_disk_id_in_mbr(self):
         if not self._config.disk_id:
             return
 
-        content = self._config.disk_id.byte_sequence()
-        assert len(content) == _DISK_ID_COUNT_BYTES
-
         self._messenger.info('Setting MBR disk identifier to %s (4 bytes)...' % str(self._config.disk_id))
-        f = open(self._abs_target_path, 'w')
-        f.seek(_DISK_ID_OFFSET)
-        f.write(content)
-        f.close()
+        fd = os.open(self._abs_target_path, os.O_WRONLY)
+        try:
+            set_disk_id(fd, self._config.disk_id.byte_sequence())
+        finally:
+            os.close(fd)
 
     def process_root_password(self):
         if self._config.abs_root_password_file:
@@ -780,12 +1159,6 @@ class BootstrapEngine(object):
             self._messenger.warn('Using --password PASSWORD is a security risk more often than not; '
                     'please consider using --password-file FILE, instead.')
 
-    def _install_dhcp_client(self):
-        return self._distro.install_dhcp_client()
-
-    def _install_sudo(self):
-        return self._distro.install_sudo()
-
     def _create_sudo_nopasswd_user(self):
         user_name = self._distro.get_cloud_username()
         self._messenger.info('Creating user "%s"...' % user_name)
@@ -808,9 +1181,6 @@ class BootstrapEngine(object):
             print('%s ALL = NOPASSWD: ALL' % user_name, file=f)
             os.fchmod(f.fileno(), 0o440)
 
-    def _install_cloud_init_and_friends(self):
-        self._distro.install_cloud_init_and_friends()
-
     def _configure_cloud_init_and_friends(self):
         self._distro.adjust_etc_cloud_cfg()
 
@@ -823,9 +1193,6 @@ class BootstrapEngine(object):
                     datasource_list: [ConfigDrive, NoCloud, OpenStack, Ec2]
                     """), file=f)
 
-    def _install_sshd(self):
-        return self._distro.install_sshd()
-
     def _delete_sshd_keys(self):
         # Even with new keys generated by cloud-init, it would
         # be cool to not have the current keys go into the image.
@@ -884,20 +1251,61 @@ class BootstrapEngine(object):
                 blacklist pcspkr
                 """), file=f)
 
-    def _install_acpid_unless_using_systemd(self):
-        if not self._distro.uses_systemd():
-            return self._distro.install_acpid()
-
     def _allow_autostart_of_services(self, allow):
         # The idea is to avoid starting services in the chroot
         # that we would only need to kill one way or another
         self._distro.allow_autostart_of_services(allow)
 
     def _prepare_installation_of_packages(self):
-        self._distro.prepare_installation_of_packages()
+        self._distro.prepare_installation_of_packages(self._distro.get_packages_to_prefetch(
+                self._get_package_features(), self._config.with_openstack))
 
     def _install_kernel(self):
-        self._distro.install_kernel()
+        # NOTE: So that the kernel phase can be shared across hostnames
+        set_hostname(_KERNEL_BUILD_HOSTNAME)
+        try:
+            self._distro.install_kernel()
+        finally:
+            set_hostname(self._config.hostname)
+
+    def _get_package_features(self):
+        features = []
+        if self._config.bootloader_approach in BOOTLOADER__ANY_GRUB:
+            features.append(FEATURE__GRUB2)  # Need grub2-mkconfig in any case
+
+        if self._config.with_openstack:
+            features += [
+                    FEATURE__DHCP_CLIENT,
+                    FEATURE__SUDO,
+                    FEATURE__CLOUD_INIT,
+                    FEATURE__SSHD,
+                    ]
+            if not self._distro.uses_systemd():
+                features.append(FEATURE__ACPID)
+
+        return features
+
+    def _install_packages_for_features(self):
+        packages = self._distro.get_packages_for_all(self._get_package_features())
+        if not packages:
+            return
+
+        # NOTE: A single transaction rather than one per feature
+        #       saves repeated dependency resolution and triggers
+        self._distro.install_packages(packages)
+
+    def _prefetch_packages(self):
+        packages = self._distro.get_packages_to_prefetch(
+                self._get_package_features(), self._config.with_openstack)
+        if not packages:
+            return
+
+        self._messenger.info('Prefetching packages %s...' % ', '.join(packages))
+        try:
+            self._distro.prefetch_packages(packages)
+        except subprocess.CalledProcessError as e:
+            # NOTE: Installation will download whatever is missing, later
+            self._messenger.warn('Prefetching packages failed (%s), continuing.' % e)
 
     def _turn_etc_resolv_conf_to_systemd_resolved(self):
         self._messenger.info('Handing /etc/resolv.conf over to systemd-resolved...')
@@ -908,18 +1316,228 @@ class BootstrapEngine(object):
                 'ln', '-s', '/run/systemd/resolve/resolv.conf', '/etc/resolv.conf',
                 ], env=env)
 
+    def _get_phase_inputs(self):
+        return [
+                (PHASE__BASE, {
+                    'architecture': self._config.architecture,
+                    'bootloader_approach': self._config.bootloader_approach,
+                    'distro': self._distro.get_phase_cache_inputs(),
+                    'version': VERSION_STR,
+                }),
+                (PHASE__KERNEL, {
+                    # NOTE: Pre-chroot scripts get to see the hostname
+                    'hostname': self._config.hostname if self._abs_scripts_dir_pre else None,
+                    'root_fs': self._root_fs.KEY,
+                    'root_overlay': self._root_overlay,
+                    'scripts_pre': digest_directory(self._abs_scripts_dir_pre),
+                }),
+                (PHASE__PACKAGES, {
+                    'with_openstack': self._config.with_openstack,
+                }),
+                (PHASE__SETUP, {}),
+                (PHASE__SCRIPTS, {
+                    'scripts_chroot': digest_directory(self._abs_scripts_dir_chroot),
+                }),
+                ]
+
+    def _prepare_phase_cache(self):
+        if self._phase_cache is None:
+            return
+
+        self._phase_cache.ensure_directory_writable()
+        self._phase_keys = compute_phase_keys(self._get_phase_inputs())
+
+    def _compute_journal_fingerprint(self):
+        # NOTE: Covers what is configured outside of phases, as well
+        return compute_phase_keys(self._get_phase_inputs() + [
+                ('journal', {
+                    'disk_id': self._config.disk_id and str(self._config.disk_id),
+                    'first_partition_uuid': self._config.first_partition_uuid,
+                    'hostname': self._config.hostname,
+                    'machine_id': self._config.machine_id and str(self._config.machine_id),
+                    'root_password': digest_text(self._config.root_password),
+                    'scripts_post': digest_directory(self._abs_scripts_dir_post),
+                }),
+                ])[-1]
+
+    def _restore_latest_phase_snapshot(self):
+        if self._phase_cache is None:
+            return
+
+        index = self._phase_cache.find_latest(self._phase_keys)
+        if index is None:
+            self._messenger.info('No snapshot of any build phase found, building from scratch.')
+            return
+
+        metadata = self._phase_cache.restore(PHASES[index],
+                self._phase_keys[index], self._abs_mountpoint)
+        self._restored_phase_index = index
+        self._snapshot_first_partition_uuid = metadata['first_partition_uuid']
+
+    def _phase_needs_running(self, phase):
+        if self._restored_phase_index is None:
+            return True
+        return PHASES.index(phase) > self._restored_phase_index
+
+    def _store_phase_snapshot(self, phase):
+        if self._phase_cache is None:
+            return
+
+        key = self._phase_keys[PHASES.index(phase)]
+        if self._phase_cache.contains(key):
+            return
+
+        self._phase_cache.store(phase, key, self._abs_mountpoint, {
+                'first_partition_uuid': self._config.first_partition_uuid,
+                })
+
+    def _adjust_snapshot_first_partition_uuid(self):
+        # NOTE: The restored GRUB configuration may still refer to the
+        #       file system UUID of the build that took the snapshot
+        self._replace_first_partition_uuid_in_boot_loader_config(
+                self._snapshot_first_partition_uuid,
+                self._config.first_partition_uuid)
+
+    def _replace_first_partition_uuid_in_boot_loader_config(self, old_uuid, new_uuid):
+        if old_uuid == new_uuid:
+            return
+
+        for abs_filename in (
+                os.path.join(self._abs_mountpoint, 'boot', 'grub', 'grub.cfg'),
+                os.path.join(self._abs_mountpoint, 'boot', 'extlinux', 'extlinux.conf'),
+                ):
+            if not os.path.exists(abs_filename):
+                continue
+
+            self._messenger.info('Replacing file system UUID %s by %s in file "%s"...'
+                    % (old_uuid, new_uuid, abs_filename))
+            self._executor.check_call([
+                    COMMAND_SED,
+                    's,%s,%s,g' % (old_uuid, new_uuid),
+                    '-i', abs_filename,
+                    ])
+
+    def _load_journal(self):
+        if self._journal is None:
+            return
+
+        self._journal.set_fingerprint(self._compute_journal_fingerprint())
+        if not self._resume:
+            return
+
+        self._resuming = self._journal.load()
+
+    def _run_step(self, step_name, func, *args):
+        if self._journal is not None and self._journal.is_completed(step_name):
+            self._messenger.info('Skipping step "%s" (completed by an earlier run).' % step_name)
+            return
+
+        before = time.monotonic()
+        func(*args)
+        if self._step_timings is not None:
+            self._step_timings.record(step_name, time.monotonic() - before)
+
+        if self._journal is not None:
+            self._journal.mark_completed(step_name)
+
+    def _run_steps(self, graph):
+        run_step_graph(graph, self._run_step)
+
+    def _run_chroot_scripts_from_inside_chroot(self):
+        self._copy_chroot_scripts()
+        try:
+            self._run_chroot_scripts()
+        finally:
+            self._remove_chroot_scripts()
+
+    def _create_image_file(self):
+        if self._image_size_bytes is None:
+            return
+
+        # NOTE: Sparse, only space actually written will be taken
+        self._messenger.info('Creating sparse image file "%s" of %s...'
+                % (self._abs_target_path, format_byte_size(self._image_size_bytes)))
+        with open(self._abs_target_path, 'wb') as f:
+            f.truncate(self._image_size_bytes)
+
+    def _attach_loop_device(self):
+        self._messenger.info('Attaching image file "%s" to a loop device...' % self._abs_target_path)
+        output = self._executor.check_output([
+                COMMAND_LOSETUP,
+                '--find', '--show',
+                self._abs_target_path,
+                ])
+        self._abs_image_file = self._abs_target_path
+        self._abs_target_path = output.rstrip().decode('utf-8')
+
+    def _detach_loop_device(self):
+        self._messenger.info('Detaching loop device "%s"...' % self._abs_target_path)
+        if not check_call__keep_trying(self._executor, [
+                COMMAND_LOSETUP,
+                '--detach', self._abs_target_path,
+                ]):
+            self._messenger.warn('Detaching loop device "%s" failed, giving up.'
+                    % self._abs_target_path)
+        self._abs_target_path = self._abs_image_file
+        self._abs_image_file = None
+
+    def _write_output(self):
+        if self._abs_output_path is None:
+            return
+
+        write_output(self._messenger, self._executor, self._abs_target_path,
+                self._output_format, self._abs_output_path)
+
     def run(self):
+        before = time.monotonic()
+        try:
+            self._run_with_image_file()
+        finally:
+            self._close_pid_namespace()
+            if self._step_timings is not None:
+                self._step_timings.report(self._messenger, time.monotonic() - before)
+
+    def _run_with_image_file(self):
+        if self._target_is_image_file():
+            if not (self._resume and os.path.exists(self._abs_target_path)):
+                self._create_image_file()
+            self._attach_loop_device()
+            try:
+                self._run_with_journal()
+            finally:
+                self._detach_loop_device()
+            self._truncate_shrunk_image_file()
+        else:
+            self._run_with_journal()
+
+        self._write_output()
+
+    def _run_with_journal(self):
+        try:
+            self._run()
+        except BaseException:
+            if self._journal is not None:
+                self._messenger.info('Journal of completed steps kept at "%s", '
+                        're-run with --resume to continue.' % self._journal.get_filename())
+            raise
+        else:
+            if self._journal is not None:
+                self._journal.remove()
+
+    def _run(self):
+        step = self._run_step
+
+        self._prepare_phase_cache()
+        self._load_journal()
         self._unshare()
         self._check_device_size()
-        self._partition_device()
-        self._set_disk_id_in_mbr()
+        step('partition-device', self._partition_device)
         self._create_partition_devices()
         try:
-            self._format_partitions()
+            self._start_prefetching_directory_bootstrap()
+            step('format-partitions', self._format_partitions)
 
-            if self._config.first_partition_uuid:
-                self._set_first_partition_uuid()
-            else:
+            if not self._config.first_partition_uuid:
                 self._gather_first_partition_uuid()
             assert self._config.first_partition_uuid
 
@@ -927,95 +1545,142 @@ class BootstrapEngine(object):
             try:
                 self._mount_disk_chroot_mounts()
                 try:
-                    self._mkdir_mountpount_etc()
-                    self._configure_hostname()  # first time
-                    self._create_etc_resolv_conf()  # first time
-                    try:
-                        self.run_directory_bootstrap()
-                    finally:
-                        self._unmount_directory_bootstrap_leftovers()
-                    self._configure_hostname()  # re-write
-                    self._create_etc_resolv_conf()  # re-write
-                    self._create_etc_fstab()
-                    self._create_etc_machine_id()  # potentially re-write
-                    self._run_pre_scripts()
+                    if not self._resuming:
+                        self._restore_latest_phase_snapshot()
+                    if self._phase_needs_running(PHASE__BASE):
+                        step('mkdir-etc', self._mkdir_mountpount_etc)
+                        step('configure-hostname-early', self._configure_hostname)  # first time
+                        step('create-etc-resolv-conf-early', self._create_etc_resolv_conf)  # first time
+                        self._finish_prefetching_directory_bootstrap()
+                        try:
+                            step('run-directory-bootstrap', self.run_directory_bootstrap)
+                        finally:
+                            self._unmount_directory_bootstrap_leftovers()
+                        self._store_phase_snapshot(PHASE__BASE)
+                    graph = StepGraph()
+                    graph.add('configure-hostname', self._configure_hostname)  # re-write
+                    graph.add('create-etc-resolv-conf', self._create_etc_resolv_conf)  # re-write
+                    graph.add('create-etc-fstab', self._create_etc_fstab)
+                    graph.add('create-etc-machine-id', self._create_etc_machine_id)  # potentially re-write
+                    self._run_steps(graph)
+                    if self._phase_needs_running(PHASE__KERNEL):
+                        step('run-pre-scripts', self._run_pre_scripts)
                     if self._config.bootloader_approach in BOOTLOADER__HOST_GRUB2:
-                        self._install_bootloader__grub2()
+                        step('install-bootloader', self._install_bootloader__grub2)
                     elif self._config.bootloader_approach == BOOTLOADER__HOST_EXTLINUX:
-                        self._install_bootloader__extlinux()
+                        step('install-bootloader', self._install_bootloader__extlinux)
                     self._mount_nondisk_chroot_mounts()
                     try:
                         self._allow_autostart_of_services(False)
-                        self._set_root_password_inside_chroot()
-                        self._prepare_installation_of_packages()
-
-                        # NOTE: Kernel is configured/installed early to allow other
-                        #       packages to run their checks on the kernel configuration
-                        #       with the actual kernel configuration
-                        self._install_kernel()
-
-                        if self._config.bootloader_approach in BOOTLOADER__ANY_GRUB:
-                            # Need grub2-mkconfig in any case
-                            self._ensure_chroot_has_grub2_installed()
 
+                        # NOTE: Before (rather than while) installing and prefetching concurrently
+                        if self._phase_needs_running(PHASE__PACKAGES):
+                            step('prepare-installation-of-packages', self._prepare_installation_of_packages)
+
+                        if self._phase_needs_running(PHASE__KERNEL):
+                            # NOTE: Kernel is configured/installed early to allow other
+                            #       packages to run their checks on the kernel configuration
+                            #       with the actual kernel configuration
+                            graph = StepGraph()
+                            graph.add('install-kernel', self._install_kernel,
+                                    resources=[RESOURCE__PACKAGE_MANAGER])
+                            graph.add('prefetch-packages', self._prefetch_packages,
+                                    resources=[] if self._distro.can_prefetch_packages_while_installing()
+                                            else [RESOURCE__PACKAGE_MANAGER])
+                            self._run_steps(graph)
+                            self._store_phase_snapshot(PHASE__KERNEL)
+
+                        if self._phase_needs_running(PHASE__PACKAGES):
+                            step('install-packages', self._install_packages_for_features)
+                            for feature in self._get_package_features():
+                                step('finish-installing-%s' % feature, self._distro.finish_installing, feature)
+                            self._store_phase_snapshot(PHASE__PACKAGES)
+
+                        # NOTE: Not part of any phase since it writes to the MBR
                         if self._config.bootloader_approach in BOOTLOADER__CHROOT_GRUB2:
-                            self._install_bootloader__grub2()
-
-                        if self._config.with_openstack:
-                            # Essentials
-                            self._install_dhcp_client()
-                            self._install_sudo()
-                            self._install_cloud_init_and_friends()
-                            self._configure_cloud_init_and_friends()
-                            self._install_sshd()
-                            self._make_openstack_services_autostart()
-
-                            # Goodies
-                            self._disable_clearing_tty1()
-                            self._disable_pcspkr_autoloading()
-                            self._install_acpid_unless_using_systemd()
-                        # elif with vagrant support:
-                        #   ...
-                        #   self._install_sudo()
-                        #   self._create_sudo_nopasswd_user()
-                        #   ...
-
-                        self.create_network_configuration()  # after DHCP client install
-
-                        self._adjust_initramfs_generator_config()
-                        self.generate_initramfs_from_inside_chroot()
-
-                        if self._config.bootloader_approach in BOOTLOADER__ANY_GRUB:
-                            self.adjust_grub_defaults()
-                            self._messenger.info('Generating GRUB configuration...')
-                            self.generate_grub_cfg_from_inside_chroot()
-                            self._fix_grub_cfg_root_device()
-
-                        if self._abs_scripts_dir_chroot:
-                            self._copy_chroot_scripts()
-                            try:
-                                self._run_chroot_scripts()
-                            finally:
-                                self._remove_chroot_scripts()
+                            step('install-bootloader', self._install_bootloader__grub2)
+
+                        if self._phase_needs_running(PHASE__SETUP):
+                            graph = StepGraph()
+                            if self._config.with_openstack:
+                                # Essentials
+                                graph.add('configure-cloud-init-and-friends', self._configure_cloud_init_and_friends)
+                                graph.add('make-openstack-services-autostart', self._make_openstack_services_autostart)
+
+                                # Goodies
+                                graph.add('disable-clearing-tty1', self._disable_clearing_tty1)
+                                graph.add('disable-pcspkr-autoloading', self._disable_pcspkr_autoloading)
+                            # elif with vagrant support:
+                            #   ...
+                            #   self._install_sudo()
+                            #   self._create_sudo_nopasswd_user()
+                            #   ...
+
+                            graph.add('create-network-configuration', self.create_network_configuration)  # after DHCP client install
+
+                            graph.add('adjust-initramfs-generator-config', self._adjust_initramfs_generator_config)
+
+                            # NOTE: The initramfs may pick up any of the configuration above
+                            graph.add('generate-initramfs', self.generate_initramfs_from_inside_chroot,
+                                    after=graph.get_names())
+
+                            if self._config.bootloader_approach in BOOTLOADER__ANY_GRUB \
+                                    and self._root_fs.KEY != ROOT_FS__SQUASHFS:
+                                graph.add('adjust-grub-defaults', self.adjust_grub_defaults)
+                                graph.add('generate-grub-cfg', self._generate_grub_cfg,  # after initramfs for detection
+                                        after=['adjust-grub-defaults', 'generate-initramfs'])
+                            self._run_steps(graph)
+                            self._store_phase_snapshot(PHASE__SETUP)
+                        else:
+                            self._adjust_snapshot_first_partition_uuid()
+
+                        if self._phase_needs_running(PHASE__SCRIPTS):
+                            if self._abs_scripts_dir_chroot:
+                                step('run-chroot-scripts', self._run_chroot_scripts_from_inside_chroot)
+                            self._store_phase_snapshot(PHASE__SCRIPTS)
+
+                        # NOTE: Not part of any phase so that snapshots
+                        #       are free of password hashes and can be shared
+                        step('set-root-password', self._set_root_password_inside_chroot)
+
+                        # NOTE: Not part of any phase since it depends on the disk identifier
+                        if self._root_overlay:
+                            step('write-root-overlay-init', self._write_root_overlay_init)
+                        if self._root_fs.KEY == ROOT_FS__SQUASHFS \
+                                and self._config.bootloader_approach in BOOTLOADER__CHROOT_GRUB2:
+                            step('install-bootloader-for-squashfs', self._install_bootloader__grub2_for_squashfs)
 
                         if self._config.with_openstack:
                             # Essentials (that better go last)
-                            self._delete_sshd_keys()
-                            self._clean_machine_id()
-                            self._perform_in_chroot_shipping_clean_up()
+                            graph = StepGraph()
+                            graph.add('delete-sshd-keys', self._delete_sshd_keys)
+                            graph.add('clean-machine-id', self._clean_machine_id)
+                            graph.add('perform-in-chroot-shipping-clean-up', self._perform_in_chroot_shipping_clean_up,
+                                    resources=[RESOURCE__PACKAGE_MANAGER])
 
                             if self._distro.uses_systemd_resolved(self._config.with_openstack):
                                 # Cannot go early, breaks chroot connectivity
-                                self._turn_etc_resolv_conf_to_systemd_resolved()
+                                graph.add('turn-etc-resolv-conf-to-systemd-resolved',
+                                        self._turn_etc_resolv_conf_to_systemd_resolved,
+                                        after=graph.get_names())
+                            self._run_steps(graph)
 
                         self._allow_autostart_of_services(True)
                     finally:
                         self._unmount_nondisk_chroot_mounts()
-                    self.perform_post_chroot_clean_up()
-                    self._run_post_scripts()
+                    step('perform-post-chroot-clean-up', self.perform_post_chroot_clean_up)
+                    step('run-post-scripts', self._run_post_scripts)
+                    self._compact_file_system()
+                    self._sync_disk_chroot_mounts()
+                    self._create_squashfs_file()
                 finally:
                     self._unmount_disk_chroot_mounts()
             finally:
                 self._rmdir_mountpount()
+            self._finish_file_system()
+            self._shrink_file_system()
+            self._write_squashfs_file_to_first_partition()
         finally:
+            self._stop_prefetching_directory_bootstrap()
+            self._remove_squashfs_file()
             self._remove_partition_devices()
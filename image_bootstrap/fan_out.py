@@ -0,0 +1,226 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import errno
+import mmap
+import os
+import queue
+import threading
+
+from directory_bootstrap.shared.byte_size import format_byte_size
+from image_bootstrap.block_device import (
+        get_loop_backing_file, get_size_bytes, is_block_device, iter_data_extents, zero_out)
+
+_CHUNK_SIZE_BYTES = 4 * 1024 * 1024
+_BUFFER_COUNT = 8
+_DIRECT_IO_ALIGNMENT_BYTES = 4096
+
+_ZEROS = memoryview(bytes(_CHUNK_SIZE_BYTES))
+
+
+class _Chunk(object):
+    """
+    A piece of the source, shared by all writers until the last
+    writer is done with it and the buffer goes back to the pool
+    """
+    def __init__(self, offset, length, buffer, pool, writer_count):
+        self.offset = offset
+        self.length = length
+        self.buffer = buffer  # None for all zeros
+        self._pool = pool
+        self._pending_writers = writer_count
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            self._pending_writers -= 1
+            done = not self._pending_writers
+        if done and self.buffer is not None:
+            self._pool.put(self.buffer)
+
+
+class _Writer(threading.Thread):
+    def __init__(self, abs_target_path, size_bytes):
+        super(_Writer, self).__init__(name='fan-out writer for "%s"' % abs_target_path)
+        self.abs_target_path = abs_target_path
+        self.chunks = queue.Queue(maxsize=_BUFFER_COUNT * 4)
+        self.error = None
+        self._size_bytes = size_bytes
+        self._fd_direct = None
+        self._fd = None
+        self._block_device = None
+        self._zero_start = None
+        self._zero_end = None
+
+    def open(self):
+        # NOTE: No O_CREAT, so that a mistyped block device does not
+        #       end up as an image file in RAM-backed /dev
+        self._fd = os.open(self.abs_target_path, os.O_WRONLY)
+        self._block_device = is_block_device(self._fd)
+
+        if self._block_device:
+            size_bytes_found = get_size_bytes(self._fd)
+            if size_bytes_found < self._size_bytes:
+                raise OSError(errno.ENOSPC, 'Device "%s" is %s in size, %s or more needed.' % (
+                        self.abs_target_path,
+                        format_byte_size(size_bytes_found),
+                        format_byte_size(self._size_bytes),
+                        ))
+        else:
+            # NOTE: Zero chunks are left to holes of the file
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, self._size_bytes)
+
+        try:
+            self._fd_direct = os.open(self.abs_target_path, os.O_WRONLY | os.O_DIRECT)
+        except (AttributeError, OSError):  # i.e. no O_DIRECT on this platform/file system
+            self._fd_direct = None
+
+    def close(self):
+        for fd in (self._fd_direct, self._fd):
+            if fd is not None:
+                os.close(fd)
+
+    def _flush_zeros(self):
+        if self._zero_start is None:
+            return
+        zero_out(self._fd, self._zero_start, self._zero_end - self._zero_start)
+        self._zero_start = self._zero_end = None
+
+    def _write(self, chunk):
+        if chunk.buffer is None:
+            if not self._block_device:
+                return
+            if self._zero_end == chunk.offset:
+                self._zero_end += chunk.length
+            else:
+                self._flush_zeros()
+                self._zero_start, self._zero_end = chunk.offset, chunk.offset + chunk.length
+            return
+
+        self._flush_zeros()
+
+        data = memoryview(chunk.buffer)[:chunk.length]
+        fd = self._fd_direct
+        if fd is None or (chunk.offset | chunk.length) % _DIRECT_IO_ALIGNMENT_BYTES:
+            fd = self._fd
+
+        written = 0
+        while written < chunk.length:
+            written += os.pwrite(fd, data[written:], chunk.offset + written)
+
+    def run(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            try:
+                if self.error is None:
+                    self._write(chunk)
+            except BaseException as e:
+                self.error = e
+            finally:
+                chunk.release()
+
+        try:
+            if self.error is None:
+                self._flush_zeros()
+                os.fsync(self._fd)
+        except BaseException as e:
+            self.error = e
+
+
+def copy_to_many(messenger, abs_source_path, abs_target_paths):
+    """
+    Copy a source image to any number of (existing) targets at once, reading
+    the source only once.  Holes of the source (found by SEEK_DATA/SEEK_HOLE)
+    are not even read; they and all-zero chunks are not written
+    but left to holes (for files) or zeroed in-device (for block devices).
+    """
+    for abs_target_path in abs_target_paths:
+        if os.path.realpath(abs_target_path) == os.path.realpath(abs_source_path):
+            raise ValueError('Cannot copy "%s" onto itself' % abs_source_path)
+
+    fd_source = os.open(abs_source_path, os.O_RDONLY)
+    try:
+        size_bytes = get_size_bytes(fd_source)
+
+        # NOTE: Loop devices do not expose the holes of their backing file
+        abs_backing_file = get_loop_backing_file(fd_source)
+        if abs_backing_file is not None:
+            fd_backing_file = os.open(abs_backing_file, os.O_RDONLY)
+            if get_size_bytes(fd_backing_file) == size_bytes:
+                os.close(fd_source)
+                fd_source = fd_backing_file
+            else:
+                os.close(fd_backing_file)
+
+        messenger.info('Copying %s from "%s" to %s...' % (
+                format_byte_size(size_bytes),
+                abs_source_path,
+                ', '.join('"%s"' % e for e in abs_target_paths),
+                ))
+        os.posix_fadvise(fd_source, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        writers = [_Writer(e, size_bytes) for e in abs_target_paths]
+        try:
+            for writer in writers:
+                writer.open()
+
+            _copy_to_writers(fd_source, size_bytes, writers)
+        finally:
+            for writer in writers:
+                writer.close()
+    finally:
+        os.close(fd_source)
+
+    for writer in writers:
+        if writer.error is not None:
+            raise writer.error
+
+
+def _copy_to_writers(fd_source, size_bytes, writers):
+    pool = queue.Queue()
+    for _ in range(_BUFFER_COUNT):
+        # NOTE: Anonymous mappings are page-aligned, as needed for O_DIRECT
+        pool.put(mmap.mmap(-1, _CHUNK_SIZE_BYTES))
+
+    for writer in writers:
+        writer.start()
+
+    def put(chunk):
+        for writer in writers:
+            writer.chunks.put(chunk)
+
+    try:
+        offset = 0
+        for data_start, data_length in iter_data_extents(fd_source, size_bytes):
+            if data_start > offset:
+                put(_Chunk(offset, data_start - offset, None, pool, len(writers)))
+            offset = data_start
+
+            data_end = data_start + data_length
+            while offset < data_end:
+                if any(writer.error is not None for writer in writers):
+                    return
+
+                buffer = pool.get()
+                length = os.preadv(fd_source, [memoryview(buffer)[:data_end - offset]], offset)
+                if not length:
+                    pool.put(buffer)
+                    raise OSError(errno.EIO, 'Unexpected end of source at offset %d' % offset)
+
+                if memoryview(buffer)[:length] == _ZEROS[:length]:
+                    pool.put(buffer)
+                    buffer = None
+
+                put(_Chunk(offset, length, buffer, pool, len(writers)))
+                offset += length
+
+        if offset < size_bytes:
+            put(_Chunk(offset, size_bytes - offset, None, pool, len(writers)))
+    finally:
+        for writer in writers:
+            writer.chunks.put(None)
+        for writer in writers:
+            writer.join()
@@ -0,0 +1,74 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+from abc import ABCMeta, abstractmethod
+
+BUILD_PROFILE__SAFE = 'safe'
+BUILD_PROFILE__FAST = 'fast'
+BUILD_PROFILE__UNSAFE = 'unsafe'
+
+BUILD_PROFILES = (
+        BUILD_PROFILE__SAFE,
+        BUILD_PROFILE__FAST,
+        BUILD_PROFILE__UNSAFE,
+        )
+
+
+class RootFileSystem(object, metaclass=ABCMeta):
+    """
+    A file system to put the root file system of an image on
+    """
+    KEY = None
+    KERNEL_MODULES = []  # i.e. needed to mount the root file system at boot
+
+    def __init__(self, messenger, executor, build_profile):
+        self._messenger = messenger
+        self._executor = executor
+        self._build_profile = build_profile
+
+    @abstractmethod
+    def get_commands_to_check_for(self):
+        pass
+
+    def get_commands_to_check_for_shrinking(self):
+        return []
+
+    def check_bootloader_approach(self, bootloader_approach):
+        pass
+
+    @abstractmethod
+    def create(self, abs_device, uuid, bootloader_approach, extra_mkfs_ext4_options):
+        pass
+
+    @abstractmethod
+    def read_uuid(self, fd):
+        pass
+
+    def get_build_mount_options(self):
+        """
+        Mount options for the build, only; nothing of this makes it into the image
+        """
+        return []
+
+    def get_build_remount_options(self):
+        """
+        Mount options to revert to before unmounting after the build, if any
+        """
+        return []
+
+    def finish(self, abs_device):
+        """
+        Final touches to the unmounted file system after the build
+        """
+        pass
+
+    @abstractmethod
+    def get_etc_fstab_root_entry(self, uuid, partuuid):
+        pass
+
+    def shrink(self, abs_device, headroom_bytes):
+        """
+        Shrink the unmounted file system to its minimum size plus headroom.
+        Return the new size in bytes, or None if it was not shrunk.
+        """
+        raise ValueError('Shrinking file system "%s" is not supported' % self.KEY)
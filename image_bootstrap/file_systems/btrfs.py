@@ -0,0 +1,69 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+from directory_bootstrap.shared.commands import COMMAND_MKFS_BTRFS
+from image_bootstrap.block_device import read_btrfs_uuid
+from image_bootstrap.boot_loaders.extlinux import BOOTLOADER__HOST_EXTLINUX
+from image_bootstrap.file_systems.base import (
+        BUILD_PROFILE__FAST, BUILD_PROFILE__SAFE, BUILD_PROFILE__UNSAFE,
+        RootFileSystem)
+
+ROOT_FS__BTRFS = 'btrfs'
+
+_COMPRESSION_MOUNT_OPTION = 'compress=zstd'
+
+# NOTE: Compression is used during the build already,
+#       so that files are written compressed right away
+_BUILD_MOUNT_OPTIONS_OF_PROFILE = {
+        BUILD_PROFILE__SAFE: [_COMPRESSION_MOUNT_OPTION],
+        BUILD_PROFILE__FAST: [_COMPRESSION_MOUNT_OPTION, 'noatime'],
+        BUILD_PROFILE__UNSAFE: [_COMPRESSION_MOUNT_OPTION, 'noatime', 'nobarrier'],
+        }
+
+
+class BtrfsRootFileSystem(RootFileSystem):
+    """
+    Transparently compressed (using zstd)
+    """
+    KEY = ROOT_FS__BTRFS
+    KERNEL_MODULES = ['btrfs']
+
+    def get_commands_to_check_for(self):
+        return [
+                COMMAND_MKFS_BTRFS,
+                ]
+
+    def check_bootloader_approach(self, bootloader_approach):
+        # NOTE: extlinux cannot read compressed files, e.g. the kernel
+        if bootloader_approach == BOOTLOADER__HOST_EXTLINUX:
+            raise ValueError('Bootloader approach "%s" is not supported with root file system "%s", '
+                    'please use a GRUB 2 approach.' % (bootloader_approach, self.KEY))
+
+    def create(self, abs_device, uuid, bootloader_approach, extra_mkfs_ext4_options):
+        self._messenger.info('Creating btrfs file system on "%s"...' % abs_device)
+        cmd = [
+                COMMAND_MKFS_BTRFS,
+                '--force',
+                ]
+
+        if uuid:
+            cmd += ['--uuid', uuid]
+
+        cmd += [
+                abs_device,
+                ]
+        self._executor.check_call(cmd)
+
+    def read_uuid(self, fd):
+        return read_btrfs_uuid(fd)
+
+    def get_build_mount_options(self):
+        return _BUILD_MOUNT_OPTIONS_OF_PROFILE[self._build_profile]
+
+    def get_build_remount_options(self):
+        if self._build_profile == BUILD_PROFILE__UNSAFE:
+            return ['barrier']
+        return []
+
+    def get_etc_fstab_root_entry(self, uuid, partuuid):
+        return '/dev/disk/by-uuid/%s / btrfs defaults,%s 0 0' % (uuid, _COMPRESSION_MOUNT_OPTION)
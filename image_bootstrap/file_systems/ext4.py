@@ -0,0 +1,152 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+import subprocess
+
+from directory_bootstrap.shared.byte_size import format_byte_size
+from directory_bootstrap.shared.commands import (
+        COMMAND_E2FSCK, COMMAND_MKFS_EXT4, COMMAND_RESIZE2FS, COMMAND_TUNE2FS)
+from image_bootstrap.block_device import (
+        get_size_bytes, read_ext4_block_size, read_ext4_uuid)
+from image_bootstrap.boot_loaders.extlinux import BOOTLOADER__HOST_EXTLINUX
+from image_bootstrap.file_systems.base import (
+        BUILD_PROFILE__FAST, BUILD_PROFILE__SAFE, BUILD_PROFILE__UNSAFE,
+        RootFileSystem)
+
+ROOT_FS__EXT4 = 'ext4'
+
+_BUILD_MOUNT_OPTIONS_OF_PROFILE = {
+        BUILD_PROFILE__SAFE: [],
+        BUILD_PROFILE__FAST: ['noatime'],
+        BUILD_PROFILE__UNSAFE: ['noatime', 'data=writeback', 'barrier=0'],
+        }
+
+# NOTE: See "EXIT CODE" of man page e2fsck(8)
+_E2FSCK_EXIT_ERRORS_CORRECTED = 1
+
+
+def check_file_system(messenger, executor, abs_device):
+    """
+    Check (and repair) an ext4 file system using e2fsck;
+    errors that e2fsck corrected are no reason to fail.
+    """
+    messenger.info('Checking file system on "%s"...' % abs_device)
+    try:
+        executor.check_call([
+                COMMAND_E2FSCK,
+                '-f', '-p',
+                abs_device,
+                ])
+    except subprocess.CalledProcessError as e:
+        if e.returncode != _E2FSCK_EXIT_ERRORS_CORRECTED:
+            raise
+        messenger.info('File system errors on "%s" corrected.' % abs_device)
+
+
+class Ext4RootFileSystem(RootFileSystem):
+    KEY = ROOT_FS__EXT4
+
+    def get_commands_to_check_for(self):
+        return [
+                COMMAND_MKFS_EXT4,
+                COMMAND_TUNE2FS,
+                ]
+
+    def get_commands_to_check_for_shrinking(self):
+        return [
+                COMMAND_E2FSCK,
+                COMMAND_RESIZE2FS,
+                ]
+
+    def create(self, abs_device, uuid, bootloader_approach, extra_mkfs_ext4_options):
+        self._messenger.info('Creating ext4 file system on "%s"...' % abs_device)
+        cmd = [
+                COMMAND_MKFS_EXT4,
+                '-F',
+        ]
+
+        if bootloader_approach == BOOTLOADER__HOST_EXTLINUX:
+            self._messenger.warn('Creating ext4 file system with '
+                    'feature "64bit" disabled '
+                    'to ensure bootability with extlinux.')
+            self._messenger.warn('Please see '
+                    'https://github.com/hartwork/image-bootstrap/issues/44'
+                    ' for details.')
+            cmd += ['-O', '^64bit']
+
+        if uuid:
+            cmd += ['-U', uuid]
+
+        if self._build_profile != BUILD_PROFILE__SAFE:
+            # NOTE: The journal is re-created at the very end, see finish
+            cmd += ['-E', 'lazy_itable_init=1,lazy_journal_init=1']
+
+        cmd += extra_mkfs_ext4_options
+
+        cmd += [
+                abs_device,
+                ]
+        self._executor.check_call(cmd)
+
+    def read_uuid(self, fd):
+        return read_ext4_uuid(fd)
+
+    def get_build_mount_options(self):
+        return _BUILD_MOUNT_OPTIONS_OF_PROFILE[self._build_profile]
+
+    def get_build_remount_options(self):
+        if self._build_profile == BUILD_PROFILE__UNSAFE:
+            return ['barrier=1']
+        return []
+
+    def finish(self, abs_device):
+        if self._build_profile == BUILD_PROFILE__SAFE:
+            return
+
+        # NOTE: A journal created with lazy_journal_init may contain stale
+        #       blocks from earlier use of the device that a journal replay
+        #       after a crash could mistake for transactions
+        self._messenger.info('Re-creating journal of file system on "%s"...' % abs_device)
+        for feature in ('^has_journal', 'has_journal'):
+            self._executor.check_call([
+                    COMMAND_TUNE2FS,
+                    '-O', feature,
+                    abs_device,
+                    ])
+
+    def get_etc_fstab_root_entry(self, uuid, partuuid):
+        return '/dev/disk/by-uuid/%s / auto defaults 0 1' % uuid
+
+    def shrink(self, abs_device, headroom_bytes):
+        check_file_system(self._messenger, self._executor, abs_device)
+
+        output = self._executor.check_output([
+                COMMAND_RESIZE2FS,
+                '-P',
+                abs_device,
+                ])
+        minimum_block_count = int(output.decode('utf-8').rsplit(':', 1)[1])
+
+        fd = os.open(abs_device, os.O_RDONLY)
+        try:
+            block_size_bytes = read_ext4_block_size(fd)
+            current_block_count = get_size_bytes(fd) // block_size_bytes
+        finally:
+            os.close(fd)
+
+        block_count = min(current_block_count,
+                minimum_block_count + headroom_bytes // block_size_bytes)
+        if block_count == current_block_count:
+            return None
+
+        self._messenger.info('Shrinking file system on "%s" to %s...' % (
+                abs_device,
+                format_byte_size(block_count * block_size_bytes)))
+        self._executor.check_call([
+                COMMAND_RESIZE2FS,
+                abs_device,
+                str(block_count),
+                ])
+
+        return block_count * block_size_bytes
@@ -0,0 +1,55 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+from directory_bootstrap.shared.commands import COMMAND_MKSQUASHFS
+from image_bootstrap.boot_loaders.extlinux import BOOTLOADER__HOST_EXTLINUX
+from image_bootstrap.boot_loaders.grub2 import BOOTLOADER__HOST_GRUB2
+from image_bootstrap.file_systems.ext4 import Ext4RootFileSystem
+
+ROOT_FS__SQUASHFS = 'squashfs'
+
+
+class SquashfsRootFileSystem(Ext4RootFileSystem):
+    """
+    Read-only and compressed; the build happens on ext4 and the
+    result is packed into squashfs replacing the ext4 file system
+    """
+    KEY = ROOT_FS__SQUASHFS
+    KERNEL_MODULES = ['squashfs']
+
+    def get_commands_to_check_for(self):
+        return super(SquashfsRootFileSystem, self).get_commands_to_check_for() + [
+                COMMAND_MKSQUASHFS,
+                ]
+
+    def get_commands_to_check_for_shrinking(self):
+        return []
+
+    def check_bootloader_approach(self, bootloader_approach):
+        # NOTE: The GRUB core image is re-created from inside the chroot
+        if bootloader_approach in (BOOTLOADER__HOST_EXTLINUX, ) + BOOTLOADER__HOST_GRUB2:
+            raise ValueError('Bootloader approach "%s" is not supported with root file system "%s", '
+                    'please use a chroot GRUB 2 approach.' % (bootloader_approach, self.KEY))
+
+    def finish(self, abs_device):
+        pass  # i.e. the ext4 file system is about to be replaced
+
+    def get_etc_fstab_root_entry(self, uuid, partuuid):
+        return '/dev/disk/by-partuuid/%s / squashfs ro 0 0' % partuuid
+
+    def shrink(self, abs_device, headroom_bytes):
+        raise ValueError('Shrinking file system "%s" is not supported' % self.KEY)
+
+    def pack(self, abs_source_dir, abs_filename):
+        # NOTE: mksquashfs compresses using all CPUs by default
+        self._messenger.info('Packing "%s" into squashfs file "%s"...'
+                % (abs_source_dir, abs_filename))
+        self._executor.check_call([
+                COMMAND_MKSQUASHFS,
+                abs_source_dir,
+                abs_filename,
+                '-noappend',
+                '-comp', 'zstd',
+                '-no-progress',
+                '-e', 'lost+found',
+                ])
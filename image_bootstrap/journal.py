@@ -0,0 +1,101 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import errno
+import json
+import os
+import threading
+
+
+def journal_filename_for(abs_journal_dir, abs_target_path):
+    """
+    Derive a journal filename unique to a given target
+
+    >>> journal_filename_for('/var/cache/x', '/dev/vg/lv')
+    '/var/cache/x/dev--vg--lv.json'
+    """
+    basename = os.path.realpath(abs_target_path).strip('/').replace('/', '--')
+    return os.path.join(abs_journal_dir, basename + '.json')
+
+
+class StepJournal(object):
+    """
+    Keeps track of completed build steps on disk so that a failed build
+    can be resumed from the first incomplete step
+    """
+    def __init__(self, messenger, abs_filename, abs_target_path):
+        self._messenger = messenger
+        self._abs_filename = abs_filename
+        self._abs_target_path = os.path.realpath(abs_target_path)
+        self._fingerprint = None
+        self._completed_steps = []
+        self._lock = threading.Lock()  # i.e. steps may complete concurrently
+
+    def get_filename(self):
+        return self._abs_filename
+
+    def set_fingerprint(self, fingerprint):
+        """
+        Set a digest of the build configuration
+        so that resuming a differently configured build is refused
+        """
+        self._fingerprint = fingerprint
+
+    def load(self):
+        """
+        Return True if there is anything to resume from, False otherwise.
+        """
+        try:
+            with open(self._abs_filename) as f:
+                data = json.load(f)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._messenger.info('No journal found at "%s", starting from scratch.'
+                    % self._abs_filename)
+            return False
+
+        if data['target'] != self._abs_target_path:
+            raise ValueError('Journal "%s" is about target "%s" rather than "%s"'
+                    % (self._abs_filename, data['target'], self._abs_target_path))
+
+        if data.get('fingerprint') != self._fingerprint:
+            raise ValueError('Journal "%s" is about a build of different configuration, '
+                    'cannot resume; please remove the journal to start from scratch.'
+                    % self._abs_filename)
+
+        self._completed_steps = list(data['completed_steps'])
+        self._messenger.info('Resuming from journal "%s" (%d steps completed earlier)...'
+                % (self._abs_filename, len(self._completed_steps)))
+        return bool(self._completed_steps)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self._abs_filename), 0o700, exist_ok=True)
+        abs_temp_filename = self._abs_filename + '.incomplete'
+        with open(abs_temp_filename, 'w') as f:
+            json.dump({
+                'completed_steps': self._completed_steps,
+                'fingerprint': self._fingerprint,
+                'target': self._abs_target_path,
+            }, f, indent=4, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(abs_temp_filename, self._abs_filename)
+
+    def is_completed(self, step_name):
+        with self._lock:
+            return step_name in self._completed_steps
+
+    def mark_completed(self, step_name):
+        with self._lock:
+            self._completed_steps.append(step_name)
+            self._save()
+
+    def remove(self):
+        try:
+            os.remove(self._abs_filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            self._messenger.info('Removing journal "%s"...' % self._abs_filename)
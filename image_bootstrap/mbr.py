@@ -0,0 +1,135 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+import struct
+
+MBR_SIZE_BYTES = 512
+
+_DISK_ID_OFFSET = 440
+_DISK_ID_SIZE_BYTES = 4
+_PARTITION_TABLE_OFFSET = 446
+_PARTITION_ENTRY_SIZE_BYTES = 16
+_FIRST_PARTITION_LBA_OFFSET = _PARTITION_TABLE_OFFSET + 8
+_SIGNATURE_OFFSET = 510
+_SIGNATURE = b'\x55\xaa'
+
+_STATUS_BOOTABLE = 0x80
+_TYPE_LINUX = 0x83
+_CHS_BEYOND_LIMITS = b'\xfe\xff\xff'  # i.e. "use LBA", as for any modern disk
+
+_ALIGNMENT_BYTES = 1024 * 1024
+_MAX_SECTOR_COUNT = 2**32 - 1
+
+
+def compute_single_partition_layout(device_size_bytes, sector_size_bytes):
+    """
+    Return first sector and sector count of a single partition
+    starting at 1 MiB and spanning the rest of the device.
+
+    >>> compute_single_partition_layout(1024**3, 512)
+    (2048, 2095104)
+    >>> compute_single_partition_layout(1024**3, 4096)
+    (256, 261888)
+    """
+    first_sector = _ALIGNMENT_BYTES // sector_size_bytes
+    sector_count = device_size_bytes // sector_size_bytes - first_sector
+    if sector_count <= 0:
+        raise ValueError('Device of %d bytes too small for a partition' % device_size_bytes)
+    if first_sector + sector_count > _MAX_SECTOR_COUNT:
+        raise ValueError('Device of %d bytes too large for an MBR partition table'
+                % device_size_bytes)
+    return first_sector, sector_count
+
+
+def create_single_partition_mbr(disk_id_bytes, first_sector, sector_count):
+    """
+    Create a master boot record with empty boot code and
+    a single bootable Linux partition
+    """
+    assert len(disk_id_bytes) == _DISK_ID_SIZE_BYTES
+
+    partition_entry = struct.pack('<B3sB3sII',
+            _STATUS_BOOTABLE,
+            _CHS_BEYOND_LIMITS,
+            _TYPE_LINUX,
+            _CHS_BEYOND_LIMITS,
+            first_sector,
+            sector_count,
+            )
+    assert len(partition_entry) == _PARTITION_ENTRY_SIZE_BYTES
+
+    mbr = bytearray(MBR_SIZE_BYTES)
+    mbr[_DISK_ID_OFFSET:_DISK_ID_OFFSET + len(disk_id_bytes)] = disk_id_bytes
+    mbr[_PARTITION_TABLE_OFFSET:_PARTITION_TABLE_OFFSET + _PARTITION_ENTRY_SIZE_BYTES] = partition_entry
+    mbr[_SIGNATURE_OFFSET:] = _SIGNATURE
+    return bytes(mbr)
+
+
+def write_single_partition_table(fd, disk_id_bytes, device_size_bytes, sector_size_bytes):
+    """
+    Write a fresh MS-DOS partition table with a single partition,
+    wiping any GPT headers (that would otherwise take precedence).
+    """
+    first_sector, sector_count = compute_single_partition_layout(
+            device_size_bytes, sector_size_bytes)
+
+    mbr = create_single_partition_mbr(disk_id_bytes, first_sector, sector_count)
+
+    # NOTE: Covers the MBR as well as the primary GPT header in LBA 1
+    content = mbr + bytes(2 * sector_size_bytes - len(mbr))
+    os.pwrite(fd, content, 0)
+
+    last_sector_offset = (device_size_bytes // sector_size_bytes - 1) * sector_size_bytes
+    os.pwrite(fd, bytes(sector_size_bytes), last_sector_offset)  # i.e. backup GPT header
+
+    os.fsync(fd)
+
+
+def _read_mbr(fd):
+    mbr = os.pread(fd, MBR_SIZE_BYTES, 0)
+    if mbr[_SIGNATURE_OFFSET:] != _SIGNATURE:
+        raise ValueError('No MBR partition table found')
+    return mbr
+
+
+def get_first_partition_partuuid(fd):
+    """
+    Return the PARTUUID that Linux assigns to the first partition,
+    i.e. the disk identifier in hex followed by the partition number
+    """
+    return format_partuuid(_read_mbr(fd)[_DISK_ID_OFFSET:_DISK_ID_OFFSET + _DISK_ID_SIZE_BYTES], 1)
+
+
+def set_disk_id(fd, disk_id_bytes):
+    """
+    Change the disk identifier of an existing MBR in place
+    """
+    assert len(disk_id_bytes) == _DISK_ID_SIZE_BYTES
+    os.pwrite(fd, disk_id_bytes, _DISK_ID_OFFSET)
+    os.fsync(fd)
+
+
+def format_partuuid(disk_id_bytes, partition_number):
+    """
+    >>> format_partuuid(b'xV4\\x12', 1)
+    '12345678-01'
+    """
+    return '%08x-%02x' % (struct.unpack('<I', disk_id_bytes)[0], partition_number)
+
+
+def get_first_partition_layout(fd):
+    """
+    Return first sector and sector count of the first partition
+    """
+    return struct.unpack_from('<II', _read_mbr(fd), _FIRST_PARTITION_LBA_OFFSET)
+
+
+def resize_first_partition(fd, sector_count):
+    """
+    Change the size of the first partition in place, keeping its start
+    """
+    mbr = bytearray(_read_mbr(fd))
+    struct.pack_into('<I', mbr, _FIRST_PARTITION_LBA_OFFSET + 4, sector_count)
+    os.pwrite(fd, bytes(mbr), 0)
+    os.fsync(fd)
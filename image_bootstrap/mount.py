@@ -5,6 +5,9 @@
 
 import os
 import re
+import subprocess
+
+from directory_bootstrap.shared.mount import detach, try_unmounting
 
 # See https://www.kernel.org/doc/Documentation/filesystems/proc.txt
 _PROC_PID_MOUNTINFO_LINE = re.compile(
@@ -15,10 +18,68 @@ _PROC_PID_MOUNTINFO_LINE = re.compile(
         '(?P<mount>/[^ ]*) '  # Spaces are encoded as "\040"
         '.+$')
 
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def _unescape(text):
+    """
+    >>> _unescape('/mnt/with\\\\040space')
+    '/mnt/with space'
+    """
+    if '\\' not in text:
+        return text
+    return _OCTAL_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), text)
+
+
+def _normpath(abs_path):
+    """
+    >>> _normpath('/mnt//dev/./pts/')
+    '/mnt/dev/pts'
+    """
+    # NOTE: The kernel hands out normalized paths; checking is cheaper than normalizing
+    if '//' in abs_path or '/.' in abs_path or (abs_path.endswith('/') and abs_path != '/'):
+        return os.path.normpath(abs_path)
+    return abs_path
+
+
+def _split_path(abs_path):
+    return [component for component in os.path.normpath(abs_path).split('/') if component]
+
+
+class MountEntry(object):
+    """
+    A single line of /proc/<pid>/mountinfo (the fields of interest)
+    """
+    __slots__ = ('mount_id', 'parent_id', 'major', 'minor', 'root', 'mount_point', 'index')
+
+    def __init__(self, mount_id, parent_id, major, minor, root, mount_point, index=None):
+        self.mount_id = mount_id
+        self.parent_id = parent_id
+        self.major = major
+        self.minor = minor
+        self.root = root
+        self.mount_point = mount_point
+        self.index = index  # i.e. position in the mount table
+
+    def __repr__(self):
+        return 'MountEntry(%d, %d, %r)' % (self.mount_id, self.parent_id, self.mount_point)
+
+
+# NOTE: Nodes of the path component trie are plain dicts mapping
+#       components to child nodes, and key None to the list of mounts
+#       right at that path (if any)
+_ENTRIES = None
+
 
 class MountFinder(object):
+    """
+    The mount table, parsed once and indexed by path components
+    so that queries for subtrees do not need to look at all mounts
+    """
     def __init__(self):
-        self._mount_points = []
+        self._entries = []
+        self._root_node = {}
+        self._children_of_mount_id = {}
 
     @staticmethod
     def _parse_line(line):
@@ -26,13 +87,35 @@ class MountFinder(object):
         match = _PROC_PID_MOUNTINFO_LINE.match(line)
         if match is None:
             raise ValueError(f'Unexpected line format: {line!r}')
-        return match.groupdict()
+        mount_id, parent_id, major, minor, root, mount_point = match.groups()
+        return MountEntry(int(mount_id), int(parent_id), int(major), int(minor),
+                _unescape(root), _normpath(_unescape(mount_point)))
+
+    def _add(self, entry):
+        entry.index = len(self._entries)
+        self._entries.append(entry)
+
+        node = self._root_node
+        for component in entry.mount_point.split('/'):  # i.e. normalized already
+            if not component:
+                continue
+            child = node.get(component)
+            if child is None:
+                child = node[component] = {}
+            node = child
+        entries = node.get(_ENTRIES)
+        if entries is None:
+            node[_ENTRIES] = [entry]
+        else:
+            entries.append(entry)
+
+        self._children_of_mount_id.setdefault(entry.parent_id, []).append(entry)
 
     def _load_text(self, text):
         for line in text.split('\n'):
             if not line:
                 continue
-            self._mount_points.append(self._parse_line(line)['mount'])
+            self._add(self._parse_line(line))
 
     def load(self, filename=None):
         if filename is None:
@@ -41,17 +124,95 @@ class MountFinder(object):
         with open(filename, 'r') as f:
             self._load_text(f.read())
 
-    def _normpath_no_trailing_slash(self, abs_path):
-        return os.path.normpath(abs_path)
+    def _find_node(self, abs_path):
+        node = self._root_node
+        for component in _split_path(abs_path):
+            node = node.get(component)
+            if node is None:
+                return None
+        return node
 
-    def _normpath_trailing_slash(self, abs_path):
-        return os.path.join(os.path.normpath(abs_path), '')
+    def _collect_below(self, abs_path, inclusive, topmost_only):
+        top_node = self._find_node(abs_path)
+        if top_node is None:
+            return []
 
-    def below(self, abs_path, inclusive=False):
-        prefix = self._normpath_trailing_slash(abs_path)
-        for abs_candidate in self._mount_points:
-            normed_candidate = self._normpath_trailing_slash(abs_candidate)
-            if normed_candidate.startswith(prefix):
-                if normed_candidate == prefix and not inclusive:
+        entries = []
+        pending_nodes = [top_node]
+        while pending_nodes:
+            node = pending_nodes.pop()
+            node_entries = node.get(_ENTRIES)
+            if node_entries is not None and (inclusive or node is not top_node):
+                entries += node_entries
+                if topmost_only:
                     continue
-                yield self._normpath_no_trailing_slash(normed_candidate)
+            pending_nodes += reversed([child for component, child in node.items()
+                                       if component is not _ENTRIES])
+        return entries
+
+    def get_mounts_below(self, abs_path, inclusive=False):
+        """
+        Mounts at paths below abs_path (and at abs_path, if inclusive),
+        mounts at parent directories before those at sub-directories
+        """
+        return self._collect_below(abs_path, inclusive, topmost_only=False)
+
+    def get_topmost_mounts_below(self, abs_path, inclusive=False):
+        """
+        Like get_mounts_below, but without mounts at paths
+        below other mounts of the result
+        """
+        return self._collect_below(abs_path, inclusive, topmost_only=True)
+
+    def below(self, abs_path, inclusive=False):
+        for entry in self.get_mounts_below(abs_path, inclusive=inclusive):
+            yield entry.mount_point
+
+    def get_teardown_order(self, abs_path, inclusive=False):
+        """
+        Mounts below abs_path (as with get_mounts_below) in an order
+        that they can be unmounted in: following mount and parent IDs,
+        mounts on top of others go first and later mounts before earlier ones.
+        """
+        entries = self.get_mounts_below(abs_path, inclusive=inclusive)
+        mount_ids = {entry.mount_id for entry in entries}
+        top_entries = sorted((entry for entry in entries if entry.parent_id not in mount_ids),
+                key=lambda entry: entry.index)
+
+        ordered_entries = []
+        pending = [(entry, False) for entry in top_entries]
+        while pending:
+            entry, children_done = pending.pop()
+            if children_done:
+                ordered_entries.append(entry)
+                continue
+            pending.append((entry, True))
+            pending += ((child, False) for child
+                    in self._children_of_mount_id.get(entry.mount_id, ()))
+        return ordered_entries
+
+
+def _load_mounts():
+    mounts = MountFinder()
+    mounts.load()
+    return mounts
+
+
+def unmount_tree(messenger, executor, abs_path, inclusive=False):
+    """
+    Unmount all mounts below abs_path (and abs_path itself, if inclusive)
+    by detaching each topmost mount with all of its sub-mounts in one go
+    (once per layer, for mounts stacked on the same path).
+    Whatever is found left after that gets unmounted mount by mount.
+    """
+    mounts = _load_mounts()
+    for entry in mounts.get_topmost_mounts_below(abs_path, inclusive=inclusive):
+        try:
+            detach(messenger, executor, entry.mount_point)
+        except (OSError, subprocess.CalledProcessError) as e:
+            messenger.warn('Detaching "%s" failed (%s), falling back to unmounting one by one.'
+                    % (entry.mount_point, e))
+
+    mounts = _load_mounts()
+    for entry in mounts.get_teardown_order(abs_path, inclusive=inclusive):
+        try_unmounting(messenger, executor, entry.mount_point)
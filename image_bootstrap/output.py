@@ -0,0 +1,87 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+from directory_bootstrap.shared.commands import (
+        COMMAND_QEMU_IMG, COMMAND_XZ, COMMAND_ZSTD)
+from image_bootstrap.fan_out import copy_to_many
+
+OUTPUT_FORMAT__RAW = 'raw'
+OUTPUT_FORMAT__QCOW2 = 'qcow2'
+OUTPUT_FORMAT__RAW_XZ = 'raw.xz'
+OUTPUT_FORMAT__RAW_ZST = 'raw.zst'
+
+OUTPUT_FORMATS = (
+        OUTPUT_FORMAT__RAW,
+        OUTPUT_FORMAT__QCOW2,
+        OUTPUT_FORMAT__RAW_ZST,
+        OUTPUT_FORMAT__RAW_XZ,
+        )
+
+_COMMAND_OF_FORMAT = {
+        OUTPUT_FORMAT__RAW: None,
+        OUTPUT_FORMAT__QCOW2: COMMAND_QEMU_IMG,
+        OUTPUT_FORMAT__RAW_XZ: COMMAND_XZ,
+        OUTPUT_FORMAT__RAW_ZST: COMMAND_ZSTD,
+        }
+
+_FORMAT_OF_SUFFIX = (
+        ('.qcow2', OUTPUT_FORMAT__QCOW2),
+        ('.xz', OUTPUT_FORMAT__RAW_XZ),
+        ('.zst', OUTPUT_FORMAT__RAW_ZST),
+        )
+
+# NOTE: Number of parallel coroutines, qemu-img's default is 8
+_QEMU_IMG_COROUTINES = 16
+
+
+def guess_output_format(abs_output_path):
+    """
+    >>> guess_output_format('/tmp/debian.raw.zst')
+    'raw.zst'
+    >>> guess_output_format('/tmp/debian.img')
+    'raw'
+    """
+    for suffix, output_format in _FORMAT_OF_SUFFIX:
+        if abs_output_path.endswith(suffix):
+            return output_format
+    return OUTPUT_FORMAT__RAW
+
+
+def get_commands_for_output_format(output_format):
+    return [_COMMAND_OF_FORMAT[output_format]]
+
+
+def _compress(executor, argv, abs_source_path, abs_output_path):
+    with open(abs_source_path, 'rb') as fin, open(abs_output_path, 'wb') as fout:
+        executor.check_call(argv, stdin=fin, stdout=fout)
+
+
+def write_output(messenger, executor, abs_source_path, output_format, abs_output_path):
+    """
+    Write the (built) image to an output file, reading it once
+    """
+    if output_format == OUTPUT_FORMAT__RAW:
+        copy_to_many(messenger, abs_source_path, [abs_output_path])
+        return
+
+    messenger.info('Writing %s image "%s" from "%s"...'
+            % (output_format, abs_output_path, abs_source_path))
+    if output_format == OUTPUT_FORMAT__QCOW2:
+        # NOTE: qemu-img skips holes and zeros on its own
+        executor.check_call([
+                COMMAND_QEMU_IMG, 'convert',
+                '-f', 'raw',
+                '-O', 'qcow2',
+                '-m', str(_QEMU_IMG_COROUTINES),
+                '-W',  # i.e. allow out-of-order writes
+                abs_source_path,
+                abs_output_path,
+                ])
+    elif output_format == OUTPUT_FORMAT__RAW_ZST:
+        _compress(executor, [COMMAND_ZSTD, '-T0', '-q', '-c'],
+                abs_source_path, abs_output_path)
+    elif output_format == OUTPUT_FORMAT__RAW_XZ:
+        _compress(executor, [COMMAND_XZ, '-T0', '-c'],
+                abs_source_path, abs_output_path)
+    else:
+        raise ValueError('Output format "%s" not supported' % output_format)
@@ -0,0 +1,56 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import multiprocessing
+
+from directory_bootstrap.shared.output_control import run_handle_errors
+
+
+def _run_engine(engine, messenger, options):
+    def main_function(messenger, options):
+        engine.run()
+
+    run_handle_errors(main_function, messenger, options)
+
+
+def _start_engine_process(engine, messenger, options):
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=_run_engine,
+            args=(engine, messenger, options))
+    process.start()
+    return process
+
+
+def run_engine_in_child_process(messenger, options, abs_target_path, engine):
+    """
+    Run a bootstrap engine in a process of its own so that the PID
+    namespace it creates (and kills at the end) is gone with that process
+    rather than leaving the caller unable to start any further processes.
+    """
+    process = _start_engine_process(engine, messenger, options)
+    process.join()
+    if process.exitcode:
+        raise ValueError('Processing failed for target "%s"' % abs_target_path)
+
+
+def run_engines_in_parallel(messenger, options, engine_of_target):
+    """
+    Run bootstrap engines in processes of their own (rather than threads)
+    so that each of them gets to unshare namespaces of its own.
+    """
+    processes = []
+    for abs_target_path, engine in engine_of_target:
+        messenger.info('Processing target "%s" in the background...' % abs_target_path)
+        processes.append((abs_target_path, _start_engine_process(engine, messenger, options)))
+
+    failed_targets = []
+    for abs_target_path, process in processes:
+        process.join()
+        if process.exitcode:
+            failed_targets.append(abs_target_path)
+
+    if failed_targets:
+        raise ValueError('Processing failed for target(s) %s'
+                % ', '.join('"%s"' % e for e in failed_targets))
+
+    messenger.info('All %d target(s) processed successfully.' % len(processes))
@@ -0,0 +1,164 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import errno
+import hashlib
+import json
+import os
+import stat
+
+from directory_bootstrap.shared.commands import COMMAND_TAR
+
+PHASE__BASE = 'base'
+PHASE__KERNEL = 'kernel'
+PHASE__PACKAGES = 'packages'
+PHASE__SETUP = 'setup'
+PHASE__SCRIPTS = 'scripts'
+
+PHASES = (
+        PHASE__BASE,
+        PHASE__KERNEL,
+        PHASE__PACKAGES,
+        PHASE__SETUP,
+        PHASE__SCRIPTS,
+        )
+
+_SNAPSHOT_SUFFIX = '.tar'
+_METADATA_SUFFIX = '.json'
+
+
+def digest_directory(abs_dir):
+    """
+    Digest file names, permissions and content of a (scripts) directory
+    so that any change in there will yield a different digest.
+    """
+    if abs_dir is None:
+        return None
+
+    h = hashlib.sha256()
+    for abs_root, dirs, files in os.walk(abs_dir):
+        dirs.sort()
+        for basename in sorted(files):
+            abs_filename = os.path.join(abs_root, basename)
+            props = os.lstat(abs_filename)
+            h.update(os.path.relpath(abs_filename, abs_dir).encode('utf-8'))
+            h.update(b'\0%o\0' % stat.S_IMODE(props.st_mode))
+            if stat.S_ISLNK(props.st_mode):
+                h.update(os.readlink(abs_filename).encode('utf-8'))
+            else:
+                with open(abs_filename, 'rb') as f:
+                    h.update(f.read())
+            h.update(b'\0')
+    return h.hexdigest()
+
+
+def digest_text(text):
+    if text is None:
+        return None
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def compute_phase_keys(inputs_of_phase):
+    """
+    Compute one key per phase where each key covers the inputs
+    of its own phase as well as those of all the phases before it.
+
+    >>> keys = compute_phase_keys([('one', {'a': 1}), ('two', {'b': 2})])
+    >>> [len(key) for key in keys]
+    [64, 64]
+    >>> compute_phase_keys([('one', {'a': 1})])[0] == keys[0]
+    True
+    """
+    keys = []
+    previous_key = ''
+    for phase, inputs in inputs_of_phase:
+        h = hashlib.sha256()
+        h.update(previous_key.encode('utf-8'))
+        h.update(phase.encode('utf-8'))
+        h.update(json.dumps(inputs, sort_keys=True).encode('utf-8'))
+        previous_key = h.hexdigest()
+        keys.append(previous_key)
+    return keys
+
+
+class PhaseCache(object):
+    """
+    Content-addressed storage of root file system snapshots,
+    one per completed build phase
+    """
+    def __init__(self, messenger, executor, abs_cache_dir):
+        self._messenger = messenger
+        self._executor = executor
+        self._abs_cache_dir = abs_cache_dir
+
+    def _abs_snapshot_filename(self, key):
+        return os.path.join(self._abs_cache_dir, key + _SNAPSHOT_SUFFIX)
+
+    def _abs_metadata_filename(self, key):
+        return os.path.join(self._abs_cache_dir, key + _METADATA_SUFFIX)
+
+    def ensure_directory_writable(self):
+        try:
+            os.makedirs(self._abs_cache_dir, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        if not os.access(os.path.join(self._abs_cache_dir, ''), os.W_OK):
+            raise IOError(errno.EACCES, 'Permission denied: \'%s\'' % self._abs_cache_dir)
+
+    def contains(self, key):
+        return os.path.exists(self._abs_metadata_filename(key))
+
+    def find_latest(self, keys):
+        """
+        Return the index of the latest key with a snapshot, or None.
+        """
+        for index in reversed(range(len(keys))):
+            if self.contains(keys[index]):
+                return index
+        return None
+
+    def store(self, phase, key, abs_mountpoint, metadata):
+        abs_snapshot_filename = self._abs_snapshot_filename(key)
+        # NOTE: Unique so that parallel builds do not step on each other
+        abs_temp_filename = '%s.incomplete.%d' % (abs_snapshot_filename, os.getpid())
+        self._messenger.info('Storing snapshot of phase "%s" at "%s"...'
+                % (phase, abs_snapshot_filename))
+        self._executor.check_call([
+                COMMAND_TAR,
+                '--create',
+                '--file', abs_temp_filename,
+                '--one-file-system',  # i.e. skip /dev, /proc, /sys, ..
+                '--numeric-owner',
+                '--xattrs', '--xattrs-include=*',
+                '--acls',
+                '--directory', abs_mountpoint,
+                '.',
+                ])
+        os.rename(abs_temp_filename, abs_snapshot_filename)
+
+        # NOTE: Written last since its presence marks the snapshot complete
+        abs_metadata_filename = self._abs_metadata_filename(key)
+        abs_temp_filename = '%s.incomplete.%d' % (abs_metadata_filename, os.getpid())
+        with open(abs_temp_filename, 'w') as f:
+            json.dump(dict(metadata, phase=phase), f, sort_keys=True)
+        os.rename(abs_temp_filename, abs_metadata_filename)
+
+    def restore(self, phase, key, abs_mountpoint):
+        abs_snapshot_filename = self._abs_snapshot_filename(key)
+        self._messenger.info('Restoring snapshot of phase "%s" from "%s"...'
+                % (phase, abs_snapshot_filename))
+        self._executor.check_call([
+                COMMAND_TAR,
+                '--extract',
+                '--file', abs_snapshot_filename,
+                '--numeric-owner',
+                '--preserve-permissions',
+                '--xattrs', '--xattrs-include=*',
+                '--acls',
+                '--directory', abs_mountpoint,
+                ])
+
+        with open(self._abs_metadata_filename(key)) as f:
+            return json.load(f)
@@ -0,0 +1,130 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+RESOURCE__PACKAGE_MANAGER = 'package-manager'
+
+DEFAULT_MAX_CONCURRENT_STEPS = 4
+
+
+class Step(object):
+    def __init__(self, name, func, after, resources):
+        self.name = name
+        self.func = func
+        self.after = frozenset(after)
+        self.resources = frozenset(resources)
+
+    def __repr__(self):
+        return 'Step(%r, after=%r, resources=%r)' % (
+                self.name, sorted(self.after), sorted(self.resources))
+
+
+class StepGraph(object):
+    """
+    Build steps with explicit dependencies (on steps added earlier,
+    so that there can be no cycles) and resources that steps
+    must not use at the same time.
+
+    >>> graph = StepGraph()
+    >>> graph.add('a', print)
+    >>> graph.add('b', print, after=['a'], resources=[RESOURCE__PACKAGE_MANAGER])
+    >>> graph.get_names()
+    ['a', 'b']
+    >>> graph.add('c', print, after=['x'])
+    Traceback (most recent call last):
+        ...
+    ValueError: Step "c" cannot come after unknown step "x"
+    """
+    def __init__(self):
+        self._steps = []
+
+    def add(self, name, func, after=(), resources=()):
+        names = self.get_names()
+        if name in names:
+            raise ValueError('Step "%s" added twice' % name)
+        for dependency in after:
+            if dependency not in names:
+                raise ValueError('Step "%s" cannot come after unknown step "%s"'
+                        % (name, dependency))
+        self._steps.append(Step(name, func, after, resources))
+
+    def get_names(self):
+        return [step.name for step in self._steps]
+
+    def __iter__(self):
+        return iter(self._steps)
+
+    def __len__(self):
+        return len(self._steps)
+
+
+def run_step_graph(graph, run_step, max_workers=DEFAULT_MAX_CONCURRENT_STEPS):
+    """
+    Call run_step(name, func) for each step of the graph, from threads,
+    starting steps as soon as all of their dependencies have completed
+    and none of their resources are held by running steps.
+
+    Once a step has failed, no further steps are started and
+    the first error is re-raised after all running steps have ended,
+    so that clean-up can follow the usual order.
+    """
+    pending = list(graph)
+    completed_names = set()
+    held_resources = set()
+    step_of_future = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while step_of_future or (pending and error is None):
+            if error is None:
+                for step in list(pending):
+                    if len(step_of_future) >= max_workers:
+                        break
+                    if not step.after <= completed_names \
+                            or step.resources & held_resources:
+                        continue
+                    pending.remove(step)
+                    held_resources |= step.resources
+                    step_of_future[pool.submit(run_step, step.name, step.func)] = step
+
+            # NOTE: The earliest pending step can always start once nothing runs
+            assert step_of_future
+
+            done_futures, _ = wait(step_of_future, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                step = step_of_future.pop(future)
+                held_resources -= step.resources
+                try:
+                    future.result()
+                except BaseException as e:
+                    if error is None:
+                        error = e
+                else:
+                    completed_names.add(step.name)
+
+    if error is not None:
+        raise error
+
+
+class StepTimings(object):
+    """
+    Collects how long build steps took, from any thread
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seconds_of_step = []
+
+    def record(self, step_name, seconds):
+        with self._lock:
+            self._seconds_of_step.append((step_name, seconds))
+
+    def report(self, messenger, total_seconds):
+        with self._lock:
+            seconds_of_step = list(self._seconds_of_step)
+
+        messenger.info('Step timings:')
+        for step_name, seconds in seconds_of_step:
+            messenger.info('  %8.2fs  %s' % (seconds, step_name))
+        messenger.info('  %8.2fs  (total, wall clock)' % total_seconds)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import subprocess
+import uuid
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
+
+from image_bootstrap.block_device import (
+        get_size_bytes, iter_data_extents, read_btrfs_uuid, read_ext4_block_size,
+        read_ext4_uuid)
+
+_UUID = 'c1b9d5a2-f162-11cf-9ece-0020afc76f16'
+
+
+class TestReadExt4Uuid(TestCase):
+
+    @skipIf(shutil.which('mkfs.ext4') is None, 'mkfs.ext4 not available')
+    def test_superblock_from_mkfs(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'fs')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(8 * 1024 * 1024)
+            subprocess.check_call(['mkfs.ext4', '-F', '-q', '-b', '2048', '-U', _UUID, abs_filename])
+
+            fd = os.open(abs_filename, os.O_RDONLY)
+            try:
+                self.assertEqual(read_ext4_uuid(fd), _UUID)
+                self.assertEqual(get_size_bytes(fd), 8 * 1024 * 1024)
+                self.assertEqual(read_ext4_block_size(fd), 2048)
+            finally:
+                os.close(fd)
+
+    def test_no_superblock(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'zeros')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(4096)
+
+            fd = os.open(abs_filename, os.O_RDONLY)
+            try:
+                with self.assertRaises(ValueError):
+                    read_ext4_uuid(fd)
+            finally:
+                os.close(fd)
+
+
+class TestReadBtrfsUuid(TestCase):
+
+    def test_synthetic_superblock(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'fs')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(1024 * 1024)
+                f.seek(64 * 1024 + 0x20)
+                f.write(uuid.UUID(_UUID).bytes)
+                f.seek(64 * 1024 + 0x40)
+                f.write(b'_BHRfS_M')
+
+            fd = os.open(abs_filename, os.O_RDONLY)
+            try:
+                self.assertEqual(read_btrfs_uuid(fd), _UUID)
+                with self.assertRaises(ValueError):
+                    read_ext4_uuid(fd)
+            finally:
+                os.close(fd)
+
+    def test_no_superblock(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'zeros')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(4096)  # i.e. too small to hold one
+
+            fd = os.open(abs_filename, os.O_RDONLY)
+            try:
+                with self.assertRaises(ValueError):
+                    read_btrfs_uuid(fd)
+            finally:
+                os.close(fd)
+
+
+class TestIterDataExtents(TestCase):
+
+    def test_holes_skipped(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'sparse')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(16 * 1024 * 1024)
+                f.seek(8 * 1024 * 1024)
+                f.write(b'\x55' * 4096)
+
+            fd = os.open(abs_filename, os.O_RDONLY)
+            try:
+                extents = list(iter_data_extents(fd, 16 * 1024 * 1024))
+            finally:
+                os.close(fd)
+
+            # NOTE: File systems without hole support report a single extent
+            self.assertTrue(any(offset <= 8 * 1024 * 1024
+                    and offset + length >= 8 * 1024 * 1024 + 4096
+                    for offset, length in extents))
+            self.assertLessEqual(sum(length for _, length in extents), 16 * 1024 * 1024)
@@ -0,0 +1,135 @@
+import os
+import struct
+import subprocess
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock
+
+from directory_bootstrap.shared.executor import Executor
+from image_bootstrap.customize import CustomizationEngine, check_golden_image
+from image_bootstrap.engine import MachineConfig
+from image_bootstrap.mbr import write_single_partition_table
+from image_bootstrap.types.disk_id import disk_id_type
+
+_OLD_UUID = 'c1b9d5a2-f162-11cf-9ece-0020afc76f16'
+_NEW_UUID = '0f6e4a3c-7e52-4f7b-9c2e-3d8f1b6a5e41'
+
+
+def _create_machine_config(disk_id=None, first_partition_uuid=None, machine_id=None):
+    return MachineConfig('machine', 'amd64', None, None, '/etc/resolv.conf',
+            disk_id, first_partition_uuid, machine_id, 'auto', False, False)
+
+
+def _create_customization(machine_config, abs_mountpoint=None):
+    customization = CustomizationEngine(Mock(),
+            Executor(Mock(), stdout=subprocess.DEVNULL),
+            machine_config, '/dev/null')
+    customization._abs_mountpoint = abs_mountpoint
+    return customization
+
+
+def _create_image(abs_filename, ext4_magic):
+    with open(abs_filename, 'wb') as f:
+        f.truncate(4 * 1024 * 1024)
+        write_single_partition_table(f.fileno(), b'\x12\x34\x56\x78', 4 * 1024 * 1024, 512)
+        # NOTE: Magic of the ext4 superblock of the partition at 1 MiB
+        f.seek(1024 * 1024 + 1024 + 0x38)
+        f.write(struct.pack('<H', ext4_magic))
+
+
+class TestCheckGoldenImage(TestCase):
+
+    def test_ext4_accepted(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'golden.img')
+            _create_image(abs_filename, 0xef53)
+            check_golden_image(abs_filename)
+
+    def test_other_file_systems_refused(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'golden.img')
+            _create_image(abs_filename, 0)
+            with self.assertRaisesRegex(ValueError, 'ext4 golden images only'):
+                check_golden_image(abs_filename)
+
+    def test_no_partition_table_refused(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'golden.img')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(4 * 1024 * 1024)
+            with self.assertRaisesRegex(ValueError, 'ext4 golden images only'):
+                check_golden_image(abs_filename)
+
+
+class TestIdentifiers(TestCase):
+
+    def test_copy_without_identifiers(self):
+        machine_config = _create_machine_config(disk_id_type('0x12345678'), _OLD_UUID,
+                'c1b9d5a2f16211cf9ece0020afc76f16')
+
+        copied_config = machine_config.copy_without_identifiers()
+
+        self.assertIsNone(copied_config.disk_id)
+        self.assertIsNone(copied_config.first_partition_uuid)
+        self.assertIsNone(copied_config.machine_id)
+        self.assertEqual(copied_config.hostname, 'machine')
+        self.assertEqual(machine_config.first_partition_uuid, _OLD_UUID)
+
+    def test_random_identifiers_picked(self):
+        configs = [_create_machine_config() for _ in range(2)]
+        for machine_config in configs:
+            _create_customization(machine_config)._pick_identifiers()
+            self.assertIsNotNone(machine_config.disk_id)
+            self.assertIsNotNone(machine_config.first_partition_uuid)
+
+        self.assertNotEqual(configs[0].first_partition_uuid, configs[1].first_partition_uuid)
+        self.assertNotEqual(str(configs[0].disk_id), str(configs[1].disk_id))
+
+    def test_explicit_identifiers_kept(self):
+        disk_id = disk_id_type('0x12345678')
+        machine_config = _create_machine_config(disk_id, _OLD_UUID)
+
+        _create_customization(machine_config)._pick_identifiers()
+
+        self.assertIs(machine_config.disk_id, disk_id)
+        self.assertEqual(machine_config.first_partition_uuid, _OLD_UUID)
+
+
+class TestBootLoaderConfig(TestCase):
+
+    def _write(self, abs_mountpoint, path, content):
+        abs_filename = os.path.join(abs_mountpoint, path)
+        os.makedirs(os.path.dirname(abs_filename))
+        with open(abs_filename, 'w') as f:
+            f.write(content)
+        return abs_filename
+
+    def test_uuid_replaced(self):
+        with TemporaryDirectory() as abs_mountpoint:
+            abs_grub_cfg = self._write(abs_mountpoint, 'boot/grub/grub.cfg',
+                    'search --fs-uuid --set=root %s\n'
+                    'linux /boot/vmlinuz root=UUID=%s ro\n' % (_OLD_UUID, _OLD_UUID))
+            abs_extlinux_conf = self._write(abs_mountpoint, 'boot/extlinux/extlinux.conf',
+                    'APPEND root=UUID=%s\n' % _OLD_UUID)
+
+            customization = _create_customization(_create_machine_config(), abs_mountpoint)
+            customization._replace_first_partition_uuid_in_boot_loader_config(
+                    _OLD_UUID, _NEW_UUID)
+
+            with open(abs_grub_cfg) as f:
+                self.assertEqual(f.read(),
+                        'search --fs-uuid --set=root %s\n'
+                        'linux /boot/vmlinuz root=UUID=%s ro\n' % (_NEW_UUID, _NEW_UUID))
+            with open(abs_extlinux_conf) as f:
+                self.assertEqual(f.read(), 'APPEND root=UUID=%s\n' % _NEW_UUID)
+
+    def test_nothing_to_do(self):
+        customization = _create_customization(_create_machine_config(), '/nonexistent')
+        customization._executor = Mock()
+
+        customization._replace_first_partition_uuid_in_boot_loader_config(
+                _OLD_UUID, _OLD_UUID)
+        customization._replace_first_partition_uuid_in_boot_loader_config(
+                _OLD_UUID, _NEW_UUID)  # i.e. no boot loader config files
+
+        customization._executor.check_call.assert_not_called()
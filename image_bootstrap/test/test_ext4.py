@@ -0,0 +1,25 @@
+import subprocess
+from unittest import TestCase
+from unittest.mock import Mock
+
+from image_bootstrap.file_systems.ext4 import check_file_system
+
+
+class TestCheckFileSystem(TestCase):
+
+    def _check(self, returncode):
+        executor = Mock()
+        if returncode:
+            executor.check_call.side_effect = subprocess.CalledProcessError(
+                    returncode, ['e2fsck'])
+        check_file_system(Mock(), executor, '/dev/loop0p1')
+
+    def test_clean(self):
+        self._check(0)
+
+    def test_errors_corrected(self):
+        self._check(1)
+
+    def test_errors_left(self):
+        for returncode in (2, 4, 8):
+            self.assertRaises(subprocess.CalledProcessError, self._check, returncode)
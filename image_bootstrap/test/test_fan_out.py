@@ -0,0 +1,78 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import image_bootstrap.fan_out as fan_out
+from image_bootstrap.block_device import iter_data_extents
+from image_bootstrap.fan_out import copy_to_many
+
+
+class TestCopyToMany(TestCase):
+
+    def test_content_and_holes(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_source = os.path.join(abs_dir, 'source')
+            with open(abs_source, 'wb') as f:
+                f.write(b'\x55' * 1000)
+                f.seek(9 * 1024 * 1024)
+                f.write(b'\xaa' * 4097)  # i.e. unaligned tail
+            abs_targets = [os.path.join(abs_dir, 'target%d' % i) for i in range(3)]
+            with open(abs_targets[0], 'wb') as f:
+                f.write(b'\xff' * (10 * 1024 * 1024))  # i.e. stale content
+            for abs_target in abs_targets[1:]:
+                open(abs_target, 'wb').close()
+
+            copy_to_many(Mock(), abs_source, abs_targets)
+
+            with open(abs_source, 'rb') as f:
+                expected = f.read()
+            for abs_target in abs_targets:
+                with open(abs_target, 'rb') as f:
+                    self.assertEqual(f.read(), expected)
+
+    def test_large_holes_are_not_read(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_source = os.path.join(abs_dir, 'source')
+            with open(abs_source, 'wb') as f:
+                f.truncate(4 * 1024**3)
+                f.seek(2 * 1024**3)
+                f.write(b'\x55' * 4096)
+            abs_target = os.path.join(abs_dir, 'target')
+            open(abs_target, 'wb').close()
+
+            with open(abs_source, 'rb') as f:
+                if list(iter_data_extents(f.fileno(), 4 * 1024**3)) == [(0, 4 * 1024**3)]:
+                    self.skipTest('File system without SEEK_DATA/SEEK_HOLE support')
+
+            ranges_read = []
+            original_preadv = os.preadv
+
+            def preadv(fd, buffers, offset):
+                length = original_preadv(fd, buffers, offset)
+                ranges_read.append((offset, length))
+                return length
+
+            with patch.object(fan_out.os, 'preadv', preadv):
+                copy_to_many(Mock(), abs_source, [abs_target])
+
+            # i.e. nothing but the data in the middle (a block or so) was read
+            self.assertTrue(ranges_read)
+            for offset, length in ranges_read:
+                self.assertLessEqual(2 * 1024**3 - 64 * 1024, offset)
+                self.assertLessEqual(offset + length, 2 * 1024**3 + 64 * 1024)
+
+            with open(abs_target, 'rb') as f:
+                self.assertEqual(os.fstat(f.fileno()).st_size, 4 * 1024**3)
+                f.seek(2 * 1024**3 - 1)
+                self.assertEqual(f.read(4098), b'\0' + b'\x55' * 4096 + b'\0')
+
+    def test_missing_targets_not_created(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_source = os.path.join(abs_dir, 'source')
+            with open(abs_source, 'wb') as f:
+                f.write(b'\x55' * 4096)
+            abs_target = os.path.join(abs_dir, 'sdx')
+
+            self.assertRaises(FileNotFoundError, copy_to_many, Mock(), abs_source, [abs_target])
+            self.assertFalse(os.path.exists(abs_target))
@@ -0,0 +1,49 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock
+
+from image_bootstrap.journal import StepJournal
+
+
+class TestStepJournal(TestCase):
+
+    def test_round_trip(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'journals', 'target.json')
+
+            journal = StepJournal(Mock(), abs_filename, '/dev/null')
+            self.assertFalse(journal.load())
+            journal.mark_completed('one')
+            journal.mark_completed('two')
+
+            journal = StepJournal(Mock(), abs_filename, '/dev/null')
+            self.assertTrue(journal.load())
+            self.assertTrue(journal.is_completed('two'))
+            self.assertFalse(journal.is_completed('three'))
+
+            journal.remove()
+            self.assertFalse(os.path.exists(abs_filename))
+
+    def test_target_mismatch(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'target.json')
+            StepJournal(Mock(), abs_filename, '/dev/null').mark_completed('one')
+
+            journal = StepJournal(Mock(), abs_filename, '/dev/zero')
+            self.assertRaises(ValueError, journal.load)
+
+    def test_fingerprint_mismatch(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'target.json')
+            journal = StepJournal(Mock(), abs_filename, '/dev/null')
+            journal.set_fingerprint('debian-stretch')
+            journal.mark_completed('one')
+
+            journal = StepJournal(Mock(), abs_filename, '/dev/null')
+            journal.set_fingerprint('debian-stretch')
+            self.assertTrue(journal.load())
+
+            journal = StepJournal(Mock(), abs_filename, '/dev/null')
+            journal.set_fingerprint('arch')
+            self.assertRaises(ValueError, journal.load)
@@ -0,0 +1,70 @@
+import os
+import struct
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from image_bootstrap.mbr import (
+        create_single_partition_mbr, get_first_partition_layout,
+        get_first_partition_partuuid, resize_first_partition, set_disk_id,
+        write_single_partition_table)
+
+
+class TestSinglePartitionMbr(TestCase):
+
+    def test_layout(self):
+        mbr = create_single_partition_mbr(b'\x78\x56\x34\x12', 2048, 4096)
+
+        self.assertEqual(len(mbr), 512)
+        self.assertEqual(mbr[:440], bytes(440))
+        self.assertEqual(mbr[440:444], b'\x78\x56\x34\x12')
+        self.assertEqual(mbr[446], 0x80)  # boot flag
+        self.assertEqual(mbr[446 + 4], 0x83)  # Linux
+        self.assertEqual(struct.unpack('<II', mbr[446 + 8:446 + 16]), (2048, 4096))
+        self.assertEqual(mbr[462:510], bytes(48))  # no further partitions
+        self.assertEqual(mbr[510:], b'\x55\xaa')
+
+    def test_write_wipes_gpt_headers(self):
+        size_bytes = 8 * 1024 * 1024
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'disk')
+            with open(abs_filename, 'wb') as f:
+                f.write(b'\xff' * size_bytes)
+
+            fd = os.open(abs_filename, os.O_RDWR)
+            try:
+                write_single_partition_table(fd, bytes(4), size_bytes, 512)
+                self.assertEqual(get_first_partition_layout(fd),
+                        (2048, size_bytes // 512 - 2048))
+
+                resize_first_partition(fd, 4096)
+                self.assertEqual(get_first_partition_layout(fd), (2048, 4096))
+                resize_first_partition(fd, size_bytes // 512 - 2048)
+            finally:
+                os.close(fd)
+
+            with open(abs_filename, 'rb') as f:
+                content = f.read()
+
+        self.assertEqual(content[510:512], b'\x55\xaa')
+        self.assertEqual(struct.unpack('<II', content[446 + 8:446 + 16]),
+                (2048, size_bytes // 512 - 2048))
+        self.assertEqual(content[512:1024], bytes(512))
+        self.assertEqual(content[-512:], bytes(512))
+        self.assertEqual(content[1024:1025], b'\xff')
+
+    def test_set_disk_id(self):
+        size_bytes = 4 * 1024 * 1024
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'disk')
+            with open(abs_filename, 'wb') as f:
+                f.truncate(size_bytes)
+
+            fd = os.open(abs_filename, os.O_RDWR)
+            try:
+                write_single_partition_table(fd, bytes(4), size_bytes, 512)
+                set_disk_id(fd, b'\x78\x56\x34\x12')
+                self.assertEqual(get_first_partition_partuuid(fd), '12345678-01')
+                self.assertEqual(get_first_partition_layout(fd),
+                        (2048, size_bytes // 512 - 2048))
+            finally:
+                os.close(fd)
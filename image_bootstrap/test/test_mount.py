@@ -1,6 +1,28 @@
+from textwrap import dedent
 from unittest import TestCase
+from unittest.mock import Mock, patch
 
-from image_bootstrap.mount import MountFinder
+import image_bootstrap.mount as mount_module
+from image_bootstrap.mount import MountFinder, unmount_tree
+
+_MOUNTINFO = dedent("""\
+        21 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw
+        30 21 0:20 / /mnt rw shared:2 - ext4 /dev/loop0p1 rw
+        31 30 0:5 / /mnt/dev rw shared:3 - devtmpfs devtmpfs rw
+        32 31 0:21 / /mnt/dev/pts rw shared:4 - devpts devpts rw
+        33 30 0:22 / /mnt/proc rw shared:5 - proc proc rw
+        34 30 0:23 / /mnt/var/lib rw shared:6 - tmpfs tmpfs rw
+        35 30 0:24 / /mnt/var rw shared:7 - tmpfs tmpfs rw
+        36 35 0:25 / /mnt/var rw shared:8 - tmpfs tmpfs rw
+        37 21 0:26 / /mnt2 rw shared:9 - tmpfs tmpfs rw
+        38 21 0:27 / /media/with\\040space rw shared:10 - tmpfs tmpfs rw
+        """)
+
+
+def _create_finder(text=_MOUNTINFO):
+    finder = MountFinder()
+    finder._load_text(text)
+    return finder
 
 
 class TestMountInfoParser(TestCase):
@@ -12,9 +34,74 @@ class TestMountInfoParser(TestCase):
                 ('671 491 0:4 mnt:[4026532218] /run/snapd/ns/lxd.mnt rw - nsfs nsfs rw', '/run/snapd/ns/lxd.mnt'),
                 ):
             finder = MountFinder()
-            groupdict = finder._parse_line(mount_info_line)
-            assert groupdict['mount'] == expected_mount
+            entry = finder._parse_line(mount_info_line)
+            assert entry.mount_point == expected_mount
+
+    def test_ids(self):
+        entry = MountFinder._parse_line('314 20 0:3 net:[4026532205] /run/netns/a/ rw - nsfs nsfs rw')
+        self.assertEqual((entry.mount_id, entry.parent_id, entry.major, entry.minor),
+                         (314, 20, 0, 3))
+        self.assertEqual(entry.mount_point, '/run/netns/a')
 
     def test_loading(self):
         finder = MountFinder()
         finder.load()
+
+
+class TestMountFinder(TestCase):
+    def test_below(self):
+        finder = _create_finder()
+        self.assertEqual(list(finder.below('/mnt/')), [
+                '/mnt/dev', '/mnt/dev/pts', '/mnt/proc',
+                '/mnt/var', '/mnt/var', '/mnt/var/lib',
+                ])
+        self.assertEqual(list(finder.below('/mnt/dev', inclusive=True)),
+                         ['/mnt/dev', '/mnt/dev/pts'])
+        self.assertEqual(list(finder.below('/mnt/dev/pts')), [])
+        self.assertEqual(list(finder.below('/nowhere', inclusive=True)), [])
+        self.assertEqual(list(finder.below('/media')), ['/media/with space'])
+
+    def test_topmost(self):
+        finder = _create_finder()
+        self.assertEqual(
+                [entry.mount_id for entry in finder.get_topmost_mounts_below('/mnt')],
+                [31, 33, 35, 36])
+        self.assertEqual(
+                [entry.mount_id for entry in finder.get_topmost_mounts_below('/', inclusive=True)],
+                [21])
+
+    def test_teardown_order(self):
+        finder = _create_finder()
+        self.assertEqual(
+                [entry.mount_id for entry in finder.get_teardown_order('/mnt', inclusive=True)],
+                # NOTE: /mnt/var/lib (34) is hidden below /mnt/var (35, 36)
+                [36, 35, 34, 33, 32, 31, 30])
+
+
+class TestUnmountTree(TestCase):
+    def _unmount_tree(self, text_before, text_after, detach_error=None):
+        detach = Mock(side_effect=detach_error)
+        try_unmounting = Mock()
+        messenger = Mock()
+        with patch.object(mount_module, '_load_mounts',
+                          Mock(side_effect=[_create_finder(text_before),
+                                            _create_finder(text_after)])), \
+                patch.object(mount_module, 'detach', detach), \
+                patch.object(mount_module, 'try_unmounting', try_unmounting):
+            unmount_tree(messenger, None, '/mnt')
+        return messenger, detach, try_unmounting
+
+    def test_single_detach_per_subtree(self):
+        _, detach, try_unmounting = self._unmount_tree(_MOUNTINFO, '')
+        self.assertEqual([c[0][2] for c in detach.call_args_list],
+                         ['/mnt/dev', '/mnt/proc', '/mnt/var', '/mnt/var'])
+        try_unmounting.assert_not_called()
+
+    def test_fallback_for_leftovers(self):
+        messenger, _, try_unmounting = self._unmount_tree(
+                _MOUNTINFO, _MOUNTINFO, detach_error=OSError(16, 'busy'))
+        self.assertEqual(messenger.warn.call_count, 4)
+        self.assertEqual([c[0][2] for c in try_unmounting.call_args_list], [
+                '/mnt/var', '/mnt/var', '/mnt/var/lib',
+                '/mnt/proc', '/mnt/dev/pts', '/mnt/dev',
+                ])
@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock
+
+from directory_bootstrap.shared.namespace import unshare_current_process
+from image_bootstrap.parallel import run_engine_in_child_process
+
+
+class _PidNamespaceEngine(object):
+    """
+    Creates and closes a PID namespace the way BootstrapEngine.run does
+    """
+    def __init__(self, abs_status_filename):
+        self._abs_status_filename = abs_status_filename
+
+    def run(self):
+        try:
+            pid_namespace = unshare_current_process(Mock(), pid_namespace=True)
+        except OSError:
+            pid_namespace = None
+
+        with open(self._abs_status_filename, 'w') as f:
+            f.write('unshared' if pid_namespace else 'skipped')
+
+        if pid_namespace is not None:
+            subprocess.check_call(['true'])
+            pid_namespace.kill_all_processes()
+            pid_namespace.close()
+
+
+class TestRunEngineInChildProcess(TestCase):
+
+    def test_forking_after_pid_namespace_closed(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_status_filename = os.path.join(abs_dir, 'status')
+            run_engine_in_child_process(Mock(), Mock(debug=False), '/dev/null',
+                    _PidNamespaceEngine(abs_status_filename))
+            with open(abs_status_filename) as f:
+                status = f.read()
+
+        # i.e. neither running commands nor forking further engines fails with ENOMEM
+        subprocess.check_call(['true'])
+        process = multiprocessing.get_context('fork').Process(target=os.getpid)
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        if status != 'unshared':
+            self.skipTest('Unsharing namespaces not permitted')
+
+    def test_failure_raises(self):
+        engine = Mock()
+        engine.run.side_effect = ValueError('failing on purpose')
+        self.assertRaises(ValueError, run_engine_in_child_process,
+                Mock(), Mock(debug=False), '/dev/null', engine)
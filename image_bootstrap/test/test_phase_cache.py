@@ -0,0 +1,161 @@
+import os
+import stat
+import subprocess
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import Mock
+
+from directory_bootstrap.shared.executor import Executor
+from image_bootstrap.engine import BOOTLOADER__NONE, BootstrapEngine, MachineConfig
+from image_bootstrap.phase_cache import (
+        PHASE__BASE, PHASE__KERNEL, PHASE__PACKAGES, PHASES, PhaseCache,
+        compute_phase_keys, digest_directory)
+
+
+class TestPhaseKeys(TestCase):
+
+    def test_change_affects_later_phases_only(self):
+        before = compute_phase_keys([
+                ('one', {'a': 1}),
+                ('two', {'b': 2}),
+                ('three', {'c': 3}),
+                ])
+        after = compute_phase_keys([
+                ('one', {'a': 1}),
+                ('two', {'b': 20}),
+                ('three', {'c': 3}),
+                ])
+        self.assertEqual(before[0], after[0])
+        self.assertNotEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
+
+    def test_key_order_irrelevant(self):
+        self.assertEqual(
+                compute_phase_keys([('one', {'a': 1, 'b': 2})]),
+                compute_phase_keys([('one', {'b': 2, 'a': 1})]))
+
+
+class TestDigestDirectory(TestCase):
+
+    def test_none(self):
+        self.assertIsNone(digest_directory(None))
+
+    def test_content_and_mode_changes(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_script = os.path.join(abs_dir, '10-hello')
+            with open(abs_script, 'w') as f:
+                f.write('#! /bin/sh\n')
+            os.chmod(abs_script, 0o644)
+            digest_original = digest_directory(abs_dir)
+
+            os.chmod(abs_script, 0o755)
+            digest_mode_changed = digest_directory(abs_dir)
+            self.assertNotEqual(digest_original, digest_mode_changed)
+
+            with open(abs_script, 'a') as f:
+                f.write('echo hello\n')
+            self.assertNotEqual(digest_mode_changed, digest_directory(abs_dir))
+
+
+def _create_phase_cache(abs_cache_dir):
+    executor = Executor(Mock(), stdout=subprocess.DEVNULL)
+    return PhaseCache(Mock(), executor, abs_cache_dir)
+
+
+class TestPhaseCache(TestCase):
+
+    def test_store_restore_round_trip(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_mountpoint = os.path.join(abs_dir, 'before')
+            os.makedirs(os.path.join(abs_mountpoint, 'etc'))
+            with open(os.path.join(abs_mountpoint, 'etc', 'hostname'), 'w') as f:
+                f.write('machine\n')
+            os.chmod(os.path.join(abs_mountpoint, 'etc', 'hostname'), 0o600)
+
+            phase_cache = _create_phase_cache(os.path.join(abs_dir, 'cache'))
+            phase_cache.ensure_directory_writable()
+            keys = compute_phase_keys([(PHASE__BASE, {}), (PHASE__KERNEL, {})])
+            self.assertIsNone(phase_cache.find_latest(keys))
+
+            phase_cache.store(PHASE__BASE, keys[0], abs_mountpoint, {'first_partition_uuid': 'abc'})
+            self.assertTrue(phase_cache.contains(keys[0]))
+            self.assertFalse(phase_cache.contains(keys[1]))
+            self.assertEqual(phase_cache.find_latest(keys), 0)
+            self.assertEqual(sorted(os.listdir(os.path.join(abs_dir, 'cache'))),
+                             [keys[0] + '.json', keys[0] + '.tar'])  # i.e. no leftovers
+
+            abs_restored = os.path.join(abs_dir, 'after')
+            os.mkdir(abs_restored)
+            metadata = phase_cache.restore(PHASE__BASE, keys[0], abs_restored)
+            self.assertEqual(metadata, {'first_partition_uuid': 'abc', 'phase': PHASE__BASE})
+            abs_hostname = os.path.join(abs_restored, 'etc', 'hostname')
+            with open(abs_hostname) as f:
+                self.assertEqual(f.read(), 'machine\n')
+            self.assertEqual(stat.S_IMODE(os.stat(abs_hostname).st_mode), 0o600)
+
+
+class TestEngineRestore(TestCase):
+
+    @staticmethod
+    def _create_engine(abs_phase_cache_dir, abs_mountpoint, hostname='machine',
+            root_password=None):
+        machine_config = MachineConfig(hostname, 'amd64', root_password, None,
+                '/etc/resolv.conf', None, 'abc', None, BOOTLOADER__NONE, False, False)
+        engine = BootstrapEngine(Mock(), Executor(Mock(), stdout=subprocess.DEVNULL),
+                machine_config, None, None, None, '/dev/null', None,
+                abs_phase_cache_dir=abs_phase_cache_dir)
+        distro = Mock()
+        distro.get_phase_cache_inputs.return_value = {'release': 'stable'}
+        engine.set_distro(distro)
+        engine._abs_mountpoint = abs_mountpoint
+        engine._prepare_phase_cache()
+        return engine
+
+    def test_restore_across_hostnames_and_passwords(self):
+        with TemporaryDirectory() as abs_dir:
+            abs_phase_cache_dir = os.path.join(abs_dir, 'cache')
+            abs_mountpoint = os.path.join(abs_dir, 'one')
+            os.makedirs(os.path.join(abs_mountpoint, 'boot'))
+            with open(os.path.join(abs_mountpoint, 'boot', 'vmlinuz'), 'w') as f:
+                f.write('kernel')
+
+            engine = self._create_engine(abs_phase_cache_dir, abs_mountpoint)
+            engine._restore_latest_phase_snapshot()
+            self.assertTrue(engine._phase_needs_running(PHASE__BASE))
+            engine._store_phase_snapshot(PHASE__BASE)
+            engine._store_phase_snapshot(PHASE__KERNEL)
+
+            abs_mountpoint = os.path.join(abs_dir, 'two')
+            os.mkdir(abs_mountpoint)
+            engine = self._create_engine(abs_phase_cache_dir, abs_mountpoint,
+                    hostname='other', root_password='secret')
+            engine._restore_latest_phase_snapshot()
+
+            self.assertFalse(engine._phase_needs_running(PHASE__BASE))
+            self.assertFalse(engine._phase_needs_running(PHASE__KERNEL))
+            self.assertTrue(engine._phase_needs_running(PHASE__PACKAGES))
+            self.assertEqual(engine._snapshot_first_partition_uuid, 'abc')
+            self.assertTrue(os.path.exists(os.path.join(abs_mountpoint, 'boot', 'vmlinuz')))
+
+    def test_openstack_invalidates_later_phases(self):
+        with TemporaryDirectory() as abs_dir:
+            engine = self._create_engine(os.path.join(abs_dir, 'cache'), abs_dir)
+            keys_before = engine._phase_keys
+            engine._config.with_openstack = True
+            engine._prepare_phase_cache()
+            keys_after = engine._phase_keys
+
+        index = PHASES.index(PHASE__PACKAGES)
+        self.assertEqual(keys_before[:index], keys_after[:index])
+        self.assertNotEqual(keys_before[index], keys_after[index])
+
+    def test_journal_fingerprint(self):
+        with TemporaryDirectory() as abs_dir:
+            engine = self._create_engine(os.path.join(abs_dir, 'cache'), abs_dir)
+            fingerprint = engine._compute_journal_fingerprint()
+            self.assertEqual(engine._compute_journal_fingerprint(), fingerprint)
+
+            for attribute, value in (('hostname', 'other'), ('root_password', 'secret')):
+                engine = self._create_engine(os.path.join(abs_dir, 'cache'), abs_dir,
+                        **{attribute: value})
+                self.assertNotEqual(engine._compute_journal_fingerprint(), fingerprint)
@@ -0,0 +1,57 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import threading
+from unittest import TestCase
+
+from image_bootstrap.steps import StepGraph, run_step_graph
+
+
+class TestRunStepGraph(TestCase):
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._events = []
+
+    def _run_step(self, step_name, func):
+        with self._lock:
+            self._events.append(('start', step_name))
+        func()
+        with self._lock:
+            self._events.append(('end', step_name))
+
+    def test_independent_steps_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+        graph = StepGraph()
+        graph.add('a', barrier.wait)
+        graph.add('b', barrier.wait)
+        graph.add('c', lambda: None, after=['a', 'b'])
+
+        run_step_graph(graph, self._run_step)
+
+        self.assertEqual(self._events[-2:], [('start', 'c'), ('end', 'c')])
+
+    def test_resources_are_exclusive(self):
+        graph = StepGraph()
+        for name in ('a', 'b', 'c'):
+            graph.add(name, lambda: None, resources=['package-manager'])
+
+        run_step_graph(graph, self._run_step)
+
+        self.assertEqual(self._events, [
+                ('start', 'a'), ('end', 'a'),
+                ('start', 'b'), ('end', 'b'),
+                ('start', 'c'), ('end', 'c'),
+                ])
+
+    def test_no_new_steps_after_failure(self):
+        def fail():
+            raise ValueError('failed')
+
+        graph = StepGraph()
+        graph.add('a', fail)
+        graph.add('b', lambda: None, after=['a'])
+
+        with self.assertRaises(ValueError):
+            run_step_graph(graph, self._run_step)
+
+        self.assertEqual(self._events, [('start', 'a')])
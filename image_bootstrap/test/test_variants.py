@@ -0,0 +1,60 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from image_bootstrap.engine import MachineConfig
+from image_bootstrap.variants import load_variants
+
+
+class TestLoadVariants(TestCase):
+
+    def _load(self, content):
+        with TemporaryDirectory() as abs_dir:
+            abs_filename = os.path.join(abs_dir, 'variants.yml')
+            with open(abs_filename, 'w') as f:
+                f.write(content)
+            return abs_dir, load_variants(abs_filename)
+
+    def test_relative_paths(self):
+        abs_dir, variants = self._load(
+                '- target: /dev/vg/lv2\n'
+                '  scripts-chroot: scripts/\n')
+        self.assertEqual(len(variants), 1)
+        self.assertEqual(variants[0].abs_target_path, '/dev/vg/lv2')
+        self.assertEqual(variants[0].abs_scripts_dir_chroot,
+                os.path.join(abs_dir, 'scripts/'))
+        self.assertIsNone(variants[0].abs_scripts_dir_pre)
+
+    def test_output(self):
+        abs_dir, variants = self._load(
+                '- target: /dev/vg/lv2\n'
+                '  output: lv2.qcow2\n'
+                '- target: /dev/vg/lv3\n')
+        self.assertEqual(variants[0].abs_output_path, os.path.join(abs_dir, 'lv2.qcow2'))
+        self.assertEqual(variants[0].get_output_format(), 'qcow2')
+        self.assertIsNone(variants[1].abs_output_path)
+        self.assertIsNone(variants[1].get_output_format())
+
+    def test_target_missing(self):
+        with self.assertRaises(ValueError):
+            self._load('- hostname: other\n')
+
+    def test_unknown_key(self):
+        with self.assertRaises(ValueError):
+            self._load('- target: /dev/vg/lv2\n  color: blue\n')
+
+    def test_apply_to(self):
+        _, variants = self._load(
+                '- target: /dev/vg/lv2\n'
+                '  hostname: other\n'
+                '  openstack: true\n')
+        machine_config = MachineConfig('machine', 'amd64', None, None,
+                '/etc/resolv.conf', '0x12345678', None, None, 'auto', False, False)
+
+        variant_config = variants[0].apply_to(machine_config)
+
+        self.assertEqual(variant_config.hostname, 'other')
+        self.assertTrue(variant_config.with_openstack)
+        self.assertIsNone(variant_config.disk_id)
+        self.assertEqual(machine_config.hostname, 'machine')
+        self.assertEqual(machine_config.disk_id, '0x12345678')
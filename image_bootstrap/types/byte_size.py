@@ -0,0 +1,35 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import re
+
+_BYTE_SIZE_PATTERN = '^([1-9][0-9]*)([KMGTkmgt]?)$'
+_BYTE_SIZE_MATCHER = re.compile(_BYTE_SIZE_PATTERN)
+
+_FACTOR_OF_UNIT = {
+        '': 1,
+        'K': 1024,
+        'M': 1024**2,
+        'G': 1024**3,
+        'T': 1024**4,
+        }
+
+
+def byte_size_type(text):
+    """
+    Meant to be used as an argparse type
+
+    >>> byte_size_type('3G')
+    3221225472
+    >>> byte_size_type('3g')
+    3221225472
+    >>> byte_size_type('512')
+    512
+    """
+    match = _BYTE_SIZE_MATCHER.match(text)
+    if not match:
+        raise ValueError('"%s" does not match pattern "%s"' % (text, _BYTE_SIZE_PATTERN))
+    return int(match.group(1)) * _FACTOR_OF_UNIT[match.group(2).upper()]
+
+
+byte_size_type.__name__ = 'byte size'
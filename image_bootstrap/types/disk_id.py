@@ -1,6 +1,7 @@
 # Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
 # Licensed under AGPL v3 or later
 
+import os
 import re
 
 _DISK_ID_PATTERN = '^0x[0-9a-fA-F]{1,8}$'
@@ -19,10 +20,21 @@ class DiskIdentifier(object):
         self._number = number
 
     def __str__(self):
-        return '0x%8x' % self._number
+        return '0x%08x' % self._number
 
     def byte_sequence(self):
-        return ''.join([chr((self._number >> i * 8) & 255) for i in range(4)])
+        """
+        >>> DiskIdentifier(0x12345678).byte_sequence()
+        b'xV4\\x12'
+        """
+        return bytes((self._number >> i * 8) & 255 for i in range(4))
+
+    @classmethod
+    def random(clazz):
+        number = 0
+        while not number:
+            number = int.from_bytes(os.urandom(4), 'little')
+        return clazz(number)
 
 
 def disk_id_type(text):
@@ -0,0 +1,98 @@
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+
+import os
+
+import image_bootstrap.loaders._yaml as yaml
+from image_bootstrap.output import guess_output_format
+
+_VARIANT_KEY_TARGET = 'target'
+
+_ALLOWED_VARIANT_KEYS = (
+        'hostname',
+        'openstack',
+        'output',
+        'scripts-chroot',
+        'scripts-post',
+        'scripts-pre',
+        _VARIANT_KEY_TARGET,
+        )
+
+
+class Variant(object):
+    def __init__(self, abs_target_path, hostname=None, with_openstack=None,
+            abs_scripts_dir_pre=None, abs_scripts_dir_chroot=None,
+            abs_scripts_dir_post=None, abs_output_path=None):
+        self.abs_target_path = abs_target_path
+        self.hostname = hostname
+        self.with_openstack = with_openstack
+        self.abs_scripts_dir_pre = abs_scripts_dir_pre
+        self.abs_scripts_dir_chroot = abs_scripts_dir_chroot
+        self.abs_scripts_dir_post = abs_scripts_dir_post
+        self.abs_output_path = abs_output_path
+
+    def get_output_format(self):
+        if self.abs_output_path is None:
+            return None
+        return guess_output_format(self.abs_output_path)
+
+    def apply_to(self, machine_config):
+        machine_config = machine_config.copy_without_identifiers()
+        if self.hostname is not None:
+            machine_config.hostname = self.hostname
+        if self.with_openstack is not None:
+            machine_config.with_openstack = self.with_openstack
+        return machine_config
+
+
+def _parse_variant(d, abs_base_dir):
+    if not isinstance(d, dict):
+        raise ValueError('Variant %r is not a mapping' % (d,))
+
+    for key in d:
+        if key not in _ALLOWED_VARIANT_KEYS:
+            raise ValueError('Variant key "%s" not supported, pick from: %s'
+                    % (key, ', '.join(_ALLOWED_VARIANT_KEYS)))
+
+    if _VARIANT_KEY_TARGET not in d:
+        raise ValueError('Variant %r lacks key "%s"' % (d, _VARIANT_KEY_TARGET))
+
+    def abs_path_or_none(key):
+        path = d.get(key)
+        return path and os.path.join(abs_base_dir, path)
+
+    with_openstack = d.get('openstack')
+    if with_openstack is not None and not isinstance(with_openstack, bool):
+        raise ValueError('Variant key "openstack" needs a boolean value')
+
+    return Variant(
+            abs_path_or_none(_VARIANT_KEY_TARGET),
+            hostname=d.get('hostname'),
+            with_openstack=with_openstack,
+            abs_scripts_dir_pre=abs_path_or_none('scripts-pre'),
+            abs_scripts_dir_chroot=abs_path_or_none('scripts-chroot'),
+            abs_scripts_dir_post=abs_path_or_none('scripts-post'),
+            abs_output_path=abs_path_or_none('output'),
+            )
+
+
+def load_variants(abs_filename):
+    """
+    Load variants from a YAML file like:
+
+        - target: /dev/vg/lv2
+          hostname: other
+          openstack: true
+          scripts-chroot: scripts/other/
+          output: other.qcow2
+
+    Relative paths are relative to the directory of the file.
+    """
+    with open(abs_filename) as f:
+        data = yaml.safe_load(f.read())
+
+    if not isinstance(data, list):
+        raise ValueError('File "%s" does not contain a list of variants' % abs_filename)
+
+    abs_base_dir = os.path.dirname(abs_filename)
+    return [_parse_variant(d, abs_base_dir) for d in data]
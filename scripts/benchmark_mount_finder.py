@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+# Copyright (C) 2015 Sebastian Pipping <sebastian@pipping.org>
+# Licensed under AGPL v3 or later
+#
+# Benchmarks MountFinder on synthetic mountinfo files the size of those
+# of CI hosts with thousands of container mounts, against a linear scan
+# over all mount points (which is how MountFinder used to work).
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_bootstrap.mount import MountFinder  # noqa: E402
+
+_BUILD_MOUNTPOINT = '/mnt/tmp-image-bootstrap'
+
+
+def _write_synthetic_mountinfo(f, count_mounts):
+    print('21 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw', file=f)
+    mount_id = 22
+    for i in range(count_mounts):
+        if i % 2:
+            mount_point = '/var/lib/docker/overlay2/%064x/merged' % i
+            print('%d 21 0:%d / %s rw,relatime shared:%d - overlay overlay rw'
+                    % (mount_id, i % 256, mount_point, mount_id), file=f)
+        else:
+            mount_point = '/run/docker/netns/%012x' % i
+            print('%d 21 0:4 net:[%d] %s rw shared:%d - nsfs nsfs rw'
+                    % (mount_id, 4026530000 + i, mount_point, mount_id), file=f)
+        mount_id += 1
+
+    build_mount_id = mount_id
+    print('%d 21 7:1 / %s rw - ext4 /dev/loop0p1 rw' % (build_mount_id, _BUILD_MOUNTPOINT), file=f)
+    for target in ('dev', 'dev/pts', 'dev/shm', 'proc', 'sys'):
+        mount_id += 1
+        print('%d %d 0:%d / %s/%s rw - tmpfs tmpfs rw'
+                % (mount_id, build_mount_id, mount_id % 256, _BUILD_MOUNTPOINT, target), file=f)
+
+
+def _linear_below(mount_points, abs_path):
+    prefix = os.path.join(os.path.normpath(abs_path), '')
+    for abs_candidate in mount_points:
+        normed_candidate = os.path.join(os.path.normpath(abs_candidate), '')
+        if normed_candidate.startswith(prefix) and normed_candidate != prefix:
+            yield os.path.normpath(normed_candidate)
+
+
+def _seconds_per_call(func, count_calls):
+    before = time.perf_counter()
+    for _ in range(count_calls):
+        func()
+    return (time.perf_counter() - before) / count_calls
+
+
+def _benchmark(count_mounts, count_queries):
+    with tempfile.NamedTemporaryFile('w', suffix='.mountinfo') as f:
+        _write_synthetic_mountinfo(f, count_mounts)
+        f.flush()
+
+        def load():
+            finder = MountFinder()
+            finder.load(f.name)
+            return finder
+
+        load_seconds = _seconds_per_call(load, 3)
+        finder = load()
+
+    mount_points = [entry.mount_point for entry in finder.get_mounts_below('/', inclusive=True)]
+
+    expected = sorted(_linear_below(mount_points, _BUILD_MOUNTPOINT))
+    assert sorted(finder.below(_BUILD_MOUNTPOINT)) == expected
+
+    trie_seconds = _seconds_per_call(
+            lambda: list(finder.below(_BUILD_MOUNTPOINT)), count_queries)
+    teardown_seconds = _seconds_per_call(
+            lambda: finder.get_teardown_order(_BUILD_MOUNTPOINT), count_queries)
+    linear_seconds = _seconds_per_call(
+            lambda: list(_linear_below(mount_points, _BUILD_MOUNTPOINT)), count_queries)
+
+    print('%8d mounts: load %8.2f ms, below %8.3f ms (linear scan %8.3f ms, %6.0fx), '
+            'teardown order %8.3f ms' % (
+            count_mounts,
+            load_seconds * 1000,
+            trie_seconds * 1000,
+            linear_seconds * 1000,
+            linear_seconds / trie_seconds,
+            teardown_seconds * 1000,
+            ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MountFinder on synthetic mountinfo files')
+    parser.add_argument('--mounts', metavar='COUNT', type=int, nargs='+',
+            default=[1000, 10000, 100000],
+            help='numbers of mounts to benchmark with (default: %(default)s)')
+    parser.add_argument('--queries', metavar='COUNT', type=int, default=100,
+            help='number of queries per measurement (default: %(default)s)')
+    options = parser.parse_args()
+
+    for count_mounts in options.mounts:
+        _benchmark(count_mounts, options.queries)
+
+
+if __name__ == '__main__':
+    main()